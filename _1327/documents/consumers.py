@@ -1,23 +1,210 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from urllib.parse import parse_qs
 
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+from django.utils import translation
 
-class PreviewConsumer(WebsocketConsumer):
+from _1327.documents.models import Document
+from _1327.documents.utils import merge_preview_patches, preview_group_name, preview_patch, reset_preview_blocks, TEXT_LANGUAGES
+from _1327.main.utils import convert_markdown_blocks
+from _1327.user_management.shortcuts import check_permissions
 
-	def connect(self):
-		self.group_name = self.scope['url_route']['kwargs']['hash_value']
-		async_to_sync(self.channel_layer.group_add)(
+
+logger = logging.getLogger(__name__)
+
+preview_render_executor = ThreadPoolExecutor(max_workers=settings.PREVIEW_RENDER_THREADS)
+
+# counters of the preview connections and messages of this process, they are only written to the log
+preview_metrics = Counter()
+
+
+# the texts waiting to be rendered by language, the task rendering them and the number of connected editors, per
+# document. The editors of a document share them, so that each text is rendered only once for all of them.
+pending_texts = {}
+render_tasks = {}
+editor_connections = Counter()
+
+
+def editor_group_name(hash_value):
+	return 'editor.{}'.format(hash_value)
+
+
+def render_preview(hash_value, text, language):
+	# runs in the threads of preview_render_executor, which have to clean up their database connections themselves
+	close_old_connections()
+	try:
+		with translation.override(language):
+			rendered_blocks = convert_markdown_blocks(text)
+		return '\n'.join(html for __, html in rendered_blocks), preview_patch(hash_value, language, rendered_blocks)
+	finally:
+		close_old_connections()
+
+
+async def render_pending_texts(channel_layer, hash_value):
+	loop = asyncio.get_event_loop()
+	texts = pending_texts[hash_value]
+	while texts:
+		language, text = texts.popitem()
+		html, patch = await loop.run_in_executor(preview_render_executor, render_preview, hash_value, text, language)
+		await channel_layer.group_send(
+			editor_group_name(hash_value),
+			{
+				'type': 'send_rendered_text',
+				'message': json.dumps({'language': language, 'text': html}),
+			}
+		)
+		await channel_layer.group_send(
+			preview_group_name(hash_value, language),
+			{
+				'type': 'update_preview',
+				'message': json.dumps(patch),
+			}
+		)
+	del pending_texts[hash_value]
+
+
+class PreviewConsumer(AsyncWebsocketConsumer):
+	"""
+		Sends the previews of a document to a client. Sending only queues a preview, so after each preview the consumer
+		waits PREVIEW_INTERVAL seconds and combines the previews arriving meanwhile into a single pending one. This way a
+		client receives the newest state instead of a growing backlog.
+	"""
+
+	async def connect(self):
+		self.hash_value = self.scope['url_route']['kwargs']['hash_value']
+		self.language = self.get_language()
+		self.group_name = preview_group_name(self.hash_value, self.language)
+		self.pending_patch = None
+		self.send_task = None
+		await self.channel_layer.group_add(
+			self.group_name,
+			self.channel_name,
+		)
+
+		# the page of this client was rendered from the saved text, so the next preview has to contain all blocks
+		await sync_to_async(reset_preview_blocks)(self.hash_value, self.language)
+		await self.accept()
+		preview_metrics['connections'] += 1
+		preview_metrics['open_connections'] += 1
+
+	def get_language(self):
+		# the preview page passes the language of the text it shows
+		language = parse_qs(self.scope.get('query_string', b'').decode()).get('language', [None])[0]
+		if language in TEXT_LANGUAGES:
+			return language
+		return settings.LANGUAGE_CODE.split('-')[0]
+
+	async def disconnect(self, code):
+		await self.channel_layer.group_discard(
+			self.group_name,
+			self.channel_name,
+		)
+		if self.send_task is not None:
+			self.send_task.cancel()
+
+		preview_metrics['open_connections'] -= 1
+		logger.info(
+			'Preview client disconnected, %d open connections, %d previews sent, %d previews dropped',
+			preview_metrics['open_connections'], preview_metrics['previews_sent'], preview_metrics['previews_dropped'],
+		)
+
+	async def update_preview(self, event):
+		try:
+			patch = json.loads(event['message'])
+		except (KeyError, ValueError):
+			logger.warning('Ignoring malformed preview of document %s', self.hash_value)
+			return
+		preview_metrics['previews_received'] += 1
+		if self.pending_patch is not None:
+			patch = merge_preview_patches(self.pending_patch, patch)
+			preview_metrics['previews_dropped'] += 1
+		self.pending_patch = patch
+
+		if self.send_task is None or self.send_task.done():
+			self.send_task = asyncio.ensure_future(self.send_pending_patches())
+
+	async def send_pending_patches(self):
+		while self.pending_patch is not None:
+			patch, self.pending_patch = self.pending_patch, None
+			await self.send(text_data=json.dumps(patch))
+			preview_metrics['previews_sent'] += 1
+			await asyncio.sleep(settings.PREVIEW_INTERVAL)
+
+
+class EditorConsumer(AsyncWebsocketConsumer):
+	"""
+		Renders the texts sent by the editors of a document. The rendered text is sent back to all editors of the
+		document and the changed blocks are sent to the clients of the live preview of its language. Texts arriving
+		while a text of the document is rendered replace each other, so that only the latest text of each language is
+		rendered next, no matter which editor sent it.
+	"""
+
+	async def connect(self):
+		self.hash_value = self.scope['url_route']['kwargs']['hash_value']
+		self.group_name = editor_group_name(self.hash_value)
+		self.joined = False
+
+		if not await database_sync_to_async(self.has_permissions)():
+			await self.close()
+			return
+		await self.channel_layer.group_add(
 			self.group_name,
 			self.channel_name,
 		)
+		editor_connections[self.hash_value] += 1
+		self.joined = True
+		await self.accept()
 
-		self.accept()
+	def has_permissions(self):
+		try:
+			document = Document.objects.get(hash_value=self.hash_value)
+		except Document.DoesNotExist:
+			return False
+		if document.has_perms():
+			try:
+				check_permissions(document, self.scope['user'], [document.view_permission_name, document.edit_permission_name])
+			except PermissionDenied:
+				return False
+		return True
 
-	def disconnect(self, messsage, **kwargs):
-		async_to_sync(self.channel_layer.group_discard)(
+	async def disconnect(self, code):
+		if not self.joined:
+			return
+		await self.channel_layer.group_discard(
 			self.group_name,
 			self.channel_name,
 		)
+		editor_connections[self.hash_value] -= 1
+		if editor_connections[self.hash_value] == 0:
+			del editor_connections[self.hash_value]
+			render_task = render_tasks.pop(self.hash_value, None)
+			if render_task is not None:
+				render_task.cancel()
+			pending_texts.pop(self.hash_value, None)
+
+	async def receive(self, text_data=None, bytes_data=None):
+		try:
+			data = json.loads(text_data)
+			language, text = data['language'], data['text']
+		except (KeyError, TypeError, ValueError):
+			language = None
+		if language not in TEXT_LANGUAGES:
+			logger.warning('Ignoring malformed message of the editor of document %s', self.hash_value)
+			return
+
+		pending_texts.setdefault(self.hash_value, {})[language] = text
+		render_task = render_tasks.get(self.hash_value)
+		if render_task is None or render_task.done():
+			render_tasks[self.hash_value] = asyncio.ensure_future(render_pending_texts(self.channel_layer, self.hash_value))
 
-	def update_preview(self, event):
-		self.send(text_data=event['message'])
+	async def send_rendered_text(self, event):
+		await self.send(text_data=event['message'])
@@ -0,0 +1,171 @@
+from difflib import SequenceMatcher
+import json
+
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import Deserializer as JSONDeserializer, Serializer  # noqa
+from django.db import transaction
+from reversion.models import Version
+
+
+FORMAT = 'delta_json'
+
+
+def diff_text(base_text, text):
+	"""
+		Returns the operations that turn the base text into the text. Each operation is either a [start, end] range of
+		lines to copy from the base text or a string to insert.
+	"""
+	base_lines, lines = base_text.splitlines(keepends=True), text.splitlines(keepends=True)
+	operations = []
+	for tag, base_start, base_end, start, end in SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+		if tag == 'equal':
+			operations.append([base_start, base_end])
+		elif tag != 'delete':
+			operations.append(''.join(lines[start:end]))
+	return operations
+
+
+def patch_text(base_text, operations):
+	base_lines = base_text.splitlines(keepends=True)
+	return ''.join(
+		''.join(base_lines[operation[0]:operation[1]]) if isinstance(operation, list) else operation
+		for operation in operations
+	)
+
+
+def create_delta(snapshot_id, snapshot_fields, serialized_object):
+	fields, deltas = {}, {}
+	for name, value in serialized_object['fields'].items():
+		snapshot_value = snapshot_fields.get(name)
+		if value == snapshot_value:
+			continue
+		if isinstance(value, str) and isinstance(snapshot_value, str):
+			deltas[name] = diff_text(snapshot_value, value)
+		else:
+			fields[name] = value
+	return {
+		'model': serialized_object['model'],
+		'pk': serialized_object['pk'],
+		'snapshot': snapshot_id,
+		'fields': fields,
+		'deltas': deltas,
+	}
+
+
+def apply_delta(snapshot_fields, delta):
+	fields = dict(snapshot_fields)
+	fields.update(delta['fields'])
+	for name, operations in delta['deltas'].items():
+		fields[name] = patch_text(snapshot_fields[name], operations)
+	return fields
+
+
+def reconstruct(delta, versions=None):
+	"""
+		Returns the object of a delta in the structure of the JSON serialization format. The full snapshot the delta
+		refers to is taken from versions, a dict of version ids to their format and serialized data, or loaded.
+	"""
+	if versions is not None and delta['snapshot'] in versions:
+		format, serialized_data = versions[delta['snapshot']]
+	else:
+		snapshot = Version.objects.filter(pk=delta['snapshot']).values_list('format', 'serialized_data').first()
+		if snapshot is None:
+			raise DeserializationError('The snapshot {} of a delta does not exist.'.format(delta['snapshot']))
+		format, serialized_data = snapshot
+	if format == FORMAT:
+		raise DeserializationError('The snapshot {} of a delta is a delta itself.'.format(delta['snapshot']))
+
+	serialized_object = json.loads(serialized_data)[0]
+	return {'model': serialized_object['model'], 'pk': serialized_object['pk'], 'fields': apply_delta(serialized_object['fields'], delta)}
+
+
+def load(format, serialized_data, versions=None):
+	"""
+		Returns the object of a version in the structure of the JSON serialization format.
+	"""
+	data = json.loads(serialized_data)
+	if format == FORMAT:
+		return reconstruct(data, versions)
+	return data[0]
+
+
+def dump(serialized_object, snapshot_id, snapshot_object, num_deltas, snapshot_interval):
+	"""
+		Returns the format and the serialized data a version is stored with, given the last full snapshot of the object
+		and the number of deltas referring to it. A full snapshot is stored after every snapshot_interval versions and
+		whenever the delta would not be smaller.
+	"""
+	snapshot = json.dumps([serialized_object])
+	if snapshot_interval is None or snapshot_object is None or num_deltas + 1 >= snapshot_interval:
+		return 'json', snapshot
+	delta = json.dumps(create_delta(snapshot_id, snapshot_object['fields'], serialized_object))
+	if len(delta) >= len(snapshot):
+		return 'json', snapshot
+	return FORMAT, delta
+
+
+def store_as_delta(version, snapshot_interval):
+	"""
+		Replaces a version that was just saved as a full snapshot by its changes to the last full snapshot of the same
+		object. Every delta refers to the last full snapshot before it, so a version is kept as a full snapshot once
+		later versions exist.
+	"""
+	versions = Version.objects.filter(content_type_id=version.content_type_id, object_id=version.object_id)
+	with transaction.atomic():
+		# the lock keeps the snapshot from being deleted before the delta referring to it is stored
+		snapshot = versions.select_for_update().filter(format='json', pk__lt=version.pk).order_by('-pk').first()
+		if snapshot is None:
+			return
+		later_ids = list(versions.filter(pk__gt=snapshot.pk).exclude(pk=version.pk).values_list('pk', flat=True))
+		if any(version_id > version.pk for version_id in later_ids):
+			return
+
+		serialized_object = json.loads(version.serialized_data)[0]
+		format, serialized_data = dump(serialized_object, snapshot.pk, json.loads(snapshot.serialized_data)[0], len(later_ids), snapshot_interval)
+		if format == FORMAT:
+			versions.filter(pk=version.pk, format='json').update(format=format, serialized_data=serialized_data)
+			version.format, version.serialized_data = format, serialized_data
+
+
+def rebase_deltas(snapshot_id, snapshot_interval):
+	"""
+		Stores the first delta referring to a full snapshot as a full snapshot itself and the other deltas referring to
+		it as changes to the new one, so that the snapshot can be deleted without losing the versions after it.
+	"""
+	snapshot = Version.objects.filter(pk=snapshot_id, format='json').first()
+	if snapshot is None:
+		return
+
+	dependent_versions = []
+	later_versions = Version.objects.filter(content_type_id=snapshot.content_type_id, object_id=snapshot.object_id, pk__gt=snapshot.pk)
+	for version in later_versions.order_by('pk').only('format', 'serialized_data').iterator():
+		if version.format != FORMAT:
+			break
+		dependent_versions.append(version)
+	stored_versions = {snapshot.pk: (snapshot.format, snapshot.serialized_data)}
+	serialized_objects = [load(version.format, version.serialized_data, stored_versions) for version in dependent_versions]
+
+	new_snapshot_id, new_snapshot_object, num_deltas = None, None, 0
+	for version, serialized_object in zip(dependent_versions, serialized_objects):
+		version.format, version.serialized_data = dump(serialized_object, new_snapshot_id, new_snapshot_object, num_deltas, snapshot_interval)
+		if version.format == FORMAT:
+			num_deltas += 1
+		else:
+			new_snapshot_id, new_snapshot_object, num_deltas = version.pk, serialized_object, 0
+	Version.objects.bulk_update(dependent_versions, ['format', 'serialized_data'])
+
+
+def Deserializer(stream_or_string, **options):
+	"""
+		Reads versions that only store the changes to a full snapshot of the same object by reconstructing their full
+		JSON serialization, so reversion can use them like any other version.
+	"""
+	if not isinstance(stream_or_string, (bytes, str)):
+		stream_or_string = stream_or_string.read()
+	if isinstance(stream_or_string, bytes):
+		stream_or_string = stream_or_string.decode()
+	try:
+		serialized_object = reconstruct(json.loads(stream_or_string))
+	except (KeyError, ValueError) as error:
+		raise DeserializationError() from error
+	yield from JSONDeserializer(json.dumps([serialized_object]), **options)
@@ -0,0 +1,70 @@
+from itertools import groupby
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from reversion.models import Version
+
+from _1327.documents import delta_serializer
+from _1327.documents.models import Document
+
+
+def get_snapshot_intervals():
+	# versions of deleted documents are kept by reversion, so the class of a document is taken from its versions
+	content_types = ContentType.objects.get_for_models(*Document.__subclasses__())
+	versions = Version.objects.filter(content_type__in=content_types.values()).values_list('object_id', 'content_type_id').distinct()
+	snapshot_intervals = {model: model.REVISION_SNAPSHOT_INTERVAL for model in content_types.keys()}
+	return {
+		object_id: snapshot_intervals[ContentType.objects.get_for_id(content_type_id).model_class()]
+		for object_id, content_type_id in versions
+	}
+
+
+def compact_versions(versions, snapshot_interval):
+	"""
+		Stores the versions of a document, ordered from the oldest one, as deltas and full snapshots according to the
+		snapshot interval. Returns the changed versions.
+	"""
+	stored_versions = {version.pk: (version.format, version.serialized_data) for version in versions}
+	changed_versions = []
+	snapshot_id, snapshot_object, num_deltas = None, None, 0
+	for version in versions:
+		serialized_object = delta_serializer.load(version.format, version.serialized_data, stored_versions)
+		format, serialized_data = delta_serializer.dump(serialized_object, snapshot_id, snapshot_object, num_deltas, snapshot_interval)
+		# full snapshots that are already stored are kept as reversion wrote them
+		if format != version.format or (format == delta_serializer.FORMAT and serialized_data != version.serialized_data):
+			version.format, version.serialized_data = format, serialized_data
+			changed_versions.append(version)
+		if format == delta_serializer.FORMAT:
+			num_deltas += 1
+		else:
+			snapshot_id, snapshot_object, num_deltas = version.pk, serialized_object, 0
+	return changed_versions
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Stores the revisions of documents with a REVISION_SNAPSHOT_INTERVAL as deltas and the ones of all other documents as full snapshots'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help='Only report the space that would be saved')
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			snapshot_intervals = get_snapshot_intervals()
+			versions = Version.objects.filter(content_type=ContentType.objects.get_for_model(Document)).order_by('object_id', 'pk').only('object_id', 'format', 'serialized_data')
+
+			size_before = size_after = 0
+			changed_versions = []
+			for object_id, document_versions in groupby(versions.iterator(), key=lambda version: version.object_id):
+				document_versions = list(document_versions)
+				size_before += sum(len(version.serialized_data) for version in document_versions)
+				changed_versions += compact_versions(document_versions, snapshot_intervals.get(object_id))
+				size_after += sum(len(version.serialized_data) for version in document_versions)
+
+			if options['dry_run']:
+				message = 'Would change {} versions, the revisions of documents would take {:.1f} KB instead of {:.1f} KB.'
+			else:
+				Version.objects.bulk_update(changed_versions, ['format', 'serialized_data'], batch_size=500)
+				message = 'Changed {} versions, the revisions of documents take {:.1f} KB instead of {:.1f} KB.'
+			self.stdout.write(message.format(len(changed_versions), size_after / 1024, size_before / 1024))
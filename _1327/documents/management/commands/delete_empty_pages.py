@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from _1327.documents.utils import delete_old_empty_pages
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Deletes documents that were created but never saved, should be run periodically'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=100, help='Number of documents deleted at once')
+
+	def handle(self, *args, **options):
+		num_deleted = delete_old_empty_pages(options['batch_size'])
+		self.stdout.write('Deleted {} empty pages.'.format(num_deleted))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from _1327.documents.models import RevisionMetadata
+from _1327.documents.utils import build_revision_metadata, create_revision_metadata, document_content_type_ids
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Rebuilds the number, the date and the authors of the revisions of all documents from their versions'
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			entries = build_revision_metadata(document_content_type_ids())
+			RevisionMetadata.objects.all().delete()
+			create_revision_metadata(entries)
+			self.stdout.write('Rebuilt the revision metadata of {} documents.'.format(len(entries)))
@@ -0,0 +1,49 @@
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from _1327.documents.models import Document, VisibilityIndex
+from _1327.documents.utils import build_visibility_index, create_visibility_index
+
+
+def stored_visibility_index():
+	rows = set()
+	for user_id, group_id, permission_id, object_id in VisibilityIndex.objects.values_list('user_id', 'group_id', 'permission_id', 'object_id'):
+		principal_field, principal_id = ('user_id', user_id) if user_id is not None else ('group_id', group_id)
+		rows.add((principal_field, principal_id, permission_id, object_id))
+	return rows
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Rebuilds the visibility index of documents from the object permissions and reports inconsistencies'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--check', action='store_true', help='Only report inconsistencies without rebuilding the index')
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			content_type_ids = [content_type.id for content_type in ContentType.objects.get_for_models(Document, *Document.__subclasses__()).values()]
+			expected = build_visibility_index(content_type_ids)
+			stored = stored_visibility_index()
+			missing = Counter(row[:3] for row in expected - stored)
+			superfluous = Counter(row[:3] for row in stored - expected)
+			inconsistent = missing.keys() | superfluous.keys()
+
+			for principal_field, principal_id, permission_id in sorted(inconsistent):
+				key = (principal_field, principal_id, permission_id)
+				self.stdout.write('{} {}, permission {}: {} missing, {} superfluous'.format(
+					principal_field[:-len('_id')], principal_id, permission_id, missing[key], superfluous[key],
+				))
+
+			if options['check']:
+				if inconsistent:
+					raise CommandError('The visibility index has {} inconsistent entries.'.format(len(inconsistent)))
+				self.stdout.write('The visibility index is consistent.')
+				return
+
+			VisibilityIndex.objects.all().delete()
+			create_visibility_index(expected)
+			self.stdout.write('Rebuilt the visibility index with {} rows, {} entries were inconsistent.'.format(len(expected), len(inconsistent)))
@@ -0,0 +1,36 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from _1327.documents.models import Document
+from _1327.documents.utils import render_documents
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Renders and stores the text of all documents, e.g. after the renderer or the abbreviations have changed'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of processes rendering in parallel')
+		parser.add_argument('--batch-size', type=int, default=50, help='Number of documents rendered by a process at once')
+		parser.add_argument('--stale', action='store_true', help='Only render documents marked as outdated, e.g. after links or abbreviations changed')
+
+	def handle(self, *args, **options):
+		documents = Document.objects.non_polymorphic()
+		if options['stale']:
+			documents = documents.filter(rendered_text_hash='')
+		document_ids = list(documents.order_by('id').values_list('id', flat=True))
+		batch_size = options['batch_size']
+		batches = [document_ids[i:i + batch_size] for i in range(0, len(document_ids), batch_size)]
+
+		if options['jobs'] > 1:
+			# database connections must not be shared with the forked worker processes
+			connections.close_all()
+			with ProcessPoolExecutor(max_workers=options['jobs']) as executor:
+				num_rendered = sum(executor.map(render_documents, batches))
+		else:
+			num_rendered = sum(render_documents(batch) for batch in batches)
+
+		self.stdout.write('Rendered {} documents.'.format(num_rendered))
@@ -1,4 +1,7 @@
+import hashlib
+
 import markdown
+from markdown.preprocessors import Preprocessor
 
 from _1327.documents.models import Document
 from _1327.polls.models import Poll
@@ -7,5 +10,54 @@ from _1327.polls.models import Poll
 class InternalLinksMarkdownExtension(markdown.extensions.Extension):
 
 	def extendMarkdown(self, md):
-		md.inlinePatterns.register(Document.LinkPattern(Document.DOCUMENT_LINK_REGEX, md), 'InternalLinkDocumentsPattern', 200)
-		md.inlinePatterns.register(Poll.LinkPattern(Poll.POLLS_LINK_REGEX, md), 'InternalLinkPollsPattern', 200)
+		md.registerExtension(self)
+		self.patterns = [
+			Document.LinkPattern(Document.DOCUMENT_LINK_REGEX, md),
+			Poll.LinkPattern(Poll.POLLS_LINK_REGEX, md),
+		]
+		md.preprocessors.register(InternalLinkPreprocessor(md, self.patterns), 'resolve_internal_links', 100)
+		md.inlinePatterns.register(self.patterns[0], 'InternalLinkDocumentsPattern', 200)
+		md.inlinePatterns.register(self.patterns[1], 'InternalLinkPollsPattern', 200)
+
+	def reset(self):
+		for pattern in self.patterns:
+			pattern.reset()
+
+
+class InternalLinkPreprocessor(Preprocessor):
+	"""
+		Resolves all internal links of a text before the inline patterns run.
+	"""
+
+	def __init__(self, md, patterns):
+		super().__init__(md)
+		self.patterns = patterns
+
+	def run(self, lines):
+		text = '\n'.join(lines)
+		for pattern in self.patterns:
+			pattern.resolve_links(text)
+		return lines
+
+
+# the patterns are only used to look up urls, which does not change their state
+LINK_PATTERNS = [
+	Document.LinkPattern(Document.DOCUMENT_LINK_REGEX),
+	Poll.LinkPattern(Poll.POLLS_LINK_REGEX),
+]
+
+
+def internal_links_stamp(text):
+	"""
+		Returns a stamp of the targets of all internal links in a text, which changes whenever one of them is changed
+		or deleted.
+	"""
+	urls = [(type(pattern).__qualname__, sorted(pattern.lookup_urls(text).items())) for pattern in LINK_PATTERNS]
+	if not any(pattern_urls for __, pattern_urls in urls):
+		return ''
+	return hashlib.sha1(repr(urls).encode()).hexdigest()
+
+
+def invalidate_internal_links(ids):
+	for pattern in LINK_PATTERNS:
+		pattern.invalidate(ids)
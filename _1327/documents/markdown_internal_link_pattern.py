@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
 
@@ -7,6 +8,10 @@ from markdown.inlinepatterns import LinkInlineProcessor
 
 class InternalLinkPattern(LinkInlineProcessor):
 
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.urls = {}
+
 	def handleMatch(self, m, data=None):
 		el = markdown.util.etree.Element("a")
 		try:
@@ -16,5 +21,45 @@ class InternalLinkPattern(LinkInlineProcessor):
 			el.text = markdown.util.AtomicString(_('[missing link]'))
 		return el, m.start(0), m.end(0)
 
-	def url(id):
+	@classmethod
+	def cache_key_prefix(cls):
+		return 'internal_link_url:{}:'.format(cls.__qualname__)
+
+	@classmethod
+	def invalidate(cls, ids):
+		cache.delete_many([cls.cache_key_prefix() + str(id) for id in ids])
+
+	def lookup_urls(self, text):
+		"""
+			Returns the urls of all links in the text, looked up at once so that rendering a link does not need a query.
+			Resolved urls are shared between processes through the cache until their target is changed or deleted.
+		"""
+		ids = {int(match.group('id')) for match in self.compiled_re.finditer(text)}
+		if not ids:
+			return {}
+
+		key_prefix = self.cache_key_prefix()
+		cached_urls = cache.get_many([key_prefix + str(id) for id in ids])
+		urls = {int(key[len(key_prefix):]): url for key, url in cached_urls.items()}
+
+		missing_ids = ids - urls.keys()
+		if missing_ids:
+			resolved_urls = self.urls_for_ids(missing_ids)
+			cache.set_many({key_prefix + str(id): url for id, url in resolved_urls.items()}, timeout=None)
+			urls.update(resolved_urls)
+		return urls
+
+	def resolve_links(self, text):
+		self.urls = self.lookup_urls(text)
+
+	def reset(self):
+		self.urls = {}
+
+	def url(self, id):
+		try:
+			return self.urls[int(id)]
+		except KeyError:
+			raise ObjectDoesNotExist
+
+	def urls_for_ids(self, ids):
 		raise NotImplementedError
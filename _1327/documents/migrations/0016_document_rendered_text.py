@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_auto_20200224_1847'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='html_de',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='html_en',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='rendered_text_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='toc_de',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='toc_en',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
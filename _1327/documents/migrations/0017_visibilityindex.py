@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+DOCUMENT_MODELS = [
+    ('documents', 'document'),
+    ('information_pages', 'informationdocument'),
+    ('minutes', 'minutesdocument'),
+    ('polls', 'poll'),
+]
+
+
+def build_visibility_index(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    VisibilityIndex = apps.get_model('documents', 'VisibilityIndex')
+    content_type_ids = []
+    for app_label, model in DOCUMENT_MODELS:
+        content_type_ids += ContentType.objects.filter(app_label=app_label, model=model).values_list('id', flat=True)
+
+    rows = set()
+    for model, principal_field in [('UserObjectPermission', 'user_id'), ('GroupObjectPermission', 'group_id')]:
+        permissions = apps.get_model('guardian', model).objects.filter(content_type_id__in=content_type_ids)
+        for principal_id, permission_id, object_pk in permissions.values_list(principal_field, 'permission_id', 'object_pk'):
+            rows.add((principal_field, principal_id, permission_id, int(object_pk)))
+
+    VisibilityIndex.objects.bulk_create(
+        (
+            VisibilityIndex(permission_id=permission_id, object_id=object_id, **{principal_field: principal_id})
+            for principal_field, principal_id, permission_id, object_id in rows
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0011_update_proxy_permissions'),
+        ('guardian', '0001_initial'),
+        ('documents', '0016_document_rendered_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisibilityIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auth.Group')),
+                ('permission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auth.Permission')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'permission', 'object_id'), ('group', 'permission', 'object_id')},
+            },
+        ),
+        migrations.RunPython(build_visibility_index, migrations.RunPython.noop),
+    ]
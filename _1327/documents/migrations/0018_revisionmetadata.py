@@ -0,0 +1,72 @@
+# Generated by Django 2.2.28 on 2026-10-18 06:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+DOCUMENT_SUBCLASS_MODELS = [
+    ('information_pages', 'informationdocument'),
+    ('minutes', 'minutesdocument'),
+    ('polls', 'poll'),
+]
+
+
+def build_revision_metadata(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Document = apps.get_model('documents', 'Document')
+    RevisionMetadata = apps.get_model('documents', 'RevisionMetadata')
+    Version = apps.get_model('reversion', 'Version')
+    content_type_ids = []
+    for app_label, model in DOCUMENT_SUBCLASS_MODELS:
+        content_type_ids += ContentType.objects.filter(app_label=app_label, model=model).values_list('id', flat=True)
+
+    entries = {}
+    versions = Version.objects.filter(content_type_id__in=content_type_ids).order_by('revision__date_created', 'revision_id')
+    for object_id, date_created, user_id in versions.values_list('object_id', 'revision__date_created', 'revision__user_id'):
+        entry = entries.setdefault(int(object_id), {'num_revisions': 0, 'authors': set()})
+        entry['num_revisions'] += 1
+        entry['last_change'] = date_created
+        entry['last_author_id'] = user_id
+        if user_id is not None:
+            entry['authors'].add(user_id)
+    # versions of deleted documents are kept by reversion
+    existing_ids = set(Document.objects.filter(id__in=entries.keys()).values_list('id', flat=True))
+    entries = {document_id: entry for document_id, entry in entries.items() if document_id in existing_ids}
+
+    RevisionMetadata.objects.bulk_create(
+        RevisionMetadata(
+            document_id=document_id,
+            num_revisions=entry['num_revisions'],
+            last_change=entry['last_change'],
+            last_author_id=entry['last_author_id'],
+        )
+        for document_id, entry in entries.items()
+    )
+    RevisionMetadata.authors.through.objects.bulk_create(
+        RevisionMetadata.authors.through(revisionmetadata_id=document_id, userprofile_id=user_id)
+        for document_id, entry in entries.items() for user_id in entry['authors']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        ('documents', '0017_visibilityindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisionMetadata',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='revision_metadata', serialize=False, to='documents.Document')),
+                ('num_revisions', models.PositiveIntegerField(default=0)),
+                ('last_change', models.DateTimeField(blank=True, null=True)),
+                ('authors', models.ManyToManyField(blank=True, related_name='_revisionmetadata_authors_+', to=settings.AUTH_USER_MODEL)),
+                ('last_author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(build_revision_metadata, migrations.RunPython.noop),
+    ]
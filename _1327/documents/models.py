@@ -2,26 +2,32 @@ from datetime import datetime
 import hashlib
 import re
 
+from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
 from django.utils.translation import ugettext_lazy as _
-from guardian.shortcuts import assign_perm, get_groups_with_perms, get_users_with_perms, remove_perm
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.shortcuts import get_groups_with_perms
 from polymorphic.models import PolymorphicModel
 from reversion import revisions
-from reversion.models import Version
 
 from _1327.documents.markdown_internal_link_pattern import InternalLinkPattern
 from _1327.main.tools import translate
-from _1327.main.utils import slugify
+from _1327.main.utils import convert_markdown, invalidate_permission_overview, slugify
 from _1327.user_management.models import UserProfile
 
 
 DOCUMENT_VIEW_PERMISSION_NAME = 'view_document'
 
 
-@revisions.register
+# the rendered text is derived from the text, so it is not stored in revisions
+RENDERED_TEXT_FIELDS = ('html_de', 'html_en', 'toc_de', 'toc_en', 'rendered_text_hash')
+
+
+@revisions.register(exclude=RENDERED_TEXT_FIELDS)
 class Document(PolymorphicModel):
 	def get_hash():
 		max_id = Document.objects.aggregate(models.Max('id'))['id__max'] or 0
@@ -36,24 +42,43 @@ class Document(PolymorphicModel):
 	text_en = models.TextField(blank=True, verbose_name=_("Text (English)"))
 	text = translate(en='text_en', de='text_de')
 	hash_value = models.CharField(max_length=40, unique=True, default=get_hash, verbose_name=_("Hash value"))
+	html_de = models.TextField(blank=True, editable=False)
+	html_en = models.TextField(blank=True, editable=False)
+	html = translate(en='html_en', de='html_de')
+	toc_de = models.TextField(blank=True, editable=False)
+	toc_en = models.TextField(blank=True, editable=False)
+	toc = translate(en='toc_en', de='toc_de')
+	rendered_text_hash = models.CharField(max_length=40, blank=True, editable=False)
 
 	DOCUMENT_LINK_REGEX = r'\[(?P<title>[^\[]+)\]\(document:(?P<id>\d+)\)'
 	VIEW_PERMISSION_NAME = DOCUMENT_VIEW_PERMISSION_NAME
+	# subclasses with a long history can store their revisions as deltas with a full snapshot after this many revisions
+	REVISION_SNAPSHOT_INTERVAL = None
 
 	class Meta:
 		verbose_name = _("Document")
 		verbose_name_plural = _("Documents")
 
 	class LinkPattern(InternalLinkPattern):
-		def url(self, id):
-			document = Document.objects.get(id=id)
-			if document:
-				return reverse(document.get_view_url_name(), args=[document.url_title])
-			return ''
+		def urls_for_ids(self, ids):
+			urls = {}
+			documents = Document.objects.non_polymorphic().filter(id__in=ids).values_list('id', 'url_title', 'polymorphic_ctype_id')
+			for id, url_title, polymorphic_ctype_id in documents:
+				document_class = ContentType.objects.get_for_id(polymorphic_ctype_id).model_class()
+				urls[id] = reverse(document_class.get_view_url_name(), args=[url_title])
+			return urls
 
 	def __str__(self):
 		return f"{self.title_de} | {self.title_en}"
 
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# remember the stored url_title to invalidate links only when it changes
+		if 'url_title' in field_names:
+			instance._stored_url_title = instance.url_title
+		return instance
+
 	def save(self, *args, **kwargs):
 		# make sure that the url is slugified
 		self.url_title = slugify(self.url_title)
@@ -65,7 +90,8 @@ class Document(PolymorphicModel):
 	def get_edit_url(self):
 		raise NotImplementedError()
 
-	def get_view_url_name(self):
+	@classmethod
+	def get_view_url_name(cls):
 		return 'view'
 
 	def get_edit_url_name(self):
@@ -97,12 +123,19 @@ class Document(PolymorphicModel):
 	def can_be_reverted(self):
 		return True
 
+	def get_revision_metadata(self):
+		if not hasattr(self, '_revision_metadata'):
+			self._revision_metadata = RevisionMetadata.objects.select_related('last_author').filter(document_id=self.id).first()
+		return self._revision_metadata
+
+	@property
+	def num_revisions(self):
+		metadata = self.get_revision_metadata()
+		return metadata.num_revisions if metadata else 0
+
 	def authors(self):
-		authors = set()
-		versions = Version.objects.get_for_object(self)
-		for version in versions:
-			authors.add(version.revision.user)
-		return authors
+		metadata = self.get_revision_metadata()
+		return set(metadata.authors.all()) if metadata else set()
 
 	@classmethod
 	def generate_new_title(cls):
@@ -146,41 +179,66 @@ class Document(PolymorphicModel):
 		content_type = ContentType.objects.get_for_model(self)
 		return "{app}.delete_{model}".format(app=content_type.app_label, model=content_type.model)
 
+	def get_permission_ids(self, permission_names):
+		content_type = ContentType.objects.get_for_model(self)
+		codenames = [permission_name.split('.')[1] for permission_name in permission_names]
+		return list(Permission.objects.filter(content_type=content_type, codename__in=codenames).values_list('id', flat=True))
+
+	@property
+	def all_permission_names(self):
+		return [self.view_permission_name, self.edit_permission_name, self.delete_permission_name]
+
 	def delete_all_permissions(self, user_or_group):
-		remove_perm(self.view_permission_name, user_or_group, self)
-		remove_perm(self.edit_permission_name, user_or_group, self)
-		remove_perm(self.delete_permission_name, user_or_group, self)
+		remove_object_permissions(self, self.get_permission_ids(self.all_permission_names), principals=[user_or_group])
 
 	def set_all_permissions(self, user_or_group):
-		assign_perm(self.view_permission_name, user_or_group, self)
-		assign_perm(self.edit_permission_name, user_or_group, self)
-		assign_perm(self.delete_permission_name, user_or_group, self)
+		permission_ids = self.get_permission_ids(self.all_permission_names)
+		principal_field = 'group_id' if isinstance(user_or_group, Group) else 'user_id'
+		assign_object_permissions(self, [(principal_field, user_or_group.id, permission_id) for permission_id in permission_ids])
 
 	def reset_permissions(self):
-		users = get_users_with_perms(self)
-		for user in users:
-			self.delete_all_permissions(user)
-		groups = get_groups_with_perms(self)
-		for group in groups:
-			self.delete_all_permissions(group)
+		remove_object_permissions(self, self.get_permission_ids(self.all_permission_names))
 
 	@property
 	def meta_information_html(self):
 		raise NotImplementedError('Please use a subclass of Document')
 
+	@staticmethod
+	def render_texts(text_de, text_en):
+		# in each language the text of the other language is shown if there is none
+		rendered = {'rendered_text_hash': Document.get_rendered_text_hash(text_de, text_en)}
+		for language, text in (('de', text_de), ('en', text_en)):
+			with translation.override(language):
+				rendered['html_' + language], rendered['toc_' + language] = convert_markdown(text or text_de or text_en)
+		return rendered
+
+	@staticmethod
+	def get_rendered_text_hash(text_de, text_en):
+		# changes of abbreviations and link targets render the affected documents again, so only the texts are hashed
+		return hashlib.sha1('\0'.join([text_de, text_en]).encode()).hexdigest()
+
+	def update_rendered_text(self):
+		for field, value in Document.render_texts(self.text_de, self.text_en).items():
+			setattr(self, field, value)
+
+	def get_rendered_text(self):
+		"""
+			Returns the html and toc for the active language. They are only rendered if the text was changed without
+			rendering it, e.g. with an update query, and are not stored then to keep requests free of writes.
+		"""
+		if self.rendered_text_hash != Document.get_rendered_text_hash(self.text_de, self.text_en):
+			return convert_markdown(self.text or self.text_de or self.text_en)
+		return self.html, self.toc
+
 	@property
 	def last_change(self):
-		last_revision = Version.objects.get_for_object(self).order_by('revision__date_created').last()
-		if last_revision is None:
-			return None
-		return last_revision.revision.date_created
+		metadata = self.get_revision_metadata()
+		return metadata.last_change if metadata else None
 
 	@property
 	def last_author(self):
-		last_revision = Version.objects.get_for_object(self).order_by('revision__date_created').last()
-		if last_revision is None:
-			return None
-		return last_revision.revision.user
+		metadata = self.get_revision_metadata()
+		return metadata.last_author if metadata else None
 
 	@property
 	def is_in_creation(self):
@@ -234,3 +292,135 @@ class Attachment(models.Model):
 
 	def __str__(self):
 		return self.displayname
+
+
+class RevisionMetadata(models.Model):
+	"""
+		The number, the date and the authors of the revisions of a document, updated whenever a revision of the document
+		is committed, so that showing them does not need to load all versions.
+	"""
+	document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='revision_metadata')
+	num_revisions = models.PositiveIntegerField(default=0)
+	last_change = models.DateTimeField(blank=True, null=True)
+	last_author = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+	authors = models.ManyToManyField(UserProfile, related_name='+', blank=True)
+
+	@classmethod
+	def add_revision(cls, document_id, revision):
+		with transaction.atomic():
+			metadata, __ = cls.objects.select_for_update().get_or_create(document_id=document_id)
+			metadata.num_revisions += 1
+			if metadata.last_change is None or revision.date_created >= metadata.last_change:
+				metadata.last_change = revision.date_created
+				metadata.last_author_id = revision.user_id
+			metadata.save()
+			if revision.user_id is not None:
+				metadata.authors.add(revision.user_id)
+
+
+class VisibilityIndex(models.Model):
+	"""
+		One row for every object permission a user or a group has for a document, derived from guardian's object
+		permissions. Unlike in guardian's tables the id of the document is an integer, so the documents a user may see
+		can be selected with an indexed subquery.
+	"""
+	user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+	group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='+', blank=True, null=True)
+	permission = models.ForeignKey(Permission, on_delete=models.CASCADE, related_name='+')
+	object_id = models.PositiveIntegerField()
+
+	class Meta:
+		unique_together = [('user', 'permission', 'object_id'), ('group', 'permission', 'object_id')]
+
+	@classmethod
+	def update(cls, permission_id, added=(), removed=(), user_id=None, group_id=None):
+		key = ('user_id', user_id, permission_id) if user_id is not None else ('group_id', group_id, permission_id)
+		cls.apply_changes({key: (set(added), set(removed))})
+
+	@classmethod
+	def apply_changes(cls, changes):
+		"""
+			Adds and removes object ids for many principals at once with a single insert and a single delete. changes
+			maps ('user_id' or 'group_id', principal id, permission id) to the sets of added and removed object ids.
+		"""
+		added = []
+		removed = Q()
+		for (principal_field, principal_id, permission_id), (added_ids, removed_ids) in changes.items():
+			added += [cls(permission_id=permission_id, object_id=object_id, **{principal_field: principal_id}) for object_id in added_ids]
+			if removed_ids:
+				removed |= Q(permission_id=permission_id, object_id__in=removed_ids, **{principal_field: principal_id})
+
+		with transaction.atomic():
+			if removed:
+				cls.objects.filter(removed).delete()
+			cls.objects.bulk_create(added, ignore_conflicts=True)
+
+	@classmethod
+	def object_ids_for_user(cls, user, content_type, codename):
+		"""
+			Returns the ids of the documents the user or one of its groups has the permission for as a queryset, to be
+			used as a subquery.
+		"""
+		return cls.objects.filter(
+			Q(user=user) | Q(group__in=user.groups.all()),
+			permission__content_type=content_type,
+			permission__codename=codename,
+		).values_list('object_id', flat=True)
+
+
+def object_permission_model(principal_field):
+	return UserObjectPermission if principal_field == 'user_id' else GroupObjectPermission
+
+
+def assign_object_permissions(document, permissions):
+	"""
+		Assigns object permissions of a document, given as ('user_id' or 'group_id', principal id, permission id), with
+		a single insert per kind of principal instead of several queries for every permission like guardian's assign_perm.
+		As bulk_create sends no signals, the visibility index and the permission overview are updated here.
+	"""
+	content_type = ContentType.objects.get_for_model(document)
+	object_pk = str(document.pk)
+	index_changes = {}
+	for principal_field in ['user_id', 'group_id']:
+		permission_model = object_permission_model(principal_field)
+		requested = {(principal_id, permission_id) for field, principal_id, permission_id in permissions if field == principal_field}
+		if not requested:
+			continue
+
+		existing = set(permission_model.objects.filter(
+			content_type=content_type,
+			object_pk=object_pk,
+			permission_id__in={permission_id for __, permission_id in requested},
+		).values_list(principal_field, 'permission_id'))
+		missing = requested - existing
+		permission_model.objects.bulk_create(
+			permission_model(content_type=content_type, object_pk=object_pk, permission_id=permission_id, **{principal_field: principal_id})
+			for principal_id, permission_id in missing
+		)
+		for principal_id, permission_id in missing:
+			index_changes[(principal_field, principal_id, permission_id)] = ({document.pk}, set())
+
+	VisibilityIndex.apply_changes(index_changes)
+	invalidate_permission_overview(document.pk)
+
+
+def remove_object_permissions(document, permission_ids, principals=None):
+	"""
+		Removes the given object permissions of a document from all or only the given users and groups with a single
+		delete per kind of principal. The delete sends post_delete for every removed permission, so the visibility index
+		and the permission overview are updated by the same receivers as for guardian's remove_perm.
+	"""
+	content_type = ContentType.objects.get_for_model(document)
+	for principal_field in ['user_id', 'group_id']:
+		object_permissions = object_permission_model(principal_field).objects.filter(
+			content_type=content_type,
+			object_pk=str(document.pk),
+			permission_id__in=permission_ids,
+		)
+		if principals is not None:
+			principal_ids = [
+				principal.id for principal in principals
+				if isinstance(principal, Group) == (principal_field == 'group_id')
+			]
+			object_permissions = object_permissions.filter(**{principal_field + '__in': principal_ids})
+		object_permissions.delete()
@@ -1,10 +1,20 @@
+from functools import partial
+
 from django.contrib.auth.models import Group
-from django.db.models.signals import post_save, pre_save
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from guardian.shortcuts import assign_perm, get_perms_for_model
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.shortcuts import get_perms_for_model
+from reversion.models import Version
+from reversion.signals import post_revision_commit
 
-from _1327.documents.models import Document
-from _1327.main.utils import slugify
+from _1327.documents import delta_serializer
+from _1327.documents.markdown_internal_link_extension import invalidate_internal_links
+from _1327.documents.models import assign_object_permissions, Document, RevisionMetadata, VisibilityIndex
+from _1327.documents.utils import mark_documents_containing_stale, rebuild_revision_metadata
+from _1327.main.utils import invalidate_permission_overview, invalidate_permission_overviews, slugify
 
 
 @receiver(pre_save)
@@ -35,9 +45,137 @@ def permission_callback(sender, instance, created, *args, **kwargs):
 	if sender not in Document.__subclasses__() or not created:
 		return
 
-	permissions = get_perms_for_model(instance)
-	groups = Group.objects.all()
-	for group in groups:
-		for permission in group.permissions.all():
-			if permission in permissions:
-				assign_perm(permission.codename, group, instance)
+	group_permissions = Group.permissions.through.objects.filter(permission__in=get_perms_for_model(instance))
+	assign_object_permissions(instance, [
+		('group_id', group_id, permission_id)
+		for group_id, permission_id in group_permissions.values_list('group_id', 'permission_id')
+	])
+
+
+@receiver(post_save)
+def invalidate_rendered_links(sender, instance, created, update_fields=None, *args, **kwargs):
+	"""
+		internal links render the url_title of the linked document, so the cached urls of a document have to be
+		invalidated whenever its url_title has changed
+	"""
+	if sender not in Document.__subclasses__() and sender is not Document:
+		return
+	if created or (update_fields is not None and 'url_title' not in update_fields):
+		return
+
+	# documents that were not loaded from the database might have changed their url_title
+	if getattr(instance, '_stored_url_title', None) != instance.url_title:
+		invalidate_links_to(instance)
+	instance._stored_url_title = instance.url_title
+
+
+@receiver(post_delete)
+def invalidate_deleted_links(sender, instance, *args, **kwargs):
+	# the Document base model is deleted together with each subclass, after which links can not be resolved anymore
+	if sender is Document:
+		invalidate_links_to(instance)
+
+
+def invalidate_links_to(document):
+	invalidate_internal_links([document.pk])
+	mark_documents_containing_stale('](document:{})'.format(document.pk), '](poll:{})'.format(document.pk))
+
+
+def visibility_index_principal(object_permission):
+	if isinstance(object_permission, UserObjectPermission):
+		return {'user_id': object_permission.user_id}
+	return {'group_id': object_permission.group_id}
+
+
+def is_document_permission(object_permission):
+	model = ContentType.objects.get_for_id(object_permission.content_type_id).model_class()
+	return model is not None and issubclass(model, Document)
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+def add_to_visibility_index(sender, instance, created, *args, **kwargs):
+	"""
+		keeps the visibility index in sync with permissions assigned with guardian's assign_perm
+	"""
+	if created and is_document_permission(instance):
+		VisibilityIndex.update(instance.permission_id, added=[int(instance.object_pk)], **visibility_index_principal(instance))
+
+
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def remove_from_visibility_index(sender, instance, *args, **kwargs):
+	"""
+		keeps the visibility index in sync with permissions removed with guardian's remove_perm
+	"""
+	if is_document_permission(instance):
+		VisibilityIndex.update(instance.permission_id, removed=[int(instance.object_pk)], **visibility_index_principal(instance))
+
+
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def invalidate_document_permission_overview(sender, instance, *args, **kwargs):
+	if is_document_permission(instance):
+		invalidate_permission_overview(int(instance.object_pk))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_document_permission_overviews(sender, *args, **kwargs):
+	invalidate_permission_overviews()
+
+
+@receiver(post_revision_commit)
+def update_revision_metadata(sender, revision, versions, **kwargs):
+	"""
+		keeps the number, the date and the authors of the revisions of documents up to date
+	"""
+	for version in versions:
+		# revisions also contain a version of the Document base model of each document, which must not be counted twice
+		if ContentType.objects.get_for_id(version.content_type_id).model_class() in Document.__subclasses__():
+			RevisionMetadata.add_revision(int(version.object_id), revision)
+
+
+@receiver(post_delete, sender=Version)
+def remove_deleted_revision_from_metadata(sender, instance, **kwargs):
+	"""
+		recomputes the revision metadata of a document when one of its versions is deleted, e.g. together with its
+		revision by reversion's deleterevisions command or the admin
+	"""
+	if ContentType.objects.get_for_id(instance.content_type_id).model_class() in Document.__subclasses__():
+		rebuild_revision_metadata([int(instance.object_id)])
+
+
+@receiver(post_revision_commit)
+def store_revisions_as_deltas(sender, revision, versions, **kwargs):
+	"""
+		replaces the new versions of documents with a REVISION_SNAPSHOT_INTERVAL by their changes to the last full
+		snapshot once the revision is committed, so that the transaction of the revision is not prolonged
+	"""
+	document_classes = {}
+	for version in versions:
+		model = ContentType.objects.get_for_id(version.content_type_id).model_class()
+		if model in Document.__subclasses__():
+			document_classes[version.object_id] = model
+
+	# the texts are stored in the versions of the Document base model
+	document_content_type = ContentType.objects.get_for_model(Document)
+	for version in versions:
+		snapshot_interval = getattr(document_classes.get(version.object_id), 'REVISION_SNAPSHOT_INTERVAL', None)
+		if version.content_type_id == document_content_type.id and snapshot_interval is not None:
+			transaction.on_commit(partial(delta_serializer.store_as_delta, version, snapshot_interval))
+
+
+@receiver(pre_delete, sender=Version)
+def rebase_deltas_of_deleted_snapshot(sender, instance, **kwargs):
+	"""
+		stores the deltas referring to a full snapshot that is deleted, e.g. by reversion's deleterevisions command, as
+		changes to a new full snapshot
+	"""
+	if instance.content_type_id != ContentType.objects.get_for_model(Document).id:
+		return
+	# the revision also contains a version of the document's own model, which tells its snapshot interval
+	document_versions = Version.objects.filter(revision_id=instance.revision_id, object_id=instance.object_id).exclude(pk=instance.pk)
+	content_type_id = document_versions.values_list('content_type_id', flat=True).first()
+	model = ContentType.objects.get_for_id(content_type_id).model_class() if content_type_id is not None else None
+	delta_serializer.rebase_deltas(instance.pk, getattr(model, 'REVISION_SNAPSHOT_INTERVAL', None))
@@ -1,32 +1,47 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
+from io import StringIO
 import json
 import re
 import tempfile
+import threading
+from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import AnonymousUser, Group
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.base import ContentFile
-from django.db import transaction
-from django.test import TestCase
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.test import override_settings, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone, translation
 from django_webtest import WebTest
-from guardian.shortcuts import assign_perm, get_perms, get_perms_for_model, remove_perm
+from guardian.shortcuts import assign_perm, get_objects_for_user as guardian_get_objects_for_user, get_perms, get_perms_for_model, remove_perm
 from guardian.utils import get_anonymous_user
 import markdown
 from model_bakery import baker
 from reversion import revisions
-from reversion.models import Version
+from reversion.models import Revision, Version
 
+from _1327.documents import delta_serializer
+from _1327.documents.consumers import EditorConsumer, preview_metrics, PreviewConsumer, render_preview
 from _1327.documents.markdown_internal_link_extension import InternalLinksMarkdownExtension
 from _1327.documents.markdown_scaled_image_extension import SCALED_IMAGE_LINK_RE, ScaledImagePattern
+from _1327.documents.utils import get_objects_for_user, get_version_diff, merge_preview_patches, preview_patch, reset_preview_blocks
 from _1327.information_pages.models import InformationDocument
-from _1327.main.utils import EscapeHtml, slugify
+from _1327.main.models import AbbreviationExplanation
+from _1327.main.utils import compute_document_permission_overview, convert_markdown, convert_markdown_blocks, document_permission_overview, EscapeHtml, \
+	slugify
 from _1327.minutes.models import MinutesDocument
 from _1327.polls.models import Poll
 from _1327.user_management.models import UserProfile
 
-from .models import Attachment, Document, TemporaryDocumentText
+from .models import Attachment, Document, RevisionMetadata, TemporaryDocumentText, VisibilityIndex
 
 
 class TestInternalLinkMarkDown(TestCase):
@@ -58,6 +73,44 @@ class TestInternalLinkMarkDown(TestCase):
 		text = self.md.convert('[description](document:{})'.format(document.id))
 		self.assertIn('<a>[missing link]</a>', text)
 
+	def test_links_are_resolved_in_one_query(self):
+		documents = [self.document] + baker.make(MinutesDocument, _quantity=3) + baker.make(Poll, _quantity=2)
+		polls = baker.make(Poll, _quantity=2)
+		text = '\n'.join(['[link](document:{})'.format(document.id) for document in documents])
+		text += '\n'.join(['[poll](poll:{})'.format(poll.id) for poll in polls])
+		cache.clear()
+
+		with self.assertNumQueries(2):
+			html = self.md.convert(text)
+		for document in documents:
+			self.assertIn(reverse(document.get_view_url_name(), args=[document.url_title]), html)
+		for poll in polls:
+			self.assertIn(reverse(poll.get_view_url_name(), args=[poll.id]), html)
+
+		# resolved urls are shared until a document changes
+		with self.assertNumQueries(0):
+			self.assertEqual(self.md.convert(text), html)
+
+	def test_only_changed_urls_invalidate_rendered_links(self):
+		text = '[link](document:{})'.format(self.document.id)
+		other_document = baker.make(InformationDocument)
+		with translation.override('en'):
+			html, __ = convert_markdown(text)
+
+			# saving documents without changing their url keeps the rendered text
+			other_document.title_en = 'changed title'
+			other_document.save()
+			document = InformationDocument.objects.get(pk=self.document.pk)
+			document.title_en = 'changed title'
+			document.save()
+			with patch('_1327.main.utils.render_markdown') as render_markdown:
+				self.assertEqual(convert_markdown(text), (html, __))
+			render_markdown.assert_not_called()
+
+			document.url_title = 'changed_url'
+			document.save()
+			self.assertIn('changed_url', convert_markdown(text)[0])
+
 
 class TestRevertion(WebTest):
 	csrf_checks = False
@@ -158,6 +211,38 @@ class TestRevertion(WebTest):
 		self.assertEqual(response.status_code, 200)
 		self.assertIn(reverse('versions', args=[old_url]), response.body.decode('utf-8'))
 
+	def test_revert_only_finds_versions_of_the_document(self):
+		other_document = baker.prepare(Document)
+		with transaction.atomic(), revisions.create_revision():
+			other_document.save()
+		for version_id in [Version.objects.get_for_object(other_document).get().pk, 'abc']:
+			self.app.post(
+				reverse('documents:revert'),
+				params={'id': version_id, 'url_title': self.document.url_title},
+				user=self.user,
+				xhr=True,
+				status=400,
+			)
+
+	def test_revert_restores_many_to_many_fields(self):
+		participants = baker.make(UserProfile, _quantity=3)
+		document = MinutesDocument.objects.get(pk=baker.make(MinutesDocument).pk)
+		document.participants.set(participants[:2])
+		with transaction.atomic(), revisions.create_revision():
+			document.save()
+		document.participants.set(participants[1:])
+		with transaction.atomic(), revisions.create_revision():
+			document.save()
+
+		response = self.app.post(
+			reverse('documents:revert'),
+			params={'id': Version.objects.get_for_object(document)[1].pk, 'url_title': document.url_title},
+			user=self.user,
+			xhr=True,
+		)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(set(MinutesDocument.objects.get(pk=document.pk).participants.all()), set(participants[:2]))
+
 	def test_version_creation(self):
 		Document.objects.all().delete()
 		self.assertEqual(Document.objects.count(), 0)
@@ -737,6 +822,28 @@ class TestMarkdownRendering(WebTest):
 		self.assertEqual(response.status_code, 200)
 		self.assertEqual('<p>' + self.document_text + '</p>', response.body.decode('utf-8'))
 
+	def test_preview_patch_contains_changed_blocks(self):
+		reset_preview_blocks(self.document.hash_value, 'en')
+		preview = preview_patch(self.document.hash_value, 'en', convert_markdown_blocks('First\n\nSecond\n\nThird'))
+		self.assertEqual(preview, {'blocks': 3, 'changed': {0: '<p>First</p>', 1: '<p>Second</p>', 2: '<p>Third</p>'}})
+
+		preview = preview_patch(self.document.hash_value, 'en', convert_markdown_blocks('First\n\nChanged'))
+		self.assertEqual(preview, {'blocks': 2, 'changed': {1: '<p>Changed</p>'}})
+
+		reset_preview_blocks(self.document.hash_value, 'en')
+		preview = preview_patch(self.document.hash_value, 'en', convert_markdown_blocks('First\n\nChanged'))
+		self.assertEqual(preview, {'blocks': 2, 'changed': {0: '<p>First</p>', 1: '<p>Changed</p>'}})
+
+	def test_preview_patches_of_each_language_are_independent(self):
+		reset_preview_blocks(self.document.hash_value, 'de')
+		reset_preview_blocks(self.document.hash_value, 'en')
+		preview_patch(self.document.hash_value, 'de', convert_markdown_blocks('Erster\n\nZweiter'))
+		preview = preview_patch(self.document.hash_value, 'en', convert_markdown_blocks('First\n\nSecond'))
+		self.assertEqual(preview, {'blocks': 2, 'changed': {0: '<p>First</p>', 1: '<p>Second</p>'}})
+
+		preview = preview_patch(self.document.hash_value, 'de', convert_markdown_blocks('Erster\n\nGeändert'))
+		self.assertEqual(preview, {'blocks': 2, 'changed': {1: '<p>Geändert</p>'}})
+
 
 class TestLanguage(WebTest):
 	csrf_checks = False
@@ -835,6 +942,20 @@ class TestSignals(TestCase):
 		test_object.save()
 		self.assertFalse(test_user.has_perm(permission_names[0], test_object))
 
+	def test_group_permission_hook_assigns_permissions_in_bulk(self):
+		for obj_id in range(5):
+			group = Group.objects.create(name="bulk_group_{}".format(obj_id))
+			for permission in get_perms_for_model(InformationDocument):
+				assign_perm("{}.{}".format(permission.content_type.app_label, permission.codename), group)
+
+		# the number of queries must not depend on the number of groups and permissions
+		document = baker.prepare(InformationDocument, title_en="test")
+		with self.assertNumQueries(8):
+			document.save()
+		for group in Group.objects.filter(name__startswith="bulk_group_"):
+			self.assertEqual(set(get_perms(group, document)), {permission.codename for permission in group.permissions.all()})
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
 
 class TestSubclassConstraints(TestCase):
 	def is_abstract_model(self, cls):
@@ -1440,6 +1561,135 @@ class TestDeletion(WebTest):
 		self.assertIn("deleteDocumentButton", response.body.decode('utf-8'))
 
 
+class TestEmptyPageDeletion(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = baker.make(UserProfile)
+		old = timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER - timedelta(minutes=1)
+		cls.empty_documents = baker.make(InformationDocument, created=old, _quantity=3) + [baker.make(MinutesDocument, created=old)]
+		cls.new_document = baker.make(InformationDocument)
+		cls.saved_document = baker.prepare(MinutesDocument, created=old, author=cls.user)
+		with transaction.atomic(), revisions.create_revision():
+			cls.saved_document.save()
+		cls.autosaved_document = baker.make(InformationDocument, created=old)
+		baker.make(TemporaryDocumentText, document=cls.autosaved_document, author=cls.user)
+
+	def test_only_old_empty_pages_are_deleted(self):
+		output = StringIO()
+		call_command('delete_empty_pages', batch_size=2, stdout=output)
+		self.assertIn('Deleted 4 empty pages.', output.getvalue())
+		self.assertEqual(
+			set(Document.objects.values_list('pk', flat=True)),
+			{self.new_document.pk, self.saved_document.pk, self.autosaved_document.pk},
+		)
+		self.assertFalse(MinutesDocument.objects.filter(pk=self.empty_documents[-1].pk).exists())
+
+	def test_creating_documents_does_not_delete_empty_pages(self):
+		self.client.force_login(baker.make(UserProfile, is_superuser=True))
+		response = self.client.get(reverse('documents:create', args=['informationdocument']))
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(Document.objects.filter(pk=self.empty_documents[0].pk).exists())
+
+
+class TestRenderedText(WebTest):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = baker.make(UserProfile, is_superuser=True)
+
+	def test_view_uses_stored_rendered_text(self):
+		document = baker.make(InformationDocument, text_en='**text**', text_de='')
+		document.update_rendered_text()
+		document.save()
+		self.assertEqual(document.html_en, '<p><strong>text</strong></p>')
+		# the german page shows the english text
+		self.assertEqual(document.html_de, '<p><strong>text</strong></p>')
+
+		with patch('_1327.documents.models.convert_markdown') as convert_markdown:
+			response = self.app.get(reverse('view', args=[document.url_title]), user=self.user)
+		convert_markdown.assert_not_called()
+		self.assertIn('<p><strong>text</strong></p>', response.body.decode('utf-8'))
+
+	def test_outdated_rendered_text_is_rendered_without_writing(self):
+		document = baker.make(InformationDocument, text_en='old text')
+		document.update_rendered_text()
+		document.save()
+
+		InformationDocument.objects.filter(pk=document.pk).update(text_en='new text')
+		with CaptureQueriesContext(connection) as queries:
+			response = self.app.get(reverse('view', args=[document.url_title]), user=self.user)
+		self.assertIn('new text', response.body.decode('utf-8'))
+		self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE "documents_document"')])
+		document.refresh_from_db()
+		self.assertIn('old text', document.html_en)
+
+	def test_changed_link_target_marks_linking_documents_stale(self):
+		linked_document = baker.make(InformationDocument)
+		document = baker.make(InformationDocument, text_en='[link](document:{})'.format(linked_document.id))
+		document.update_rendered_text()
+		document.save()
+		other_document = baker.make(InformationDocument, text_en='text')
+		other_document.update_rendered_text()
+		other_document.save()
+		other_hash = other_document.rendered_text_hash
+
+		linked_document.url_title = 'changed_url'
+		linked_document.save()
+		document.refresh_from_db()
+		self.assertEqual(document.rendered_text_hash, '')
+		with translation.override('en'):
+			self.assertIn('changed_url', document.get_rendered_text()[0])
+		other_document.refresh_from_db()
+		self.assertEqual(other_document.rendered_text_hash, other_hash)
+
+		call_command('render_documents', jobs=1, stale=True, stdout=StringIO())
+		document.refresh_from_db()
+		self.assertIn('changed_url', document.html_en)
+		self.assertEqual(document.rendered_text_hash, Document.get_rendered_text_hash(document.text_de, document.text_en))
+
+		linked_document.delete()
+		document.refresh_from_db()
+		with translation.override('en'):
+			self.assertIn('[missing link]', document.get_rendered_text()[0])
+
+	def test_changed_abbreviation_marks_documents_containing_it_stale(self):
+		document = baker.make(InformationDocument, text_en='The ABBR met.', text_de='')
+		document.update_rendered_text()
+		document.save()
+
+		abbreviation = AbbreviationExplanation.objects.create(abbreviation='ABBR', explanation='Abbreviation')
+		document.refresh_from_db()
+		self.assertEqual(document.rendered_text_hash, '')
+		with translation.override('en'):
+			self.assertIn('<abbr title="Abbreviation">ABBR</abbr>', document.get_rendered_text()[0])
+
+		document.update_rendered_text()
+		document.save()
+		abbreviation = AbbreviationExplanation.objects.get(pk=abbreviation.pk)
+		abbreviation.abbreviation = 'OTHER'
+		abbreviation.save()
+		document.refresh_from_db()
+		with translation.override('en'):
+			self.assertNotIn('<abbr', document.get_rendered_text()[0])
+
+	def test_rendered_text_is_not_versioned(self):
+		document = baker.prepare(InformationDocument, text_en='text')
+		with transaction.atomic(), revisions.create_revision():
+			document.update_rendered_text()
+			document.save()
+		version = Version.objects.get_for_object(document).get()
+		self.assertNotIn('html_en', version.field_dict)
+
+	def test_render_documents_command(self):
+		documents = baker.make(InformationDocument, text_en='# title', _quantity=3)
+		call_command('render_documents', jobs=1, batch_size=2, stdout=StringIO())
+		for document in documents:
+			document.refresh_from_db()
+			self.assertEqual(document.html_en, '<h2 id="title">title</h2>')
+			self.assertEqual(document.rendered_text_hash, Document.get_rendered_text_hash(document.text_de, document.text_en))
+
+
 class TestPreview(WebTest):
 	csrf_checks = False
 
@@ -1471,6 +1721,477 @@ class TestPreview(WebTest):
 			self.assertIn(preview_url, response.body.decode('utf-8'))
 
 
+class TestEditorConsumer(TransactionTestCase):
+
+	def setUp(self):
+		self.user = baker.make(UserProfile, is_superuser=True)
+		self.document = baker.make(InformationDocument)
+		self.document.set_all_permissions(baker.make(Group))
+
+	def communicator(self, consumer, user, url):
+		communicator = WebsocketCommunicator(consumer, url)
+		communicator.scope.update({
+			'user': user,
+			'session': {},
+			'cookies': {},
+			'url_route': {'kwargs': {'hash_value': self.document.hash_value}},
+		})
+		return communicator
+
+	def test_texts_are_rendered_for_editor_and_preview(self):
+		async def render():
+			editor = self.communicator(EditorConsumer, self.user, '/ws/editor/')
+			preview = self.communicator(PreviewConsumer, self.user, '/ws/preview/?language=de')
+			self.assertTrue((await editor.connect())[0])
+			self.assertTrue((await preview.connect())[0])
+
+			await editor.send_json_to({'language': 'de', 'text': 'First\n\nSecond'})
+			self.assertEqual(await editor.receive_json_from(timeout=5), {'language': 'de', 'text': '<p>First</p>\n<p>Second</p>'})
+			self.assertEqual(await preview.receive_json_from(), {'blocks': 2, 'changed': {'0': '<p>First</p>', '1': '<p>Second</p>'}})
+
+			await editor.send_json_to({'language': 'de', 'text': 'First\n\nChanged'})
+			await editor.receive_json_from(timeout=5)
+			self.assertEqual(await preview.receive_json_from(), {'blocks': 2, 'changed': {'1': '<p>Changed</p>'}})
+
+			await editor.disconnect()
+			await preview.disconnect()
+
+		async_to_sync(render)()
+
+	@override_settings(PREVIEW_INTERVAL=0.05)
+	def test_previews_of_alternating_languages_only_contain_changed_blocks(self):
+		async def render():
+			editor = self.communicator(EditorConsumer, self.user, '/ws/editor/')
+			previews = {
+				language: self.communicator(PreviewConsumer, self.user, '/ws/preview/?language=' + language)
+				for language in ['de', 'en']
+			}
+			self.assertTrue((await editor.connect())[0])
+			for preview in previews.values():
+				self.assertTrue((await preview.connect())[0])
+
+			await editor.send_json_to({'language': 'de', 'text': 'Erster\n\nZweiter'})
+			await editor.receive_json_from(timeout=5)
+			self.assertEqual(await previews['de'].receive_json_from(), {'blocks': 2, 'changed': {'0': '<p>Erster</p>', '1': '<p>Zweiter</p>'}})
+
+			await editor.send_json_to({'language': 'en', 'text': 'First\n\nSecond'})
+			await editor.receive_json_from(timeout=5)
+			self.assertEqual(await previews['en'].receive_json_from(), {'blocks': 2, 'changed': {'0': '<p>First</p>', '1': '<p>Second</p>'}})
+
+			await editor.send_json_to({'language': 'de', 'text': 'Erster\n\nGeändert'})
+			await editor.receive_json_from(timeout=5)
+			self.assertEqual(await previews['de'].receive_json_from(), {'blocks': 2, 'changed': {'1': '<p>Geändert</p>'}})
+			self.assertTrue(await previews['en'].receive_nothing())
+
+			await editor.disconnect()
+			for preview in previews.values():
+				await preview.disconnect()
+
+		async_to_sync(render)()
+
+	def test_editors_of_a_document_share_the_rendering(self):
+		started = threading.Event()
+		release = threading.Event()
+		rendered_texts = []
+
+		def blocking_render_preview(hash_value, text, language):
+			rendered_texts.append(text)
+			started.set()
+			release.wait(5)
+			return render_preview(hash_value, text, language)
+
+		async def render():
+			editors = [self.communicator(EditorConsumer, self.user, '/ws/editor/') for __ in range(2)]
+			for editor in editors:
+				self.assertTrue((await editor.connect())[0])
+
+			await editors[0].send_json_to({'language': 'de', 'text': 'First'})
+			await asyncio.get_event_loop().run_in_executor(None, started.wait, 5)
+			# both texts arrive while the first one is rendered, so only the latest is rendered next
+			await editors[1].send_json_to({'language': 'de', 'text': 'Second'})
+			await editors[0].send_json_to({'language': 'de', 'text': 'Third'})
+			# let the consumers handle both texts before the first one is rendered
+			await editors[0].receive_nothing()
+			release.set()
+
+			for editor in editors:
+				self.assertEqual(await editor.receive_json_from(timeout=5), {'language': 'de', 'text': '<p>First</p>'})
+				self.assertEqual(await editor.receive_json_from(timeout=5), {'language': 'de', 'text': '<p>Third</p>'})
+				self.assertTrue(await editor.receive_nothing())
+			self.assertEqual(rendered_texts, ['First', 'Third'])
+
+			for editor in editors:
+				await editor.disconnect()
+
+		with patch('_1327.documents.consumers.render_preview', blocking_render_preview):
+			async_to_sync(render)()
+
+	def test_malformed_messages_are_ignored(self):
+		async def render():
+			editor = self.communicator(EditorConsumer, self.user, '/ws/editor/')
+			self.assertTrue((await editor.connect())[0])
+
+			await editor.send_to(text_data='not json')
+			await editor.send_json_to({'text': 'no language'})
+			await editor.send_json_to(['not', 'an', 'object'])
+			await editor.send_json_to({'language': 'de', 'text': 'Text'})
+			self.assertEqual(await editor.receive_json_from(timeout=5), {'language': 'de', 'text': '<p>Text</p>'})
+			self.assertTrue(await editor.receive_nothing())
+
+			await editor.disconnect()
+
+		async_to_sync(render)()
+
+	def test_editor_without_permission_is_rejected(self):
+		async def connect():
+			editor = self.communicator(EditorConsumer, baker.make(UserProfile), '/ws/editor/')
+			connected, __ = await editor.connect()
+			self.assertFalse(connected)
+
+		async_to_sync(connect)()
+
+
+class TestPreviewConsumer(TestCase):
+
+	def test_merge_preview_patches(self):
+		older = {'blocks': 3, 'changed': {'0': '<p>a</p>', '2': '<p>c</p>'}}
+		newer = {'blocks': 2, 'changed': {'1': '<p>b</p>'}}
+		self.assertEqual(merge_preview_patches(older, newer), {'blocks': 2, 'changed': {'0': '<p>a</p>', '1': '<p>b</p>'}})
+
+	@override_settings(PREVIEW_INTERVAL=0.05)
+	def test_previews_are_combined_between_sends(self):
+		async def update():
+			consumer = PreviewConsumer({'type': 'websocket'})
+			consumer.hash_value = 'hash'
+			consumer.group_name = 'hash'
+			consumer.pending_patch = None
+			consumer.send_task = None
+			sent = []
+
+			async def send(text_data):
+				sent.append(json.loads(text_data))
+			consumer.send = send
+
+			metrics = dict(preview_metrics)
+			for index, html in enumerate(['<p>a</p>', '<p>b</p>', '<p>c</p>']):
+				await consumer.update_preview({'message': json.dumps({'blocks': 3, 'changed': {index: html}})})
+				# let the consumer send the first preview
+				await asyncio.sleep(0)
+			await consumer.update_preview({'message': 'not json'})
+			await consumer.send_task
+
+			self.assertEqual(sent, [
+				{'blocks': 3, 'changed': {'0': '<p>a</p>'}},
+				{'blocks': 3, 'changed': {'1': '<p>b</p>', '2': '<p>c</p>'}},
+			])
+			self.assertEqual(preview_metrics['previews_sent'] - metrics.get('previews_sent', 0), 2)
+			self.assertEqual(preview_metrics['previews_dropped'] - metrics.get('previews_dropped', 0), 1)
+
+		async_to_sync(update)()
+
+
+class TestVisibilityIndex(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = baker.make(UserProfile)
+		cls.group = baker.make(Group)
+		cls.user.groups.add(cls.group)
+		cls.documents = baker.make(InformationDocument, _quantity=3)
+
+	def visible_documents(self, user):
+		queryset = InformationDocument.objects.all()
+		return set(get_objects_for_user(user, InformationDocument.VIEW_PERMISSION_NAME, klass=queryset))
+
+	def test_index_follows_permission_changes(self):
+		first, second, third = self.documents
+		self.assertEqual(self.visible_documents(self.user), set())
+
+		assign_perm(first.view_permission_name, self.user, first)
+		assign_perm(second.view_permission_name, self.group, second)
+		assign_perm(third.edit_permission_name, self.group, third)
+		self.assertEqual(self.visible_documents(self.user), {first, second})
+		self.assertEqual(self.visible_documents(self.user), set(guardian_get_objects_for_user(self.user, first.view_permission_name, klass=InformationDocument)))
+
+		remove_perm(second.view_permission_name, self.group, second)
+		self.assertEqual(self.visible_documents(self.user), {first})
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
+	def test_anonymous_and_superusers(self):
+		assign_perm(self.documents[0].view_permission_name, get_anonymous_user(), self.documents[0])
+		self.assertEqual(self.visible_documents(AnonymousUser()), {self.documents[0]})
+		self.assertEqual(self.visible_documents(baker.make(UserProfile, is_superuser=True)), set(self.documents))
+
+	def test_lookup_is_a_single_query(self):
+		for document in self.documents:
+			assign_perm(document.view_permission_name, self.group, document)
+		self.user.has_perm(InformationDocument.get_view_permission())
+		with self.assertNumQueries(1):
+			object_ids = set(VisibilityIndex.object_ids_for_user(self.user, ContentType.objects.get_for_model(InformationDocument), InformationDocument.VIEW_PERMISSION_NAME))
+		self.assertEqual(object_ids, {document.id for document in self.documents})
+
+	def test_deleting_a_group_with_permissions(self):
+		group = baker.make(Group)
+		assign_perm(self.documents[0].view_permission_name, group, self.documents[0])
+		group.delete()
+		self.assertFalse(VisibilityIndex.objects.filter(group_id=group.id).exists())
+
+	def test_setting_and_resetting_all_permissions(self):
+		first, second, __ = self.documents
+		first.set_all_permissions(self.group)
+		first.set_all_permissions(self.user)
+		second.set_all_permissions(self.group)
+		self.assertEqual(set(get_perms(self.group, first)), {'view_informationdocument', 'change_informationdocument', 'delete_informationdocument'})
+		self.assertEqual(self.visible_documents(self.user), {first, second})
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
+		first.delete_all_permissions(self.group)
+		self.assertEqual(get_perms(self.group, first), [])
+		self.assertEqual(self.visible_documents(self.user), {first, second})
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
+		first.reset_permissions()
+		self.assertEqual(get_perms(self.user, first), [])
+		self.assertEqual(self.visible_documents(self.user), {second})
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
+	def test_rebuild_repairs_the_index(self):
+		assign_perm(self.documents[0].view_permission_name, self.group, self.documents[0])
+		VisibilityIndex.objects.all().delete()
+		VisibilityIndex.objects.create(user=self.user, permission_id=self.documents[1].get_permission_ids([self.documents[1].view_permission_name])[0], object_id=self.documents[1].id)
+		with self.assertRaises(CommandError):
+			call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+
+		call_command('rebuild_visibility_index', stdout=StringIO())
+		call_command('rebuild_visibility_index', check=True, stdout=StringIO())
+		self.assertEqual(self.visible_documents(self.user), {self.documents[0]})
+
+	def test_permissions_of_a_principal_are_separate_rows(self):
+		first, second, __ = self.documents
+		assign_perm(first.view_permission_name, self.group, first)
+		assign_perm(second.view_permission_name, self.group, second)
+		self.assertEqual(VisibilityIndex.objects.filter(group=self.group).count(), 2)
+
+		# removing a permission only deletes its own row
+		remove_perm(first.view_permission_name, self.group, first)
+		self.assertEqual(list(VisibilityIndex.objects.filter(group=self.group).values_list('object_id', flat=True)), [second.id])
+
+
+class TestRevisionMetadata(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.users = baker.make(UserProfile, _quantity=2)
+		cls.document = baker.make(InformationDocument)
+
+	def create_revision(self, user):
+		with transaction.atomic(), revisions.create_revision():
+			self.document.save()
+			revisions.set_user(user)
+
+	def test_metadata_follows_revisions(self):
+		self.assertEqual(self.document.num_revisions, 0)
+		self.assertIsNone(self.document.last_change)
+		self.assertIsNone(self.document.last_author)
+
+		self.create_revision(self.users[0])
+		self.create_revision(self.users[1])
+		self.create_revision(self.users[1])
+
+		document = InformationDocument.objects.get(pk=self.document.pk)
+		last_change = Version.objects.get_for_object(document).first().revision.date_created
+		with self.assertNumQueries(1):
+			self.assertEqual(document.num_revisions, 3)
+			self.assertEqual(document.last_author, self.users[1])
+			self.assertEqual(document.last_change, last_change)
+		self.assertEqual(document.authors(), set(self.users))
+
+	def test_deleting_revisions_updates_metadata(self):
+		self.create_revision(self.users[0])
+		self.create_revision(self.users[1])
+		self.create_revision(self.users[0])
+		versions = list(Version.objects.get_for_object(self.document).select_related('revision'))
+
+		Revision.objects.filter(pk=versions[0].revision_id).delete()
+		document = InformationDocument.objects.get(pk=self.document.pk)
+		self.assertEqual(document.num_revisions, 2)
+		self.assertEqual(document.last_author, self.users[1])
+		self.assertEqual(document.last_change, versions[1].revision.date_created)
+
+		versions[1].delete()
+		document = InformationDocument.objects.get(pk=self.document.pk)
+		self.assertEqual(document.num_revisions, 1)
+		self.assertEqual(document.authors(), {self.users[0]})
+
+	def test_rebuild_command(self):
+		self.create_revision(self.users[0])
+		self.create_revision(self.users[1])
+		expected = RevisionMetadata.objects.values_list('document_id', 'num_revisions', 'last_change', 'last_author_id').get()
+
+		RevisionMetadata.objects.all().delete()
+		call_command('rebuild_revision_metadata', stdout=StringIO())
+		self.assertEqual(RevisionMetadata.objects.values_list('document_id', 'num_revisions', 'last_change', 'last_author_id').get(), expected)
+		self.assertEqual(InformationDocument.objects.get(pk=self.document.pk).authors(), set(self.users))
+
+
+class TestDeltaRevisions(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = baker.make(UserProfile)
+		# the date is only converted from the default datetime when it is loaded
+		cls.document = MinutesDocument.objects.get(pk=baker.make(MinutesDocument, text_de='', text_en='').pk)
+
+	def create_revisions(self, num_revisions):
+		texts = []
+		for index in range(num_revisions):
+			self.document.text_en = '\n'.join('line {}'.format(number) for number in range(50 + index * 3))
+			self.document.text_de = 'Zeile {}'.format(index)
+			with transaction.atomic(), revisions.create_revision():
+				self.document.save()
+				revisions.set_user(self.user)
+			self.run_commit_callbacks()
+			texts.append((self.document.text_de, self.document.text_en))
+		return texts
+
+	def run_commit_callbacks(self):
+		# versions are only stored as deltas once their revision is committed, which never happens within a TestCase
+		callbacks, connection.run_on_commit = connection.run_on_commit, []
+		for __, callback in callbacks:
+			callback()
+
+	def document_versions(self):
+		return Version.objects.filter(content_type=ContentType.objects.get_for_model(Document), object_id=str(self.document.pk)).order_by('pk')
+
+	def assert_texts(self, texts):
+		versions = list(Version.objects.get_for_object(self.document).reverse())
+		self.assertEqual(len(versions), len(texts))
+		for version, (text_de, text_en) in zip(versions, texts):
+			self.assertEqual(version.field_dict['text_de'], text_de)
+			self.assertEqual(version.field_dict['text_en'], text_en)
+
+	def test_versions_are_stored_as_deltas(self):
+		texts = self.create_revisions(12)
+		formats = list(self.document_versions().values_list('format', flat=True))
+		self.assertEqual(formats, ['json'] + ['delta_json'] * 9 + ['json', 'delta_json'])
+		self.assert_texts(texts)
+
+		# the latest version is the base of the next one
+		self.document_versions().last().revert()
+		self.assertEqual(MinutesDocument.objects.get(pk=self.document.pk).text_en, texts[-1][1])
+
+	def test_deleting_revisions_keeps_the_remaining_versions(self):
+		texts = self.create_revisions(12)
+		revision_ids = [version.revision_id for version in self.document_versions()]
+
+		Revision.objects.filter(pk=revision_ids[0]).delete()
+		self.assertEqual(list(self.document_versions().values_list('format', flat=True)), ['json'] + ['delta_json'] * 8 + ['json', 'delta_json'])
+		self.assert_texts(texts[1:])
+
+		# the new snapshot is deleted together with some of the deltas referring to it
+		Revision.objects.filter(pk__in=revision_ids[1:4]).delete()
+		self.assert_texts(texts[4:])
+		self.assertEqual(self.document_versions().first().format, 'json')
+
+	def test_versions_with_later_versions_stay_snapshots(self):
+		with patch.object(MinutesDocument, 'REVISION_SNAPSHOT_INTERVAL', None):
+			texts = self.create_revisions(3)
+		first, second, third = self.document_versions()
+
+		delta_serializer.store_as_delta(second, MinutesDocument.REVISION_SNAPSHOT_INTERVAL)
+		self.assertEqual(second.format, 'json')
+		delta_serializer.store_as_delta(third, MinutesDocument.REVISION_SNAPSHOT_INTERVAL)
+		self.assertEqual(third.format, 'delta_json')
+		self.assertEqual(json.loads(third.serialized_data)['snapshot'], second.pk)
+		self.assert_texts(texts)
+
+	def test_compaction(self):
+		with patch.object(MinutesDocument, 'REVISION_SNAPSHOT_INTERVAL', None):
+			texts = self.create_revisions(4)
+		self.assertEqual(set(self.document_versions().values_list('format', flat=True)), {'json'})
+		size_before = sum(len(data) for data in self.document_versions().values_list('serialized_data', flat=True))
+
+		output = StringIO()
+		call_command('compact_revisions', stdout=output)
+		self.assertIn('Changed 3 versions', output.getvalue())
+		self.assertEqual(list(self.document_versions().values_list('format', flat=True)), ['json'] + ['delta_json'] * 3)
+		size_after = sum(len(data) for data in self.document_versions().values_list('serialized_data', flat=True))
+		self.assertLess(size_after, size_before / 2)
+		self.assert_texts(texts)
+
+		with patch.object(MinutesDocument, 'REVISION_SNAPSHOT_INTERVAL', None):
+			call_command('compact_revisions', stdout=output)
+		self.assertEqual(set(self.document_versions().values_list('format', flat=True)), {'json'})
+		self.assert_texts(texts)
+
+
+class TestVersionsPage(WebTest):
+	csrf_checks = False
+	extra_environ = {'HTTP_ACCEPT_LANGUAGE': 'en'}
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = baker.make(UserProfile, is_superuser=True)
+		cls.document = baker.make(InformationDocument, text_de='', text_en='')
+		for index in range(5):
+			cls.document.text_en = '\n'.join('line {}'.format(number) for number in range(20 + index))
+			with transaction.atomic(), revisions.create_revision():
+				cls.document.save()
+				revisions.set_user(cls.user)
+				revisions.set_comment('revision {}'.format(index))
+		cls.versions = list(Version.objects.get_for_object(cls.document))
+
+	def setUp(self):
+		cache.clear()
+
+	@override_settings(VERSIONS_PAGE_SIZE=2)
+	def test_versions_are_paginated(self):
+		response = self.app.get(reverse('versions', args=[self.document.url_title]), user=self.user)
+		self.assertEqual(len(response.html.select('#versions tr')), 2)
+		self.assertEqual(len(response.html.select('#versions .version-revert-button')), 1)
+		self.assertEqual(response.html.select_one('#load-more-versions')['data-next-page'], '2')
+
+		response = self.app.get(reverse('versions_list', args=[self.document.url_title]), {'page': 3}, user=self.user)
+		self.assertEqual(response.json['next_page'], None)
+		self.assertEqual(len(response.json['versions']), 1)
+		version = response.json['versions'][0]
+		self.assertEqual(version['id'], self.versions[-1].pk)
+		self.assertEqual(version['number'], 0)
+		self.assertEqual(version['comment'], 'revision 0')
+		self.assertFalse(version['is_current'])
+
+		self.app.get(reverse('versions_list', args=[self.document.url_title]), {'page': 4}, user=self.user, status=404)
+
+	def test_diff_is_rendered_and_cached(self):
+		url = reverse('versions_diff', args=[self.document.url_title])
+		params = {'a': self.versions[-1].pk, 'b': self.versions[0].pk}
+		response = self.app.get(url, params, user=self.user)
+		self.assertIn('<td class="insert">line 23</td>', response.json['EN'])
+		self.assertNotIn('line 5<', response.json['EN'])
+		self.assertIn('class="skip"', response.json['EN'])
+
+		with self.assertNumQueries(0):
+			self.assertEqual(get_version_diff(self.versions[-1], self.versions[0]), response.json)
+
+	def test_diff_needs_versions_of_the_document(self):
+		url = reverse('versions_diff', args=[self.document.url_title])
+		other_document = baker.make(InformationDocument)
+		with transaction.atomic(), revisions.create_revision():
+			other_document.save()
+		other_version = Version.objects.get_for_object(other_document).get()
+
+		self.app.get(url, {'a': self.versions[0].pk}, user=self.user, status=400)
+		self.app.get(url, {'a': self.versions[0].pk, 'b': 'abc'}, user=self.user, status=400)
+		self.app.get(url, {'a': self.versions[0].pk, 'b': other_version.pk}, user=self.user, status=404)
+		self.app.get(url, {'a': self.versions[0].pk, 'b': 0}, user=self.user, status=404)
+
+	def test_versions_need_edit_permission(self):
+		user = baker.make(UserProfile)
+		params = {'a': self.versions[1].pk, 'b': self.versions[0].pk}
+		self.app.get(reverse('versions_list', args=[self.document.url_title]), user=user, status=403)
+		self.app.get(reverse('versions_diff', args=[self.document.url_title]), params, user=user, status=403)
+
+
 class TestPermissionOverview(WebTest):
 	csrf_checks = False
 
@@ -1536,6 +2257,31 @@ class TestPermissionOverview(WebTest):
 			for icon in icons:
 				self.assertIn(icon, response)
 
+	def test_overview_is_cached_until_permissions_change(self):
+		other_group = baker.make(Group, name='other group')
+		assign_perm(self.poll.view_permission_name, other_group, self.poll)
+		expected = [
+			(settings.ANONYMOUS_GROUP_NAME, 'view'),
+			(settings.UNIVERSITY_GROUP_NAME, 'view'),
+			(settings.STUDENT_GROUP_NAME, 'view'),
+			(settings.STAFF_GROUP_NAME, 'edit'),
+			(self.group.name, 'edit'),
+			('other group', 'view'),
+		]
+		with self.assertNumQueries(1):
+			self.assertEqual(compute_document_permission_overview(self.poll), expected)
+		self.assertEqual(document_permission_overview(self.user, self.poll), expected)
+		with patch('_1327.main.utils.compute_document_permission_overview') as compute:
+			self.assertEqual(document_permission_overview(self.user, self.poll), expected)
+		compute.assert_not_called()
+
+		remove_perm(self.poll.view_permission_name, other_group, self.poll)
+		self.assertEqual(document_permission_overview(self.user, self.poll), expected[:-1])
+
+		self.group.name = 'renamed group'
+		self.group.save()
+		self.assertIn(('renamed group', 'edit'), document_permission_overview(self.user, self.poll))
+
 
 class DocumentCreationTests(WebTest):
 
@@ -31,6 +31,8 @@ urlpatterns = [
 
 document_urlpatterns = [
 	path("<slugwithslash:title>/versions", views.versions, name="versions"),
+	path("<slugwithslash:title>/versions/list", views.versions_list, name="versions_list"),
+	path("<slugwithslash:title>/versions/diff", views.versions_diff, name="versions_diff"),
 	path("<slugwithslash:title>/permissions", views.permissions, name="permissions"),
 	path("<slugwithslash:title>/attachments", views.attachments, name="attachments"),
 ]
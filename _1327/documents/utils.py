@@ -1,17 +1,159 @@
+from difflib import SequenceMatcher
 from functools import lru_cache
-import json
 import re
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import SuspiciousOperation
+from django.core.paginator import Paginator
 from django.db import transaction
-from django.utils import timezone
+from django.db.models import CharField, Exists, OuterRef, Q
+from django.db.models.functions import Cast
+from django.utils import dateformat, timezone, translation
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext as _
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.utils import get_anonymous_user
 from reversion import revisions
 from reversion.models import Version
 
 from _1327.documents.forms import AttachmentForm
-from _1327.documents.models import Document, TemporaryDocumentText
+from _1327.documents.models import Document, RevisionMetadata, TemporaryDocumentText, VisibilityIndex
+
+
+# the languages a document has a text in
+TEXT_LANGUAGES = ('de', 'en')
+
+
+def preview_group_name(hash_value, language):
+	# the clients of the live preview of a document only receive the text of the language they show
+	return 'preview.{}.{}'.format(hash_value, language)
+
+
+def preview_blocks_key(hash_value, language):
+	return 'preview_blocks:{}:{}'.format(hash_value, language)
+
+
+def preview_patch(hash_value, language, rendered_blocks):
+	"""
+		Returns the blocks that changed since the last preview of the text in the given language sent to the clients of
+		a document, together with the number of blocks the preview has now. Only the cache keys of the blocks are
+		remembered between two previews.
+	"""
+	key = preview_blocks_key(hash_value, language)
+	previous_block_keys = cache.get(key, [])
+	cache.set(key, [block_key for block_key, __ in rendered_blocks], None)
+
+	changed = {
+		index: html for index, (block_key, html) in enumerate(rendered_blocks)
+		if index >= len(previous_block_keys) or previous_block_keys[index] != block_key
+	}
+	return {'blocks': len(rendered_blocks), 'changed': changed}
+
+
+def merge_preview_patches(older, newer):
+	# a client that has not received the older preview yet only needs the combination of both
+	changed = {index: html for index, html in older['changed'].items() if int(index) < newer['blocks']}
+	changed.update(newer['changed'])
+	return {'blocks': newer['blocks'], 'changed': changed}
+
+
+def reset_preview_blocks(hash_value, language):
+	# the next preview then contains all blocks, e.g. for a client that just connected
+	cache.delete(preview_blocks_key(hash_value, language))
+
+
+def get_objects_for_user(user, permission_name, klass):
+	"""
+		Returns the documents of the queryset klass the user has the given permission for, like guardian's
+		get_objects_for_user, but looks up the object permissions in the visibility index.
+	"""
+	if user.is_anonymous:
+		user = get_anonymous_user()
+	if user.is_superuser:
+		return klass
+
+	content_type = ContentType.objects.get_for_model(klass.model)
+	if '.' not in permission_name:
+		permission_name = '{}.{}'.format(content_type.app_label, permission_name)
+	if user.has_perm(permission_name):
+		return klass
+
+	codename = permission_name.split('.')[1]
+	return klass.filter(pk__in=VisibilityIndex.object_ids_for_user(user, content_type, codename))
+
+
+def build_visibility_index(content_type_ids):
+	"""
+		Returns the rows of the visibility index as ('user_id' or 'group_id', principal id, permission id, object id),
+		derived from the object permissions for the given content types.
+	"""
+	rows = set()
+	for permission_model, principal_field in [(UserObjectPermission, 'user_id'), (GroupObjectPermission, 'group_id')]:
+		permissions = permission_model.objects.filter(content_type_id__in=content_type_ids)
+		for principal_id, permission_id, object_pk in permissions.values_list(principal_field, 'permission_id', 'object_pk'):
+			rows.add((principal_field, principal_id, permission_id, int(object_pk)))
+	return rows
+
+
+def create_visibility_index(rows):
+	VisibilityIndex.objects.bulk_create(
+		(
+			VisibilityIndex(permission_id=permission_id, object_id=object_id, **{principal_field: principal_id})
+			for principal_field, principal_id, permission_id, object_id in rows
+		),
+		batch_size=1000,
+	)
+
+
+def build_revision_metadata(content_type_ids, document_ids=None):
+	"""
+		Returns the number, the date and the authors of the revisions of all or the given documents, derived from the
+		versions of the given content types.
+	"""
+	versions = Version.objects.filter(content_type_id__in=content_type_ids)
+	if document_ids is not None:
+		versions = versions.filter(object_id__in=[str(document_id) for document_id in document_ids])
+	entries = {}
+	for object_id, date_created, user_id in versions.order_by('revision__date_created', 'revision_id').values_list('object_id', 'revision__date_created', 'revision__user_id'):
+		entry = entries.setdefault(int(object_id), {'num_revisions': 0, 'authors': set()})
+		entry['num_revisions'] += 1
+		entry['last_change'] = date_created
+		entry['last_author_id'] = user_id
+		if user_id is not None:
+			entry['authors'].add(user_id)
+	# versions of deleted documents are kept by reversion
+	existing_ids = set(Document._base_manager.filter(id__in=entries.keys()).values_list('id', flat=True))
+	return {document_id: entry for document_id, entry in entries.items() if document_id in existing_ids}
+
+
+def create_revision_metadata(entries):
+	RevisionMetadata.objects.bulk_create(
+		RevisionMetadata(
+			document_id=document_id,
+			num_revisions=entry['num_revisions'],
+			last_change=entry['last_change'],
+			last_author_id=entry['last_author_id'],
+		)
+		for document_id, entry in entries.items()
+	)
+	RevisionMetadata.authors.through.objects.bulk_create(
+		RevisionMetadata.authors.through(revisionmetadata_id=document_id, userprofile_id=user_id)
+		for document_id, entry in entries.items() for user_id in entry['authors']
+	)
+
+
+def document_content_type_ids():
+	# revisions contain a version of every document and of its Document base model, only the former are counted
+	return [content_type.id for content_type in ContentType.objects.get_for_models(*Document.__subclasses__()).values()]
+
+
+def rebuild_revision_metadata(document_ids):
+	with transaction.atomic():
+		RevisionMetadata.objects.filter(document_id__in=document_ids).delete()
+		create_revision_metadata(build_revision_metadata(document_content_type_ids(), document_ids))
 
 
 def get_new_autosaved_pages_for_user(user, content_type):
@@ -27,12 +169,47 @@ def get_new_autosaved_pages_for_user(user, content_type):
 	return autosaved_pages
 
 
-def delete_old_empty_pages():
-	all_documents = Document.objects.filter(created__lte=timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER)
-	for document in all_documents:
-		if len(Version.objects.get_for_object(document)) == 0 and \
-			not TemporaryDocumentText.objects.filter(document=document).exists():
-				document.delete()
+def render_documents(document_ids):
+	documents = Document.objects.non_polymorphic().filter(id__in=document_ids).values_list('id', 'text_de', 'text_en')
+	for document_id, text_de, text_en in documents:
+		Document.objects.filter(id=document_id).update(**Document.render_texts(text_de, text_en))
+	return len(documents)
+
+
+def mark_documents_containing_stale(*strings):
+	"""
+		Marks the stored texts of all documents containing one of the strings as outdated with a single update, e.g. the
+		links to a document whose url has changed or an abbreviation whose explanation has changed. Such texts are
+		rendered when they are shown until the render_documents command stores them again.
+	"""
+	query = Q()
+	for string in strings:
+		query |= Q(text_de__contains=string) | Q(text_en__contains=string)
+	return Document.objects.non_polymorphic().filter(query).update(rendered_text_hash='')
+
+
+def get_old_empty_pages():
+	"""
+		Returns the ids of documents that were created some time ago and have neither a revision nor an autosave, i.e.
+		pages that were created but never saved.
+	"""
+	content_types = ContentType.objects.get_for_models(Document, *Document.__subclasses__()).values()
+	versions = Version.objects.filter(content_type__in=content_types, object_id=Cast(OuterRef('pk'), CharField()))
+	autosaves = TemporaryDocumentText.objects.filter(document=OuterRef('pk'))
+	return Document.objects.non_polymorphic().filter(created__lte=timezone.now() - settings.DELETE_EMPTY_PAGE_AFTER) \
+		.annotate(has_versions=Exists(versions), has_autosaves=Exists(autosaves)) \
+		.filter(has_versions=False, has_autosaves=False).values_list('pk', flat=True)
+
+
+def delete_old_empty_pages(batch_size=100):
+	num_deleted = 0
+	while True:
+		document_ids = list(get_old_empty_pages()[:batch_size])
+		if not document_ids:
+			return num_deleted
+		with transaction.atomic():
+			Document.objects.non_polymorphic().filter(pk__in=document_ids).delete()
+		num_deleted += len(document_ids)
 
 
 def handle_edit(request, document, formset=None, initial=None, creation_group=None):
@@ -67,6 +244,7 @@ def handle_edit(request, document, formset=None, initial=None, creation_group=No
 				if Document.objects.filter(url_title=document.url_title).exclude(id=document.id).exists():
 					document.url_title = document.generate_default_slug(document.url_title)
 
+				document.update_rendered_text()
 				with revisions.create_revision():
 					document.save()
 					document.save_formset(formset)
@@ -142,15 +320,101 @@ def handle_autosave(request, document):
 			temporary_document_text.save()
 
 
-def prepare_versions(document):
-	versions = Version.objects.get_for_object(document).reverse()
-
-	# prepare data for the template
-	version_list = []
-	for id, version in enumerate(versions):
-		version_list.append((id, version, json.dumps(version.field_dict['text_de']).strip('"'), json.dumps(version.field_dict['text_en']).strip('"')))
-
-	return version_list
+def get_versions_page(document, page_number):
+	"""
+		Returns the metadata of one page of the revisions of a document, newest first. The revisions are numbered from
+		the oldest one, which has number 0.
+	"""
+	versions = Version.objects.get_for_object(document).select_related('revision__user')
+	page = Paginator(versions, settings.VERSIONS_PAGE_SIZE).page(page_number)
+	num_versions = page.paginator.count
+	return {
+		'versions': [
+			{
+				'id': version.pk,
+				'number': num_versions - page.start_index() - index,
+				'date': dateformat.format(timezone.localtime(version.revision.date_created), 'd.m.Y, H:i'),
+				'comment': version.revision.get_comment(),
+				'user': str(version.revision.user) if version.revision.user else '',
+				# the newest version is the current state of the document
+				'is_current': page.start_index() + index == 1,
+			}
+			for index, version in enumerate(page.object_list)
+		],
+		'next_page': page.next_page_number() if page.has_next() else None,
+	}
+
+
+@lru_cache(maxsize=None)
+def get_revert_field_plan(document_class):
+	"""
+		Returns the names of the parent links and of the many to many fields in the versions of a document class. Parent
+		links are not restored and many to many fields can only be restored after the document has been saved.
+	"""
+	parent_links = frozenset(field.attname for field in document_class._meta.concrete_fields if field.one_to_one and field.remote_field.parent_link)
+	many_to_many_fields = frozenset(field.attname for field in document_class._meta.many_to_many)
+	return parent_links, many_to_many_fields
+
+
+def version_diff_key(version_a, version_b):
+	return 'version_diff:{}:{}:{}'.format(version_a.pk, version_b.pk, translation.get_language())
+
+
+def get_version_diff(version_a, version_b):
+	"""
+		Returns the diffs of the texts of two versions in both languages. Versions never change, so the diffs are cached
+		without a timeout.
+	"""
+	key = version_diff_key(version_a, version_b)
+	diffs = cache.get(key)
+	if diffs is None:
+		fields_a, fields_b = version_a.field_dict, version_b.field_dict
+		diffs = {
+			language.upper(): render_diff(fields_a['text_' + language], fields_b['text_' + language])
+			for language in ['de', 'en']
+		}
+		cache.set(key, diffs, timeout=None)
+	return diffs
+
+
+def render_diff(text_a, text_b):
+	"""
+		Renders a side by side diff with the markup of jsdifflib. Unchanged lines that are not close to a change are
+		collapsed into a single skipped row.
+	"""
+	lines_a, lines_b = text_a.splitlines(), text_b.splitlines()
+	classes = {
+		'equal': ('equal', 'equal'),
+		'replace': ('replace', 'replace'),
+		'delete': ('delete', 'empty'),
+		'insert': ('empty', 'insert'),
+	}
+
+	def cell(lines, line_number, css_class):
+		if line_number is None:
+			return format_html('<th></th><td class="empty"></td>')
+		return format_html('<th>{}</th><td class="{}">{}</td>', line_number + 1, css_class, lines[line_number])
+
+	skipped_row = format_html('<tr><th>...</th><td class="skip"></td><th>...</th><td class="skip"></td></tr>')
+	rows = []
+	last_line_a = 0
+	for group in SequenceMatcher(None, lines_a, lines_b, autojunk=False).get_grouped_opcodes(settings.VERSIONS_DIFF_CONTEXT_LINES):
+		if group[0][1] > last_line_a:
+			rows.append(skipped_row)
+		for tag, start_a, end_a, start_b, end_b in group:
+			class_a, class_b = classes[tag]
+			for offset in range(max(end_a - start_a, end_b - start_b)):
+				line_a = start_a + offset if start_a + offset < end_a else None
+				line_b = start_b + offset if start_b + offset < end_b else None
+				rows.append(format_html('<tr>{}{}</tr>', cell(lines_a, line_a, class_a), cell(lines_b, line_b, class_b)))
+		last_line_a = group[-1][2]
+	if last_line_a < len(lines_a) or not rows:
+		rows.append(skipped_row)
+
+	return format_html(
+		'<table class="diff"><thead><tr><th></th><th class="texttitle">{}</th><th></th><th class="texttitle">{}</th></tr></thead><tbody>{}</tbody></table>',
+		_('Version A'), _('Version B'), mark_safe(''.join(rows)),
+	)
 
 
 def handle_attachment(request, document):
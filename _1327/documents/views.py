@@ -10,14 +10,15 @@ from django.contrib.admin.utils import NestedObjects
 from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied, SuspiciousOperation
-from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.core.paginator import InvalidPage
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.db.models import Q
 from django.forms import formset_factory
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, Http404, render
 from django.urls import reverse
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
-from guardian.shortcuts import get_objects_for_user
 from guardian.utils import get_anonymous_user
 
 from reversion import revisions
@@ -27,11 +28,13 @@ from sendfile import sendfile
 from _1327 import settings
 from _1327.documents.forms import get_permission_form
 from _1327.documents.models import Attachment, Document, TemporaryDocumentText
-from _1327.documents.utils import delete_cascade_to_json, delete_old_empty_pages, get_model_function, get_new_autosaved_pages_for_user, \
-	handle_attachment, handle_autosave, handle_edit, prepare_versions
+from _1327.documents.utils import delete_cascade_to_json, get_model_function, get_new_autosaved_pages_for_user, \
+	get_objects_for_user, get_revert_field_plan, get_version_diff, get_versions_page, handle_attachment, handle_autosave, handle_edit, preview_group_name, preview_patch, \
+	TEXT_LANGUAGES
 from _1327.information_pages.models import InformationDocument
 from _1327.information_pages.forms import InformationDocumentForm  # noqa
-from _1327.main.utils import convert_markdown, document_permission_overview
+from _1327.main.tools import get_language_code
+from _1327.main.utils import convert_markdown_blocks, document_permission_overview
 from _1327.minutes.models import MinutesDocument
 from _1327.minutes.forms import MinutesDocumentForm  # noqa
 from _1327.polls.models import Poll
@@ -43,7 +46,6 @@ def create(request, document_type):
 	content_type = ContentType.objects.get(model=document_type)
 	if request.user.has_perm("{app}.add_{model}".format(app=content_type.app_label, model=content_type.model)):
 		model_class = content_type.model_class()
-		delete_old_empty_pages()
 		title_en, title_de = model_class.generate_new_title()
 		url_title = "temp_{}_{}".format(datetime.utcnow().strftime("%d%m%Y%H%M%S%f"), model_class.generate_default_slug(title_en))
 		kwargs = {
@@ -104,6 +106,7 @@ def edit(request, title, new_autosaved_pages=None, initial=None):
 			'permission_overview': document_permission_overview(request.user, document),
 			'supported_image_types': settings.SUPPORTED_IMAGE_TYPES,
 			'formset': formset,
+			'editor_url': settings.EDITOR_URL,
 		})
 
 
@@ -133,20 +136,47 @@ def autosave(request, title):
 def versions(request, title):
 	document = get_object_or_404(Document, url_title=title)
 	check_permissions(document, request.user, [document.edit_permission_name])
-	document_versions = prepare_versions(document)
+	versions_page = get_versions_page(document, 1)
 
 	if not document.can_be_reverted:
 		messages.warning(request, _('This Document can not be reverted!'))
 
+	versions_url_name = document.get_versions_url_name()
 	return render(request, 'documents_versions.html', {
 		'active_page': 'versions',
-		'versions': document_versions,
+		'versions': versions_page['versions'],
+		'next_page': versions_page['next_page'],
+		'versions_list_url': reverse(versions_url_name + '_list', args=[document.url_title]),
+		'versions_diff_url': reverse(versions_url_name + '_diff', args=[document.url_title]),
 		'document': document,
 		'permission_overview': document_permission_overview(request.user, document),
 		'can_be_reverted': document.can_be_reverted,
 	})
 
 
+def versions_list(request, title):
+	document = get_object_or_404(Document, url_title=title)
+	check_permissions(document, request.user, [document.edit_permission_name])
+	try:
+		versions_page = get_versions_page(document, request.GET.get('page', 1))
+	except InvalidPage:
+		raise Http404
+	return JsonResponse(versions_page)
+
+
+def versions_diff(request, title):
+	document = get_object_or_404(Document, url_title=title)
+	check_permissions(document, request.user, [document.edit_permission_name])
+	try:
+		version_ids = [int(request.GET['a']), int(request.GET['b'])]
+	except (KeyError, ValueError):
+		raise SuspiciousOperation('Invalid versions')
+	versions = Version.objects.get_for_object(document).in_bulk(version_ids)
+	if len(versions) != len(set(version_ids)):
+		raise Http404
+	return JsonResponse(get_version_diff(versions[version_ids[0]], versions[version_ids[1]]))
+
+
 def view(request, title):
 	document = get_object_or_404(Document, url_title=title)
 	content_type = ContentType.objects.get_for_model(document)
@@ -160,9 +190,7 @@ def view(request, title):
 
 	if document.text == "" and (document.text_en != "" or document.text_de != ""):
 		messages.warning(request, _('The requested document is not available in the selected language. It will be shown in the available language instead.'))
-		text, toc = convert_markdown(next((text for text in (document.text_de, document.text_en) if text != ""), ""))
-	else:
-		text, toc = convert_markdown(document.text)
+	text, toc = document.get_rendered_text()
 
 	return render(request, 'documents_base.html', {
 		'document': document,
@@ -245,17 +273,23 @@ def render_text(request, title):
 	if document.has_perms():
 		check_permissions(document, request.user, [document.view_permission_name, document.edit_permission_name])
 
-	text, __ = convert_markdown(request.POST['text'])
+	language = request.POST.get('language')
+	if language not in TEXT_LANGUAGES:
+		language = get_language_code()
+	with translation.override(language):
+		rendered_blocks = convert_markdown_blocks(request.POST['text'])
 
+	# clients of the live preview only receive the blocks that changed since the last preview
 	channel_layer = channels.layers.get_channel_layer()
 	async_to_sync(channel_layer.group_send)(
-		document.hash_value,
+		preview_group_name(document.hash_value, language),
 		{
 			'type': 'update_preview',
-			'message': text,
+			'message': json.dumps(preview_patch(document.hash_value, language, rendered_blocks)),
 		}
 	)
 
+	text = '\n'.join(html for __, html in rendered_blocks)
 	return HttpResponse(text, content_type='text/plain')
 
 
@@ -304,17 +338,15 @@ def revert(request):
 	document_url_title = request.POST['url_title']
 	document = get_object_or_404(Document, url_title=document_url_title)
 	check_permissions(document, request.user, [document.edit_permission_name])
-	versions = Version.objects.get_for_object(document)
 
 	if not document.can_be_reverted:
 		raise SuspiciousOperation('This Document can not be reverted!')
 
-	# find the we want to revert to
-	revert_version = None
-	for version in versions:
-		if version.pk == int(version_id):
-			revert_version = version
-			break
+	# find the version we want to revert to among the versions of the document
+	try:
+		revert_version = Version.objects.get_for_object(document).select_related('revision').filter(pk=int(version_id)).first()
+	except ValueError:
+		revert_version = None
 
 	if revert_version is None:
 		# user supplied version_id that does not exist
@@ -324,32 +356,18 @@ def revert(request):
 	fields = revert_version.field_dict
 	document_class = ContentType.objects.get_for_id(fields.pop('polymorphic_ctype_id')).model_class()
 
-	# Remove all references to parent objects, rename ForeignKeyFields, extract ManyToManyFields.
-	new_fields = fields.copy()
-	many_to_many_fields = {}
-	for key in fields.keys():
-		if "_ptr" in key:
-			del new_fields[key]
-			continue
-
-		try:
-			field = getattr(document_class, key).field
-		except AttributeError:
-			continue
-
-		if isinstance(field, models.ManyToManyField):
-			many_to_many_fields[key] = fields[key]
-		else:
-			new_fields[field.attname] = fields[key]
-		del new_fields[key]
+	# Remove all references to parent objects, extract ManyToManyFields.
+	parent_links, many_to_many_field_names = get_revert_field_plan(document_class)
+	new_fields = {key: value for key, value in fields.items() if key not in parent_links and key not in many_to_many_field_names}
+	many_to_many_fields = {key: value for key, value in fields.items() if key in many_to_many_field_names}
 
 	reverted_document = document_class(**new_fields)
+	reverted_document.update_rendered_text()
 	with transaction.atomic(), revisions.create_revision():
 		reverted_document.save()
 		# Restore ManyToManyFields
-		for key in many_to_many_fields.keys():
-			getattr(reverted_document, key).clear()
-			getattr(reverted_document, key).add(*many_to_many_fields[key])
+		for key, values in many_to_many_fields.items():
+			getattr(reverted_document, key).set(values)
 		revisions.set_user(request.user)
 		revisions.set_comment(
 			_('reverted to revision \"{revision_comment}\" (at {date})'.format(
@@ -501,7 +519,8 @@ def preview(request):
 	hash_value = request.GET['hash_value']
 	document = get_object_or_404(Document, hash_value=hash_value)
 
-	text, __ = convert_markdown(document.text)
+	rendered_blocks = convert_markdown_blocks(document.text)
+	text = ''.join('<div class="preview-block">{}</div>'.format(html) for __, html in rendered_blocks)
 
 	return render(
 		request,
@@ -511,6 +530,7 @@ def preview(request):
 			'text': text,
 			'preview_url': settings.PREVIEW_URL,
 			'hash_value': hash_value,
+			'language': get_language_code(),
 			'view_page': True,
 		}
 	)
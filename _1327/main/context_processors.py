@@ -1,20 +1,30 @@
 from django.conf import settings
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Q
+from django.urls import NoReverseMatch
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import get_language
+from guardian.conf import settings as guardian_settings
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from guardian.shortcuts import get_objects_for_user
 
+from _1327.documents.models import Document
 from _1327.main.models import MenuItem
-from . import models
+from _1327.main.render_cache import get_versions
+from _1327.main.utils import menu_cache_key, PERMISSION_FLAGS_SESSION_KEY, PERMISSION_FLAGS_VERSION_KEY
 
 
 def menu(request):
-	menu_items = models.MenuItem.objects.filter(menu_type=models.MenuItem.MAIN_MENU, parent=None)
-	menu_items = [menu_item for menu_item in menu_items if menu_item.can_view(request.user)]
+	language = get_language()
+	trees, visible_ids = get_menu_trees(language), get_visible_menu_item_ids(request.user)
 
+	menu_items = visible_menu_items(trees['main_menu'], visible_ids)
 	for item in menu_items:
 		mark_selected(request, item)
 
-	footer_items = models.MenuItem.objects.filter(menu_type=models.MenuItem.FOOTER)
-	footer_items = [footer_item for footer_item in footer_items if footer_item.can_view(request.user)]
-
+	footer_items = visible_menu_items(trees['footer'], visible_ids)
 	for item in footer_items:
 		mark_selected(request, item)
 
@@ -24,13 +34,106 @@ def menu(request):
 	}
 
 
+def get_menu_trees(language):
+	"""
+		Returns the main menu and the footer with all items as nested dicts. They are loaded with a single query and
+		cached per language until a menu item or a linked document changes.
+	"""
+	key = menu_cache_key('trees', language)
+	trees = cache.get(key)
+	if trees is None:
+		trees = build_menu_trees()
+		cache.set(key, trees, timeout=None)
+		# lets documents that are not linked from the menu change without invalidating it
+		cache.set(menu_cache_key('document_ids'), set(trees['document_ids']), timeout=None)
+	return trees
+
+
+def build_menu_trees():
+	menu_items = list(MenuItem.objects.all())
+	documents = {
+		document.id: document
+		for document in Document.objects.filter(id__in=[menu_item.document_id for menu_item in menu_items if menu_item.document_id])
+	}
+
+	nodes = {}
+	for menu_item in menu_items:
+		document = documents.get(menu_item.document_id)
+		if menu_item.link:
+			try:
+				url = menu_item.get_url()
+			except NoReverseMatch:
+				# the tree contains all items, so a broken link must not break the menu of every user
+				url = '#'
+		else:
+			url = document.get_view_url() if document else '#'
+		nodes[menu_item.id] = {
+			'id': menu_item.id,
+			'title': menu_item.title,
+			'get_url': url,
+			'link': menu_item.link,
+			'document_url_title': document.url_title if document else None,
+			'submenu': [],
+			'selected': False,
+		}
+	for menu_item in menu_items:
+		if menu_item.parent_id is not None:
+			nodes[menu_item.parent_id]['submenu'].append(nodes[menu_item.id])
+
+	return {
+		'main_menu': [nodes[menu_item.id] for menu_item in menu_items if menu_item.menu_type == MenuItem.MAIN_MENU and menu_item.parent_id is None],
+		'footer': [nodes[menu_item.id] for menu_item in menu_items if menu_item.menu_type == MenuItem.FOOTER],
+		'document_ids': list(documents),
+	}
+
+
+def get_visible_menu_item_ids(user):
+	"""
+		Returns the ids of the menu items the user may view or None if the user may view all of them. The permissions of
+		the groups, including the group of the IP range, are cached per set of groups. Permissions assigned to the user
+		directly are rare and looked up on every request.
+	"""
+	content_type = ContentType.objects.get_for_model(MenuItem)
+	if user.has_perm('{}.{}'.format(content_type.app_label, MenuItem.VIEW_PERMISSION_NAME)):
+		return None
+
+	# an authenticated user also has the permissions of the anonymous user
+	users = Q(user__username=guardian_settings.ANONYMOUS_USER_NAME)
+	if user.is_authenticated:
+		users |= Q(user=user)
+	groups = users
+	ip_range_group_name = user._ip_range_group_name if hasattr(user, '_ip_range_group_name') else None
+	if ip_range_group_name:
+		groups |= Q(name=ip_range_group_name)
+	group_ids = sorted(set(Group.objects.filter(groups).values_list('id', flat=True)))
+
+	key = menu_cache_key('visible', '-'.join(str(group_id) for group_id in group_ids))
+	visible_ids = cache.get(key)
+	if visible_ids is None:
+		group_permissions = GroupObjectPermission.objects.filter(
+			group_id__in=group_ids,
+			content_type=content_type,
+			permission__codename=MenuItem.VIEW_PERMISSION_NAME,
+		)
+		visible_ids = {int(object_pk) for object_pk in group_permissions.values_list('object_pk', flat=True)}
+		cache.set(key, visible_ids, timeout=None)
+
+	user_permissions = UserObjectPermission.objects.filter(users, content_type=content_type, permission__codename=MenuItem.VIEW_PERMISSION_NAME)
+	return visible_ids | {int(object_pk) for object_pk in user_permissions.values_list('object_pk', flat=True)}
+
+
+def visible_menu_items(nodes, visible_ids):
+	return [
+		dict(node, submenu=visible_menu_items(node['submenu'], visible_ids))
+		for node in nodes if visible_ids is None or node['id'] in visible_ids
+	]
+
+
 def mark_selected(request, menu_item):
-	menu_item.submenu = menu_item.children.all()
-	menu_item.submenu = [submenu_item for submenu_item in menu_item.submenu if submenu_item.can_view(request.user)]
 	found_selected = False
-	for child in menu_item.submenu:
+	for child in menu_item['submenu']:
 		if mark_selected(request, child):
-			menu_item.selected = True
+			menu_item['selected'] = True
 			found_selected = True
 
 	if found_selected:
@@ -39,34 +142,70 @@ def mark_selected(request, menu_item):
 	current_view = request.resolver_match
 	if current_view is not None:
 		current_view_name = current_view.view_name
-		if menu_item.link:
-			item_view = menu_item.link
+		if menu_item['link']:
+			item_view = menu_item['link']
 			if current_view_name == item_view:
-				menu_item.selected = True
+				menu_item['selected'] = True
 				return True
 			if item_view.startswith('admin:') and current_view_name.startswith('admin:'):
-				menu_item.selected = True
+				menu_item['selected'] = True
 				return True
-		elif menu_item.document:
-			if 'title' in request.resolver_match.kwargs and menu_item.document.url_title == request.resolver_match.kwargs['title']:
-				menu_item.selected = True
+		elif menu_item['document_url_title']:
+			if 'title' in request.resolver_match.kwargs and menu_item['document_url_title'] == request.resolver_match.kwargs['title']:
+				menu_item['selected'] = True
 				return True
 
 
+def session_permission_flag(request, name, compute):
+	"""
+		Computes a value depending on the permissions of the user only when a template uses it. The value is kept in the
+		session until the group memberships or the global permissions of any user or group change.
+	"""
+	def get_flag():
+		user = request.user
+		if not hasattr(request, 'session'):
+			return compute(user)
+
+		version = get_versions(PERMISSION_FLAGS_VERSION_KEY)[0]
+		flags = request.session.get(PERMISSION_FLAGS_SESSION_KEY)
+		if flags is None or flags['version'] != version or flags['user'] != [user.id, user.is_superuser]:
+			flags = {'version': version, 'user': [user.id, user.is_superuser]}
+		if name not in flags:
+			flags[name] = compute(user)
+			request.session[PERMISSION_FLAGS_SESSION_KEY] = flags
+		return flags[name]
+	return SimpleLazyObject(get_flag)
+
+
 def can_create_informationpage(request):
-	return {'CAN_CREATE_INFORMATIONPAGE': request.user.has_perm("information_pages.add_informationdocument")}
+	if not request.user.is_authenticated:
+		return {'CAN_CREATE_INFORMATIONPAGE': False}
+	return {'CAN_CREATE_INFORMATIONPAGE': session_permission_flag(
+		request, 'can_create_informationpage', lambda user: user.has_perm("information_pages.add_informationdocument"),
+	)}
 
 
 def can_create_minutes(request):
-	return {'CAN_CREATE_MINUTES': request.user.groups.filter(permissions__codename="add_minutesdocument")}
+	if not request.user.is_authenticated:
+		return {'CAN_CREATE_MINUTES': False}
+	return {'CAN_CREATE_MINUTES': session_permission_flag(
+		request, 'can_create_minutes', lambda user: list(user.groups.filter(permissions__codename="add_minutesdocument").values('id', 'name')),
+	)}
 
 
 def can_create_poll(request):
-	return {'CAN_CREATE_POLL': request.user.has_perm("polls.add_poll")}
+	if not request.user.is_authenticated:
+		return {'CAN_CREATE_POLL': False}
+	return {'CAN_CREATE_POLL': session_permission_flag(request, 'can_create_poll', lambda user: user.has_perm("polls.add_poll"))}
 
 
 def can_change_menu_items(request):
-	return {'CAN_CHANGE_MENU_ITEMS': request.user.is_superuser or len(get_objects_for_user(request.user, MenuItem.CHANGE_CHILDREN_PERMISSION_NAME, klass=MenuItem)) > 0}
+	if not request.user.is_authenticated:
+		return {'CAN_CHANGE_MENU_ITEMS': False}
+	return {'CAN_CHANGE_MENU_ITEMS': session_permission_flag(
+		request, 'can_change_menu_items',
+		lambda user: user.is_superuser or get_objects_for_user(user, MenuItem.CHANGE_CHILDREN_PERMISSION_NAME, klass=MenuItem).exists(),
+	)}
 
 
 def image_paths(request):
@@ -0,0 +1,252 @@
+from collections import defaultdict
+import json
+import random
+import time
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+import markdown
+
+from _1327.information_pages.models import InformationDocument
+from _1327.main.models import AbbreviationExplanation
+from _1327.main.render_cache import invalidate_abbreviations
+from _1327.main.utils import create_markdown_engine, MarkdownEnginePool
+from _1327.minutes.markdown_minutes_extensions import MinutesPreprocessor
+from _1327.minutes.markdown_minutes_reference import PREPROCESSOR_NAMES
+from _1327.polls.models import Poll
+
+
+SAMPLE_TEXT = """# Meeting
+
+|start|(18:00)
+
+## Reports
+
+* Finances were checked [5|0|1]
+* The next meeting takes place next week
+
+| Topic | Responsible |
+|-------|-------------|
+| Budget | Finance officer |
+
+|end|(19:30)
+"""
+
+MINUTES_LINES = [
+	"The committee discussed the budget for the next semester in detail.",
+	"* The proposal was accepted [5|0|1]",
+	"|enter|(18:30)(Jane Doe)",
+	"|enter|(18:35)(John Doe)(Video call)",
+	"|leave|(19:00)(Jane Doe)",
+	"|break|(19:10)(19:20)",
+	"|quorum|(6/9)",
+	"",
+]
+
+CORPUS_LINES = [
+	"The {abbreviation} discussed the budget for the next semester in detail.",
+	"* The proposal of the {abbreviation} was accepted [5|0|1]",
+	"* The proposal was rejected [1|7|0]",
+	"|enter|(18:30)(Jane Doe)",
+	"|enter|(18:35)(John Doe)(Video call)",
+	"|leave|(19:00)(Jane Doe)",
+	"|break|(19:10)(19:20)",
+	"|quorum|(6/9)",
+	"See [the last minutes](document:{document_id}) and [the poll about it](poll:{poll_id}).",
+	"![Seating plan](/attachments/download?hash_value=0123456789abcdef =300x200)",
+]
+
+BENCHMARK_CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'benchmark_markdown',
+	},
+}
+
+CORPUS_TABLE = [
+	"| Topic | Responsible | Due |",
+	"|-------|-------------|-----|",
+	"| Budget of the {abbreviation} | Finance officer | next week |",
+	"| Elections | Election committee | in two weeks |",
+]
+
+
+def generate_minutes_lines(num_lines):
+	# mostly prose with some minutes syntax in between, like real minutes
+	random_generator = random.Random(1327)
+	return [
+		random_generator.choice(MINUTES_LINES) if random_generator.random() < 0.2 else MINUTES_LINES[0]
+		for __ in range(num_lines)
+	]
+
+
+def generate_corpus_text(num_lines, abbreviations, document_ids, poll_ids):
+	# minutes with sections containing all supported syntaxes
+	random_generator = random.Random(num_lines)
+	lines = ["|start|(18:00)", ""]
+	while len(lines) < num_lines:
+		lines += ["## Topic {}".format(len(lines)), ""]
+		for __ in range(random_generator.randint(5, 15)):
+			lines.append(random_generator.choice(CORPUS_LINES))
+			lines.append("")
+		if random_generator.random() < 0.3:
+			lines += CORPUS_TABLE + [""]
+	lines.append("|end|(19:30)")
+
+	return "\n".join(
+		line.format(
+			abbreviation=random_generator.choice(abbreviations),
+			document_id=random_generator.choice(document_ids),
+			poll_id=random_generator.choice(poll_ids),
+		)
+		for line in lines
+	)
+
+
+def preprocess_minutes(preprocessors, lines):
+	for preprocessor in preprocessors:
+		lines = preprocessor.run(lines)
+	return lines
+
+
+class StageTimer:
+	"""
+		Measures the time spent in every processor of a Markdown instance. The inline patterns, including the ones
+		of the abbr extension, run within the inline treeprocessor.
+	"""
+
+	def __init__(self, md):
+		self.seconds = defaultdict(float)
+		for kind, registry in [('preprocessor', md.preprocessors), ('treeprocessor', md.treeprocessors), ('postprocessor', md.postprocessors)]:
+			for name in list(registry._data):
+				processor = registry[name]
+				processor.run = self.timed('{} {}'.format(kind, name), processor.run)
+		md.parser.parseDocument = self.timed('block parser', md.parser.parseDocument)
+
+	def timed(self, stage, function):
+		def timed_function(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.seconds[stage] += time.perf_counter() - start
+		return timed_function
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Measures the cost of setting up Markdown instances, of preprocessing minutes and of rendering synthetic minutes of different sizes'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--iterations', type=int, default=500, help='Number of renderings per measurement')
+		parser.add_argument('--minutes-lines', type=int, default=5000, help='Number of lines of the synthetic minutes')
+		parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Number of lines of the rendered documents')
+		parser.add_argument('--abbreviations', type=int, default=1000, help='Number of entries of the abbreviation table')
+		parser.add_argument('--json', action='store_true', help='Print the results as JSON, e.g. to compare them between commits')
+
+	def handle(self, *args, **options):
+		results = {
+			'engine': self.benchmark_engine(options['iterations']),
+			'minutes': self.benchmark_minutes(options['minutes_lines']),
+		}
+
+		# the objects needed for the corpus are only created for the measurements. The abbreviation table and the
+		# targets of links are cached in a private cache, so the caches of the running site are not touched.
+		with transaction.atomic(), override_settings(CACHES=BENCHMARK_CACHES):
+			results['documents'] = self.benchmark_documents(options['sizes'], options['abbreviations'])
+			transaction.set_rollback(True)
+
+		if options['json']:
+			self.stdout.write(json.dumps(results, indent=4, sort_keys=True))
+			return
+
+		for name, milliseconds in results['engine'].items():
+			self.stdout.write('{:<36}{:>10.3f} ms per call'.format(name, milliseconds))
+		for name, milliseconds in results['minutes'].items():
+			self.stdout.write('{:<36}{:>10.3f} ms per {} lines'.format(name, milliseconds, options['minutes_lines']))
+		for result in results['documents']:
+			self.stdout.write('')
+			self.stdout.write('{lines} lines, {kilobytes:.1f} KB: {milliseconds:.3f} ms per document, {kilobytes_per_second:.1f} KB/s'.format(**result))
+			for stage, milliseconds in sorted(result['stages'].items(), key=lambda stage: stage[1], reverse=True):
+				self.stdout.write('    {:<40}{:>10.3f} ms'.format(stage, milliseconds))
+
+	def benchmark_engine(self, iterations):
+		pool = MarkdownEnginePool(create_markdown_engine)
+
+		def render_with_new_engine():
+			md = create_markdown_engine()
+			md.convert(SAMPLE_TEXT)
+
+		def render_with_pooled_engine():
+			with pool.engine('en') as md:
+				md.convert(SAMPLE_TEXT)
+
+		measurements = [
+			('engine setup', create_markdown_engine),
+			('render with new engine', render_with_new_engine),
+			('render with pooled engine', render_with_pooled_engine),
+		]
+		return {
+			name: timeit.timeit(function, number=iterations) * 1000 / iterations
+			for name, function in measurements
+		}
+
+	def benchmark_minutes(self, num_lines):
+		lines = generate_minutes_lines(num_lines)
+		# the former extension with one preprocessor per kind of syntax
+		reference_md = markdown.Markdown(extensions=['_1327.minutes.markdown_minutes_reference'])
+		reference_preprocessors = [reference_md.preprocessors[name] for name in PREPROCESSOR_NAMES]
+		preprocessor = MinutesPreprocessor(markdown.Markdown())
+		measurements = [
+			('minutes, one pass per syntax', lambda: preprocess_minutes(reference_preprocessors, lines)),
+			('minutes, combined passes', lambda: preprocessor.run(lines)),
+		]
+		return {
+			name: timeit.timeit(function, number=10) * 100
+			for name, function in measurements
+		}
+
+	def benchmark_documents(self, sizes, num_abbreviations):
+		AbbreviationExplanation.objects.bulk_create(
+			AbbreviationExplanation(abbreviation='ABBR{}'.format(index), explanation='Explanation number {}'.format(index))
+			for index in range(num_abbreviations)
+		)
+		# bulk_create does not send the signals invalidating the abbreviation table
+		invalidate_abbreviations()
+		abbreviations = list(AbbreviationExplanation.objects.values_list('abbreviation', flat=True)) or ['FSR']
+		document_ids = [
+			InformationDocument.objects.create(title_en='Benchmark', url_title='benchmark-document-{}'.format(index)).id
+			for index in range(10)
+		]
+		poll_ids = [
+			Poll.objects.create(title_en='Benchmark', url_title='benchmark-poll-{}'.format(index)).id
+			for index in range(10)
+		]
+
+		results = []
+		for num_lines in sizes:
+			text = generate_corpus_text(num_lines, abbreviations, document_ids, poll_ids)
+			md = create_markdown_engine()
+			# the first rendering resolves and caches the links and the abbreviation table
+			md.convert(text)
+			md.reset()
+
+			timer = StageTimer(md)
+			iterations = max(1, 10000 // num_lines)
+			start = time.perf_counter()
+			for __ in range(iterations):
+				md.convert(text)
+				md.reset()
+			seconds = (time.perf_counter() - start) / iterations
+
+			kilobytes = len(text.encode()) / 1024
+			results.append({
+				'lines': num_lines,
+				'kilobytes': kilobytes,
+				'milliseconds': seconds * 1000,
+				'kilobytes_per_second': kilobytes / seconds,
+				'stages': {stage: stage_seconds * 1000 / iterations for stage, stage_seconds in timer.seconds.items()},
+			})
+		return results
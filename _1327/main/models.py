@@ -1,14 +1,22 @@
 from collections import namedtuple
 
+from django.contrib.auth.models import Group
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from guardian.shortcuts import assign_perm
 
 from _1327.documents.models import Document
+from _1327.main.render_cache import invalidate_abbreviations
 from _1327.main.tools import translate
+from _1327.main.utils import invalidate_menus, invalidate_permission_flags, menu_cache_key
+from _1327.user_management.models import UserProfile
 
 MENUITEM_VIEW_PERMISSION_NAME = 'view_menuitem'
 MENUITEM_EDIT_PERMISSION_NAME = 'change_menuitem'
@@ -120,3 +128,62 @@ class AbbreviationExplanation(models.Model):
 
 	def __str__(self):
 		return '*[' + self.abbreviation + ']: ' + self.explanation
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# remember the stored abbreviation to mark the documents containing it as outdated when it is renamed
+		if 'abbreviation' in field_names:
+			instance._stored_abbreviation = instance.abbreviation
+		return instance
+
+
+@receiver(post_save, sender=AbbreviationExplanation, dispatch_uid="invalidate_abbreviations_on_save")
+@receiver(post_delete, sender=AbbreviationExplanation, dispatch_uid="invalidate_abbreviations_on_delete")
+def invalidate_rendered_abbreviations(sender, instance, **kwargs):
+	from _1327.documents.utils import mark_documents_containing_stale
+	invalidate_abbreviations()
+	mark_documents_containing_stale(*{instance.abbreviation, getattr(instance, '_stored_abbreviation', instance.abbreviation)})
+	instance._stored_abbreviation = instance.abbreviation
+
+
+@receiver(post_save, sender=MenuItem, dispatch_uid="invalidate_menus_on_save")
+@receiver(post_delete, sender=MenuItem, dispatch_uid="invalidate_menus_on_delete")
+def invalidate_cached_menus(sender, **kwargs):
+	invalidate_menus()
+
+
+@receiver(post_save, sender=GroupObjectPermission, dispatch_uid="invalidate_menus_on_permission_save")
+@receiver(post_delete, sender=GroupObjectPermission, dispatch_uid="invalidate_menus_on_permission_delete")
+def invalidate_menus_on_permission_change(sender, instance, **kwargs):
+	if instance.content_type_id == ContentType.objects.get_for_model(MenuItem).id:
+		invalidate_menus()
+		invalidate_permission_flags()
+
+
+@receiver(post_save, sender=UserObjectPermission, dispatch_uid="invalidate_permission_flags_on_user_permission_save")
+@receiver(post_delete, sender=UserObjectPermission, dispatch_uid="invalidate_permission_flags_on_user_permission_delete")
+def invalidate_permission_flags_on_user_permission_change(sender, instance, **kwargs):
+	# whether a user may change menu items depends on the object permissions of menu items
+	if instance.content_type_id == ContentType.objects.get_for_model(MenuItem).id:
+		invalidate_permission_flags()
+
+
+@receiver(m2m_changed, sender=UserProfile.groups.through, dispatch_uid="invalidate_permission_flags_on_membership_change")
+@receiver(m2m_changed, sender=UserProfile.user_permissions.through, dispatch_uid="invalidate_permission_flags_on_user_permissions_change")
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid="invalidate_permission_flags_on_group_permissions_change")
+@receiver(post_delete, sender=Group, dispatch_uid="invalidate_permission_flags_on_group_delete")
+def invalidate_cached_permission_flags(sender, **kwargs):
+	invalidate_permission_flags()
+
+
+@receiver(post_save, dispatch_uid="invalidate_menus_on_document_save")
+def invalidate_menus_on_document_change(sender, instance, update_fields=None, **kwargs):
+	# menus contain the urls of linked documents
+	if sender not in Document.__subclasses__():
+		return
+	if update_fields is not None and 'url_title' not in update_fields:
+		return
+	linked_document_ids = cache.get(menu_cache_key('document_ids'))
+	if linked_document_ids is None or instance.id in linked_document_ids:
+		invalidate_menus()
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+
+ABBREVIATIONS_VERSION_KEY = 'markdown_abbreviations_version'
+
+
+class LocalMemoryRenderCache:
+	"""
+		Per-process cache for rendered markdown that evicts the least recently used entry once it is full.
+	"""
+
+	def __init__(self, max_entries):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			try:
+				self.entries.move_to_end(key)
+			except KeyError:
+				return None
+			return self.entries[key]
+
+	def set(self, key, value):
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+
+class DjangoRenderCache:
+	"""
+		Stores rendered markdown in one of the caches configured in CACHES. Size limits and eviction are up to the
+		configuration of that cache.
+	"""
+
+	def __init__(self, alias):
+		self.cache = caches[alias]
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, value):
+		self.cache.set(key, value, timeout=None)
+
+	def clear(self):
+		# entries of a shared cache are never cleared, bumping the versions makes them unreachable
+		pass
+
+
+def create_render_cache():
+	if settings.MARKDOWN_CACHE_BACKEND == 'locmem':
+		return LocalMemoryRenderCache(settings.MARKDOWN_CACHE_MAX_ENTRIES)
+	return DjangoRenderCache(settings.MARKDOWN_CACHE_BACKEND)
+
+
+render_cache = create_render_cache()
+
+
+def get_versions(*keys):
+	"""
+		Version stamps are random tokens in the default cache, so losing the cache content just invalidates everything
+		that was cached for the old stamps.
+	"""
+	versions = cache.get_many(keys)
+	for key in keys:
+		if key not in versions:
+			versions[key] = uuid.uuid4().hex
+			if not cache.add(key, versions[key], timeout=None):
+				versions[key] = cache.get(key, versions[key])
+	return [versions[key] for key in keys]
+
+
+def get_render_version():
+	"""
+		Returns a stamp that changes whenever the abbreviations change. Changes of the targets of internal links are
+		part of the cache key of each text instead, so they only invalidate the texts linking to them.
+	"""
+	return get_versions(ABBREVIATIONS_VERSION_KEY)[0]
+
+
+def invalidate_abbreviations():
+	cache.set(ABBREVIATIONS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def render_cache_key(text, language, version):
+	text_hash = hashlib.sha1(text.encode()).hexdigest()
+	return 'rendered_markdown:{}:{}:{}'.format(language, version, text_hash)
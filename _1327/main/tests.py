@@ -2,9 +2,10 @@ import datetime
 from io import StringIO
 import json
 import re
+from unittest.mock import patch
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import AnonymousUser, Group, Permission
 from django.core import mail, management
 from django.core.management import call_command
 from django.test import override_settings, RequestFactory, TestCase
@@ -16,12 +17,15 @@ from guardian.utils import get_anonymous_user
 from model_bakery import baker
 
 from _1327.information_pages.models import InformationDocument
+from _1327.main.render_cache import ABBREVIATIONS_VERSION_KEY, get_versions, LocalMemoryRenderCache, render_cache
 from _1327.main.tools import translate
-from _1327.main.utils import find_root_menu_items
+from _1327.main.utils import AbbreviationTable, convert_markdown, convert_markdown_blocks, create_markdown_engine, find_root_menu_items, \
+	MarkdownEnginePool, render_markdown, split_markdown_blocks
 from _1327.minutes.models import MinutesDocument
 from _1327.user_management.models import UserProfile
-from .context_processors import mark_selected
-from .models import MenuItem
+from .context_processors import build_menu_trees, can_change_menu_items, can_create_informationpage, can_create_minutes, can_create_poll, \
+	mark_selected, menu
+from .models import AbbreviationExplanation, MenuItem
 
 
 class TestMenuProcessor(TestCase):
@@ -31,11 +35,79 @@ class TestMenuProcessor(TestCase):
 		request = rf.get('/this_is_a_page_that_most_certainly_does_not_exist.html')
 
 		menu_item = baker.make(MenuItem)
+		node = next(node for node in build_menu_trees()['main_menu'] if node['id'] == menu_item.id)
 		try:
-			mark_selected(request, menu_item)
+			mark_selected(request, node)
 		except AttributeError:
 			self.fail("mark_selected() raises an AttributeError")
 
+	def test_menu_is_cached_until_items_or_permissions_change(self):
+		group = baker.make(Group)
+		user = baker.make(UserProfile)
+		user.groups.add(group)
+		root_item = baker.make(MenuItem, title_en='root item')
+		sub_item = baker.make(MenuItem, title_en='sub item', parent=root_item)
+		baker.make(MenuItem, title_en='hidden item', parent=root_item)
+		assign_perm(MenuItem.VIEW_PERMISSION_NAME, group, root_item)
+		assign_perm(MenuItem.VIEW_PERMISSION_NAME, group, sub_item)
+
+		def visible_submenu():
+			request.user = UserProfile.objects.get(pk=user.pk)
+			root_nodes = [node for node in menu(request)['main_menu'] if node['id'] == root_item.id]
+			return [item['title'] for item in root_nodes[0]['submenu']] if root_nodes else None
+
+		request = RequestFactory().get('/')
+		self.assertEqual(visible_submenu(), ['sub item'])
+
+		request.user = UserProfile.objects.get(pk=user.pk)
+		with patch('_1327.main.context_processors.build_menu_trees') as build:
+			# the groups, the permissions of the user and the global permissions of the user and the anonymous user
+			with self.assertNumQueries(4):
+				menu(request)
+			self.assertFalse(build.called)
+
+		sub_item.title_en = 'renamed item'
+		sub_item.save()
+		remove_perm(MenuItem.VIEW_PERMISSION_NAME, group, root_item)
+		assign_perm(MenuItem.VIEW_PERMISSION_NAME, user, root_item)
+		self.assertEqual(visible_submenu(), ['renamed item'])
+
+		remove_perm(MenuItem.VIEW_PERMISSION_NAME, user, root_item)
+		self.assertIsNone(visible_submenu())
+
+
+class TestPermissionFlagProcessors(TestCase):
+
+	def test_anonymous_users_cannot_create_anything(self):
+		request = RequestFactory().get('/')
+		request.user = AnonymousUser()
+		with self.assertNumQueries(0):
+			for context_processor in [can_create_informationpage, can_create_minutes, can_create_poll, can_change_menu_items]:
+				self.assertFalse(any(context_processor(request).values()))
+
+	def test_flags_are_lazy_and_kept_in_the_session(self):
+		group = baker.make(Group)
+		user = baker.make(UserProfile)
+		request = RequestFactory().get('/')
+		request.user = user
+		request.session = {}
+
+		with self.assertNumQueries(0):
+			flag = can_create_minutes(request)['CAN_CREATE_MINUTES']
+		self.assertFalse(flag)
+
+		group.permissions.add(Permission.objects.get(codename='add_minutesdocument'))
+		user.groups.add(group)
+		with self.assertNumQueries(1):
+			self.assertEqual(list(can_create_minutes(request)['CAN_CREATE_MINUTES']), [{'id': group.id, 'name': group.name}])
+		with self.assertNumQueries(0):
+			self.assertTrue(can_create_minutes(request)['CAN_CREATE_MINUTES'])
+
+		menu_item = baker.make(MenuItem)
+		self.assertFalse(can_change_menu_items(request)['CAN_CHANGE_MENU_ITEMS'])
+		assign_perm(MenuItem.CHANGE_CHILDREN_PERMISSION_NAME, group, menu_item)
+		self.assertTrue(can_change_menu_items(request)['CAN_CHANGE_MENU_ITEMS'])
+
 
 class MainPageTests(WebTest):
 
@@ -608,6 +680,25 @@ class TestSendRemindersCommand(TestCase):
 		self.assertEqual(len(mail.outbox), 2)
 
 
+class TestBenchmarkMarkdownCommand(TestCase):
+
+	def test_results_as_json(self):
+		abbreviations_version = get_versions(ABBREVIATIONS_VERSION_KEY)
+		output = StringIO()
+		call_command('benchmark_markdown', iterations=1, minutes_lines=10, sizes=[50], abbreviations=5, json=True, stdout=output)
+		results = json.loads(output.getvalue())
+
+		self.assertEqual(set(results['engine']), {'engine setup', 'render with new engine', 'render with pooled engine'})
+		self.assertEqual(results['documents'][0]['lines'], 50)
+		self.assertIn('preprocessor minutes', results['documents'][0]['stages'])
+		self.assertIn('treeprocessor toc', results['documents'][0]['stages'])
+		# the objects of the corpus are removed again
+		self.assertFalse(AbbreviationExplanation.objects.exists())
+		self.assertFalse(InformationDocument.objects.exists())
+		# the benchmark uses its own cache, so the rendered texts of the site stay valid
+		self.assertEqual(get_versions(ABBREVIATIONS_VERSION_KEY), abbreviations_version)
+
+
 class TestMissingMigrations(TestCase):
 	def test_for_missing_migrations(self):
 		output = StringIO()
@@ -635,6 +726,184 @@ class TestTools(TestCase):
 				self.assertEqual('english', dc.title)
 
 
+class TestRenderCache(TestCase):
+
+	def setUp(self):
+		render_cache.clear()
+
+	def test_repeated_rendering_is_cached(self):
+		text = 'Some **cached** text'
+		rendered = convert_markdown(text)
+		with self.assertNumQueries(0):
+			self.assertEqual(convert_markdown(text), rendered)
+
+	def test_language_is_part_of_key(self):
+		text = '|start|(10:00)'
+		with patch('_1327.main.utils.render_markdown', return_value=('', '')) as render_markdown:
+			for language in ['en', 'de', 'en-US']:
+				with translation.override(language):
+					convert_markdown(text)
+		self.assertEqual(render_markdown.call_count, 2)
+
+	def test_abbreviation_changes_invalidate(self):
+		text = 'The ABBR committee'
+		self.assertNotIn('<abbr', convert_markdown(text)[0])
+
+		abbreviation = AbbreviationExplanation.objects.create(abbreviation='ABBR', explanation='Abbreviation')
+		self.assertIn('<abbr title="Abbreviation">ABBR</abbr>', convert_markdown(text)[0])
+
+		abbreviation.delete()
+		self.assertNotIn('<abbr', convert_markdown(text)[0])
+
+	def test_link_target_changes_invalidate(self):
+		document = baker.make(InformationDocument, url_title='old_url')
+		text = '[link](document:{})'.format(document.id)
+		self.assertIn('old_url', convert_markdown(text)[0])
+
+		document.url_title = 'new_url'
+		document.save()
+		self.assertIn('new_url', convert_markdown(text)[0])
+
+		document.delete()
+		self.assertIn('[missing link]', convert_markdown(text)[0])
+
+	def test_local_memory_cache_evicts_least_recently_used(self):
+		cache = LocalMemoryRenderCache(max_entries=2)
+		cache.set('a', 1)
+		cache.set('b', 2)
+		cache.get('a')
+		cache.set('c', 3)
+		self.assertEqual(cache.get('a'), 1)
+		self.assertIsNone(cache.get('b'))
+		self.assertEqual(cache.get('c'), 3)
+
+
+class TestMarkdownEnginePool(TestCase):
+
+	def test_engines_are_reused_per_language(self):
+		pool = MarkdownEnginePool(create_markdown_engine)
+		with pool.engine('en') as md:
+			first_engine = md
+		with pool.engine('en') as md:
+			self.assertIs(md, first_engine)
+		with pool.engine('de') as md:
+			self.assertIsNot(md, first_engine)
+
+	def test_state_is_reset_between_uses(self):
+		pool = MarkdownEnginePool(create_markdown_engine)
+		with pool.engine('en') as md:
+			html = md.convert('## Heading\n\nThe ABBR\n\n*[ABBR]: Abbreviation')
+			self.assertIn('<abbr', html)
+			self.assertIn('Heading', md.toc)
+		with pool.engine('en') as md:
+			html = md.convert('The ABBR')
+			self.assertNotIn('<abbr', html)
+			self.assertNotIn('Heading', md.toc)
+
+
+class TestAbbreviationTable(TestCase):
+
+	def test_only_occurring_abbreviations_are_used(self):
+		table = AbbreviationTable([
+			AbbreviationExplanation(abbreviation='FSR', explanation='Fachschaftsrat'),
+			AbbreviationExplanation(abbreviation='HPI', explanation='Hasso Plattner Institute'),
+			AbbreviationExplanation(abbreviation='FS', explanation='Fachschaft'),
+		])
+		self.assertEqual(table.markdown_for('The FSR met at the HPI.'), ['*[FSR]: Fachschaftsrat', '*[HPI]: Hasso Plattner Institute'])
+		self.assertEqual(table.markdown_for('The FS and the FSRs'), ['*[FS]: Fachschaft'])
+		self.assertEqual(table.markdown_for('Nothing to explain'), [])
+
+	def test_abbreviations_contained_in_longer_ones_are_used(self):
+		table = AbbreviationTable([
+			AbbreviationExplanation(abbreviation='FS', explanation='Fachschaft'),
+			AbbreviationExplanation(abbreviation='FS IT', explanation='IT der Fachschaft'),
+		])
+		self.assertEqual(table.markdown_for('Ask the FS IT'), ['*[FS]: Fachschaft', '*[FS IT]: IT der Fachschaft'])
+
+	def test_abbreviations_with_special_characters(self):
+		table = AbbreviationTable([
+			AbbreviationExplanation(abbreviation='C++', explanation='A programming language'),
+			AbbreviationExplanation(abbreviation='.NET', explanation='A framework'),
+			AbbreviationExplanation(abbreviation='Ø-Gruppe', explanation='Ohne Gruppe'),
+			AbbreviationExplanation(abbreviation='C', explanation='Another programming language'),
+		])
+		self.assertEqual(table.contained_abbreviations['C++'], {'C'})
+		self.assertEqual(
+			table.markdown_for('C++ and .NET for the Ø-Gruppe'),
+			['*[C++]: A programming language', '*[.NET]: A framework', '*[Ø-Gruppe]: Ohne Gruppe', '*[C]: Another programming language'],
+		)
+		self.assertEqual(table.markdown_for('ASP.NETCore and CC++'), [])
+
+		AbbreviationExplanation.objects.create(abbreviation='C++', explanation='A programming language')
+		html, __ = convert_markdown('We use C++, not .NET.')
+		self.assertIn('<abbr title="A programming language">C++</abbr>', html)
+
+	def test_empty_table(self):
+		self.assertEqual(AbbreviationTable([]).markdown_for('The FSR'), [])
+
+	def test_table_is_loaded_once_per_version(self):
+		AbbreviationExplanation.objects.create(abbreviation='FSR', explanation='Fachschaftsrat')
+		self.assertIn('<abbr title="Fachschaftsrat">FSR</abbr>', convert_markdown('The FSR')[0])
+		with self.assertNumQueries(0):
+			self.assertNotIn('<abbr', convert_markdown('Another text')[0])
+
+		AbbreviationExplanation.objects.create(abbreviation='HPI', explanation='Hasso Plattner Institute')
+		with self.assertNumQueries(1):
+			self.assertIn('<abbr title="Hasso Plattner Institute">HPI</abbr>', convert_markdown('The HPI')[0])
+
+
+class TestMarkdownBlocks(TestCase):
+
+	def setUp(self):
+		render_cache.clear()
+
+	def test_text_is_split_at_blank_lines(self):
+		self.assertEqual(split_markdown_blocks('# Title\n\nFirst\nparagraph\n\n\nSecond paragraph\n'), ['# Title', 'First\nparagraph', 'Second paragraph'])
+		self.assertEqual(split_markdown_blocks('\n\n'), [])
+
+	def test_lists_and_indented_lines_stay_together(self):
+		text = '* first\n\n* second\n\n    code in the list\n\nAfter the list\n\n1. one\n2. two'
+		self.assertEqual(split_markdown_blocks(text), ['* first\n\n* second\n\n    code in the list', 'After the list', '1. one\n2. two'])
+
+	def test_blocks_render_like_the_whole_text(self):
+		text = '# Title\n\nSome *text*\n\n* first\n\n* second\n\n| a | b |\n|---|---|\n| 1 | 2 |'
+		html = '\n'.join(html for __, html in convert_markdown_blocks(text))
+		self.assertEqual(html, convert_markdown(text)[0])
+
+	def test_only_changed_blocks_are_rendered(self):
+		convert_markdown_blocks('First\n\nSecond')
+		with patch('_1327.main.utils.render_markdown', wraps=render_markdown) as mock:
+			blocks = convert_markdown_blocks('First\n\nChanged')
+		mock.assert_called_once_with('Changed', 'en')
+		self.assertEqual([html for __, html in blocks], ['<p>First</p>', '<p>Changed</p>'])
+
+	def test_reference_links_are_defined_in_every_block(self):
+		text = 'A [link][target] here\n\nAnother paragraph\n\n[target]: https://example.com\n    "Title"'
+		html = '\n'.join(html for __, html in convert_markdown_blocks(text)).strip()
+		self.assertIn('<a href="https://example.com" title="Title">link</a>', html)
+		self.assertEqual(html, convert_markdown(text)[0])
+
+	def test_abbreviations_are_defined_in_every_block(self):
+		text = 'The FSR meets\n\n*[FSR]: Fachschaftsrat\n\nThe FSR decides'
+		blocks = [html for __, html in convert_markdown_blocks(text)]
+		self.assertEqual(blocks[0], '<p>The <abbr title="Fachschaftsrat">FSR</abbr> meets</p>')
+		self.assertEqual(blocks[2], '<p>The <abbr title="Fachschaftsrat">FSR</abbr> decides</p>')
+
+	def test_headings_get_unique_ids(self):
+		text = '# Topic\n\nFirst\n\n# Topic\n\nSecond'
+		blocks = convert_markdown_blocks(text)
+		self.assertEqual([html for __, html in blocks], [convert_markdown(text)[0]])
+		self.assertIn('id="topic_1"', blocks[0][1])
+
+		self.assertEqual(len(convert_markdown_blocks('# One\n\n# Two')), 2)
+
+	def test_table_of_contents_lists_all_headings(self):
+		text = '[TOC]\n\n# One\n\n# Two'
+		blocks = convert_markdown_blocks(text)
+		self.assertEqual([html for __, html in blocks], [convert_markdown(text)[0]])
+		self.assertIn('href="#two"', blocks[0][1])
+
+
 class TestLanguageChange(WebTest):
 	csrf_checks = False
 
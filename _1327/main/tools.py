@@ -1,6 +1,10 @@
 from django.utils.translation import get_language
 
 
-def translate(**kwargs):
+def get_language_code():
 	# Transforms everything that comes out of get_language to 'en' or 'de'. suffixes like -US are omitted.
-	return property(lambda self: getattr(self, kwargs.get((get_language() or 'en').split('-')[0], kwargs['en'])))
+	return (get_language() or 'en').split('-')[0]
+
+
+def translate(**kwargs):
+	return property(lambda self: getattr(self, kwargs.get(get_language_code(), kwargs['en'])))
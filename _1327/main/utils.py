@@ -1,19 +1,33 @@
+from collections import defaultdict
+from contextlib import contextmanager
 import re
+import threading
+import uuid
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify as django_slugify
 from django.utils.translation import ugettext_lazy as _
 
-from guardian.core import ObjectPermissionChecker
+from guardian.models import GroupObjectPermission
 
 import markdown
 from markdown.extensions import Extension
+from markdown.extensions.abbr import ABBR_REF_RE, AbbrExtension, AbbrPreprocessor
 from markdown.extensions.toc import TocExtension
+from markdown.preprocessors import Preprocessor, ReferencePreprocessor
+
+from _1327.main.render_cache import ABBREVIATIONS_VERSION_KEY, get_render_version, get_versions, render_cache, render_cache_key
+from _1327.main.tools import get_language_code
 
 
 URL_TITLE_REGEX = re.compile(r'^[a-zA-Z0-9-_\/]*$')
+LIST_ITEM_REGEX = re.compile(r'^\s*(?:[*+-]|\d+\.)\s')
+WORD_CHARACTER_REGEX = re.compile(r'\w')
+HEADING_ID_REGEX = re.compile(r'<h[1-6] id="([^"]*)"')
+TOC_MARKER = '[TOC]'
 
 
 def save_main_menu_item_order(main_menu_items, user, parent_id=None):
@@ -68,9 +82,84 @@ def save_footer_item_order(footer_items, user, order_counter=0):
 	return order_counter
 
 
-def abbreviation_explanation_markdown():
+class AbbreviationTable:
+	"""
+		All abbreviation explanations compiled into a single pattern, so that only the explanations of abbreviations
+		that occur in a text have to be handed to the abbr extension.
+	"""
+	def __init__(self, abbreviations):
+		self.explanations = [(abbreviation.abbreviation, str(abbreviation)) for abbreviation in abbreviations]
+		self.pattern = None
+		if not self.explanations:
+			return
+
+		alternatives = sorted((abbreviation for abbreviation, __ in self.explanations), key=len, reverse=True)
+		# abbreviations may start or end with other characters than letters and digits, e.g. C++ or .NET
+		self.pattern = re.compile(r'(?<!\w)(?:{})(?!\w)'.format('|'.join(re.escape(alternative) for alternative in alternatives)))
+
+		# the pattern only finds the longest abbreviation at a position, so abbreviations that are part of a longer one
+		# have to be added whenever the longer one is found
+		self.contained_abbreviations = {abbreviation: self.abbreviations_within(abbreviation) for abbreviation in alternatives}
+
+	def abbreviations_within(self, abbreviation):
+		"""
+			Returns the other abbreviations occurring in an abbreviation. Shorter abbreviations starting at the same
+			position as a longer one are found by ending the search before the end of the longer one.
+		"""
+		found = set()
+		for start in range(len(abbreviation)):
+			end = len(abbreviation)
+			while end > start:
+				match = self.pattern.match(abbreviation, start, end)
+				if match is None:
+					break
+				# the search treats its end as the end of the text, which is not a boundary within the abbreviation
+				if match.end() == len(abbreviation) or not WORD_CHARACTER_REGEX.match(abbreviation, match.end()):
+					found.add(match.group(0))
+				end = match.end() - 1
+		found.discard(abbreviation)
+		return found
+
+	def markdown_for(self, text):
+		if self.pattern is None:
+			return []
+
+		found = set()
+		for match in self.pattern.finditer(text):
+			found.add(match.group(0))
+			found.update(self.contained_abbreviations[match.group(0)])
+		return [explanation for abbreviation, explanation in self.explanations if abbreviation in found]
+
+
+abbreviation_table = (None, AbbreviationTable([]))
+
+
+def get_abbreviation_table():
 	from .models import AbbreviationExplanation
-	return "\n" + ("\n".join([str(abbr) for abbr in AbbreviationExplanation.objects.all()]))
+	global abbreviation_table
+
+	version, table = abbreviation_table
+	current_version = get_versions(ABBREVIATIONS_VERSION_KEY)[0]
+	if version != current_version:
+		table = AbbreviationTable(AbbreviationExplanation.objects.all())
+		abbreviation_table = (current_version, table)
+	return table
+
+
+class AbbreviationTablePreprocessor(Preprocessor):
+	def run(self, lines):
+		explanations = get_abbreviation_table().markdown_for('\n'.join(lines))
+		if explanations:
+			return lines + [''] + explanations
+		return lines
+
+
+class AbbreviationTableExtension(Extension):
+	"""
+		Adds the explanations from the abbreviation table right before the abbr extension looks for them.
+	"""
+	def extendMarkdown(self, md):
+		md.preprocessors.register(AbbreviationTablePreprocessor(md), 'abbreviation_table', 13)
 
 
 # see https://pythonhosted.org/Markdown/release-2.6.html#safe_mode-deprecated
@@ -80,19 +169,179 @@ class EscapeHtml(Extension):
 		md.inlinePatterns.deregister('html')
 
 
-def convert_markdown(text):
+class BoundaryAbbrPreprocessor(AbbrPreprocessor):
+	"""
+		The abbr extension only matches abbreviations between word boundaries, which never occur at the start or the end
+		of abbreviations like C++ or .NET.
+	"""
+	def _generate_pattern(self, text):
+		return r'(?P<abbr>(?<!\w){}(?!\w))'.format(re.escape(text))
+
+
+class ResettableAbbrExtension(AbbrExtension):
+	"""
+		The abbr extension registers an inline pattern for every abbreviation it finds in a text. These patterns have
+		to be removed again before the Markdown instance is used for the next text.
+	"""
+	def extendMarkdown(self, md):
+		md.preprocessors.register(BoundaryAbbrPreprocessor(md), 'abbr', 12)
+		md.registerExtension(self)
+		self.md = md
+
+	def reset(self):
+		for name in [name for name in self.md.inlinePatterns._data if name.startswith('abbr-')]:
+			self.md.inlinePatterns.deregister(name)
+
+
+class MarkdownEnginePool:
+	"""
+		Keeps configured Markdown instances for reuse, as setting up all extensions costs about as much as rendering
+		a short text. Instances are kept per language and are reset after every use.
+	"""
+	def __init__(self, factory, max_idle=8):
+		self.factory = factory
+		self.max_idle = max_idle
+		self.idle_engines = defaultdict(list)
+		self.lock = threading.Lock()
+
+	@contextmanager
+	def engine(self, language):
+		with self.lock:
+			idle_engines = self.idle_engines[language]
+			md = idle_engines.pop() if idle_engines else None
+		if md is None:
+			md = self.factory()
+		try:
+			yield md
+		finally:
+			md.reset()
+			with self.lock:
+				if len(self.idle_engines[language]) < self.max_idle:
+					self.idle_engines[language].append(md)
+
+	def clear(self):
+		with self.lock:
+			self.idle_engines.clear()
+
+
+def create_markdown_engine():
 	from _1327.documents.markdown_internal_link_extension import InternalLinksMarkdownExtension
-	md = markdown.Markdown(
+	return markdown.Markdown(
 		extensions=[
 			EscapeHtml(),
 			TocExtension(baselevel=2),
 			InternalLinksMarkdownExtension(),
 			'_1327.minutes.markdown_minutes_extensions',
 			'_1327.documents.markdown_scaled_image_extension',
-			'markdown.extensions.abbr',
+			AbbreviationTableExtension(),
+			ResettableAbbrExtension(),
 			'markdown.extensions.tables',
 		])
-	return md.convert(text + abbreviation_explanation_markdown()), md.toc
+
+
+markdown_engines = MarkdownEnginePool(create_markdown_engine)
+
+
+def text_render_cache_key(text, language, render_version):
+	"""
+		The targets of the internal links of a text are part of its key, so changing a document only invalidates the
+		rendered texts linking to it.
+	"""
+	from _1327.documents.markdown_internal_link_extension import internal_links_stamp
+	return render_cache_key(text, language, '{}:{}'.format(render_version, internal_links_stamp(text)))
+
+
+def convert_markdown(text):
+	language = get_language_code()
+	key = text_render_cache_key(text, language, get_render_version())
+	rendered = render_cache.get(key)
+	if rendered is None:
+		rendered = render_markdown(text, language)
+		render_cache.set(key, rendered)
+	return rendered
+
+
+def render_markdown(text, language):
+	with markdown_engines.engine(language) as md:
+		return md.convert(text), md.toc
+
+
+def split_markdown_blocks(text):
+	"""
+		Splits a text into its top-level blocks at blank lines. Indented lines and list items stay in the block they
+		continue, so that every block renders the same on its own as within the whole text.
+	"""
+	blocks = []
+	lines = []
+	after_blank_line = False
+	for line in text.splitlines():
+		if not line.strip():
+			after_blank_line = True
+			if lines:
+				lines.append(line)
+			continue
+
+		if after_blank_line and lines and not (line[0].isspace() or (LIST_ITEM_REGEX.match(line) and LIST_ITEM_REGEX.match(lines[0]))):
+			blocks.append('\n'.join(lines).rstrip())
+			lines = []
+		lines.append(line)
+		after_blank_line = False
+
+	if lines:
+		blocks.append('\n'.join(lines).rstrip())
+	return blocks
+
+
+def markdown_definitions(text):
+	"""
+		Returns the lines of a text that define reference links and abbreviations, which apply to the whole text.
+	"""
+	definitions = []
+	lines = text.splitlines()
+	for index, line in enumerate(lines):
+		match = ReferencePreprocessor.RE.match(line)
+		if match:
+			definitions.append(line)
+			has_title = match.group(5) or match.group(6) or match.group(7)
+			if not has_title and index + 1 < len(lines) and ReferencePreprocessor.TITLE_RE.match(lines[index + 1]):
+				definitions.append(lines[index + 1])
+		elif ABBR_REF_RE.match(line):
+			definitions.append(line)
+	return definitions
+
+
+def convert_markdown_blocks(text):
+	"""
+		Renders every top-level block of the text on its own, so that after an edit only the changed blocks have to be
+		rendered again. Returns the cache key and the html of every block.
+		The definitions of reference links and abbreviations are rendered with every block. Headings only get unique
+		ids within the whole text, so the text is rendered as a single block if the ids of two blocks collide.
+	"""
+	language = get_language_code()
+	version = get_render_version()
+
+	def convert(block):
+		key = text_render_cache_key(block, language, version)
+		rendered = render_cache.get(key)
+		if rendered is None:
+			rendered = render_markdown(block, language)
+			render_cache.set(key, rendered)
+		return key, rendered[0]
+
+	if TOC_MARKER in text:
+		return [convert(text)]
+
+	definitions = '\n'.join(markdown_definitions(text))
+	rendered_blocks = []
+	heading_ids = set()
+	for block in split_markdown_blocks(text):
+		key, html = convert(block + '\n\n' + definitions if definitions else block)
+		block_heading_ids = HEADING_ID_REGEX.findall(html)
+		if not heading_ids.isdisjoint(block_heading_ids):
+			return [convert(text)]
+		heading_ids.update(block_heading_ids)
+		rendered_blocks.append((key, html))
+	return rendered_blocks
 
 
 def slugify(string):
@@ -150,37 +399,82 @@ def slugify_and_clean_url_title(instance, url_title):
 	return url_title
 
 
+PERMISSION_FLAGS_SESSION_KEY = 'permission_flags'
+PERMISSION_FLAGS_VERSION_KEY = 'permission_flags_version'
+
+
+def invalidate_permission_flags():
+	cache.set(PERMISSION_FLAGS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+MENU_VERSION_KEY = 'menu_version'
+
+
+def menu_cache_key(*parts):
+	version = get_versions(MENU_VERSION_KEY)[0]
+	return 'menu:{}:{}'.format(version, ':'.join(str(part) for part in parts))
+
+
+def invalidate_menus():
+	cache.set(MENU_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+PERMISSION_OVERVIEW_GROUPS_VERSION_KEY = 'permission_overview_groups_version'
+
+
+def permission_overview_cache_key(document_id):
+	# the overview contains group names, so renaming or deleting a group invalidates the overviews of all documents
+	version = get_versions(PERMISSION_OVERVIEW_GROUPS_VERSION_KEY)[0]
+	return 'document_permission_overview:{}:{}'.format(version, document_id)
+
+
+def invalidate_permission_overview(document_id):
+	cache.delete(permission_overview_cache_key(document_id))
+
+
+def invalidate_permission_overviews():
+	cache.set(PERMISSION_OVERVIEW_GROUPS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
 def document_permission_overview(user, document):
 	can_edit = user.has_perm(document.edit_permission_name, document)
 	if not can_edit:
 		return []
 
+	key = permission_overview_cache_key(document.id)
+	permissions = cache.get(key)
+	if permissions is None:
+		permissions = compute_document_permission_overview(document)
+		cache.set(key, permissions, timeout=None)
+	return permissions
+
+
+def compute_document_permission_overview(document):
+	content_type = ContentType.objects.get_for_model(document)
+	edit_codename = document.edit_permission_name.split('.')[1]
+	view_codename = document.view_permission_name.split('.')[1]
+	group_permissions = defaultdict(set)
+	object_permissions = GroupObjectPermission.objects.filter(content_type=content_type, object_pk=str(document.pk)).order_by('group_id')
+	for group_name, codename in object_permissions.values_list('group__name', 'permission__codename'):
+		group_permissions[group_name].add(codename)
+
+	def permission(group_name):
+		if edit_codename in group_permissions[group_name]:
+			return "edit"
+		if view_codename in group_permissions[group_name]:
+			return "view"
+		return "none"
+
 	main_groups = [
 		settings.ANONYMOUS_GROUP_NAME,
 		settings.UNIVERSITY_GROUP_NAME,
 		settings.STUDENT_GROUP_NAME,
 		settings.STAFF_GROUP_NAME,
 	]
-	permissions = []
-	for group_name in main_groups:
-		group = Group.objects.get(name=group_name)
-		checker = ObjectPermissionChecker(group)
-		checker.prefetch_perms([document])
-		if checker.has_perm(document.edit_permission_name, document):
-			permissions.append((group.name, "edit"))
-		elif checker.has_perm(document.view_permission_name, document):
-			permissions.append((group.name, "view"))
-		else:
-			permissions.append((group.name, "none"))
-
-	for group in Group.objects.exclude(name__in=main_groups):
-		checker = ObjectPermissionChecker(group)
-		checker.prefetch_perms([document])
-		if checker.has_perm(document.edit_permission_name, document):
-			permissions.append((group.name, "edit"))
-		elif checker.has_perm(document.view_permission_name, document):
-			permissions.append((group.name, "view"))
-
+	permissions = [(group_name, permission(group_name)) for group_name in main_groups]
+	for group_name in [group_name for group_name in group_permissions if group_name not in main_groups]:
+		if permission(group_name) != "none":
+			permissions.append((group_name, permission(group_name)))
 	return permissions
 
 
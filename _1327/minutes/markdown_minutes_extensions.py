@@ -5,81 +5,76 @@ from markdown import Extension
 from markdown.preprocessors import Preprocessor
 
 
-class MinutesBasePreprocessor(Preprocessor):
-	def run(self, lines):
-		new_lines = []
-
-		for line in lines:
-			if line.strip():
-				for pattern, method in self.patterns:
-					line = re.sub(pattern, method, line, flags=re.UNICODE)
-			new_lines.append(line)
+# syntax of the minutes extension, every entry is replaced by the method of MinutesPreprocessor with the same name
+MINUTES_PATTERNS = (
+	('votify', r'\[(?P<num_positive_votes>\d+)\|(?P<num_negative_votes>\d+)\|(?P<num_abstentions>\d+)\]'),
+	('startify', r'\|start\|\((?P<start_hour>\d+):(?P<start_minute>\d+)\)'),
+	('endify', r'\|end\|\((?P<end_hour>\d+):(?P<end_minute>\d+)\)'),
+	('breakify', r'\|break\|\((?P<time_start_break>[0-9:]+)\)\((?P<time_end_break>[0-9:]+)\)'),
+	('quorumify', r'\|quorum\|\((?P<num_participants>\d+)/(?P<max_num_participants>\d+)\)'),
+	('enterify', r'\|enter\|\((?P<enter_time>[0-9:]+)\)\((?P<enter_name>[\w,\ ]+)\)(\((?P<mean_of_participation>.*?)\))?'),
+	('leavify', r'\|leave\|\((?P<leave_time>[0-9:]+)\)\((?P<leave_name>[\w,\ ]+)\)'),
+)
+
+# The means of participation of an enter line is free text, which may contain any other syntax. Like with the former
+# preprocessors for each kind of syntax, the other syntax is replaced first and enter and leave afterwards in separate
+# passes, so that the text of a means of participation is replaced the same way.
+SEPARATE_PASSES = ('enterify', 'leavify')
+
+# all other patterns combined, so that every line is searched only once. The name of the outermost group that matched
+# tells which kind of syntax was found. The lookahead lets the regex engine skip ahead to possible first characters.
+MINUTES_RE = re.compile(r'(?=[\[|])(?:{})'.format('|'.join(
+	'(?P<{}>{})'.format(name, pattern) for name, pattern in MINUTES_PATTERNS if name not in SEPARATE_PASSES
+)))
+SEPARATE_PASS_RES = [(name, re.compile(pattern)) for name, pattern in MINUTES_PATTERNS if name in SEPARATE_PASSES]
+
+
+class MinutesPreprocessor(Preprocessor):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.replacements = {name: getattr(self, name) for name, __ in MINUTES_PATTERNS}
 
-		return new_lines
+	def run(self, lines):
+		# every syntax contains a pipe, lines without one can be skipped right away
+		return [self.replace_line(line) if '|' in line else line for line in lines]
 
+	def replace_line(self, line):
+		line = MINUTES_RE.sub(self.replace, line)
+		for name, regex in SEPARATE_PASS_RES:
+			line = regex.sub(self.replacements[name], line)
+		return line
 
-class VotePreprocessor(MinutesBasePreprocessor):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.patterns = [
-			(r'\[(\d+)\|(\d+)\|(\d+)\]', self.votify),
-		]
+	def replace(self, match):
+		return self.replacements[match.lastgroup](match)
 
 	def votify(self, match):
-		num_positive_votes = match.group(1)
-		num_negative_votes = match.group(2)
-		num_abstentions = match.group(3)
+		num_positive_votes = match.group('num_positive_votes')
+		num_negative_votes = match.group('num_negative_votes')
+		num_abstentions = match.group('num_abstentions')
 
 		return '**[{}|{}|{}]**'.format(num_positive_votes, num_negative_votes, num_abstentions)
 
-
-class StartEndPreprocessor(MinutesBasePreprocessor):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.patterns = [
-			(r'\|start\|\((\d+):(\d+)\)', self.startify),
-			(r'\|end\|\((\d+):(\d+)\)', self.endify),
-		]
-
-	def startify_or_endify(self, match, event):
-		hour = match.group(1)
-		minute = match.group(2)
+	def startify_or_endify(self, hour, minute, event):
 		return u'*{event}: {hour}:{minute}*  '.format(event=event, hour=hour, minute=minute)
 
 	def startify(self, match):
-		return self.startify_or_endify(match, _('Begin of meeting'))
+		return self.startify_or_endify(match.group('start_hour'), match.group('start_minute'), _('Begin of meeting'))
 
 	def endify(self, match):
-		return self.startify_or_endify(match, _('End of meeting'))
-
-
-class BreakPreprocessor(MinutesBasePreprocessor):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.patterns = [
-			(r'\|break\|\(([0-9:]+)\)\(([0-9:]+)\)', self.breakify),
-		]
+		return self.startify_or_endify(match.group('end_hour'), match.group('end_minute'), _('End of meeting'))
 
 	def breakify(self, match):
-		time_start_break = match.group(1)
-		time_end_break = match.group(2)
+		time_start_break = match.group('time_start_break')
+		time_end_break = match.group('time_end_break')
 
 		return _("*Meeting break: {time_start_break} – {time_end_break}*").format(
 			time_start_break=time_start_break,
 			time_end_break=time_end_break,
 		)
 
-
-class QuorumPrepocessor(MinutesBasePreprocessor):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.patterns = [
-			(r'\|quorum\|\((\d+)/(\d+)\)', self.quorumify),
-		]
-
 	def quorumify(self, match):
-		num_participants = int(match.group(1))
-		max_num_participants = int(match.group(2))
+		num_participants = int(match.group('num_participants'))
+		max_num_participants = int(match.group('max_num_participants'))
 		quorate = _("quorate") if num_participants / max_num_participants >= 0.5 else _("not quorate")
 
 		return _("*{num_participants}/{max_num_participants} present → {quorate}*  ").format(
@@ -88,20 +83,7 @@ class QuorumPrepocessor(MinutesBasePreprocessor):
 			quorate=quorate,
 		)
 
-
-class EnterLeavePreprocessor(MinutesBasePreprocessor):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
-		self.patterns = [
-			(r'\|enter\|\(([0-9:]+)\)\(([\w,\ ]+)\)(\((?P<mean_of_participation>.*?)\))?', self.enterify),
-			(r'\|leave\|\(([0-9:]+)\)\(([\w,\ ]+)\)', self.leavify),
-		]
-
-	def enter_or_leavify(self, match, event):
-		time = match.group(1)
-		name = match.group(2)
-		via_description = match.groupdict().get('mean_of_participation', None)
-
+	def enter_or_leavify(self, time, name, event, via_description=None):
 		if via_description is None:
 			message = _("*{time}: {name} {event} the meeting*  ").format(time=time, name=name, event=event)
 		else:
@@ -114,20 +96,16 @@ class EnterLeavePreprocessor(MinutesBasePreprocessor):
 		return message
 
 	def enterify(self, match):
-		return self.enter_or_leavify(match, _("enters"))
+		return self.enter_or_leavify(match.group('enter_time'), match.group('enter_name'), _("enters"), match.group('mean_of_participation'))
 
 	def leavify(self, match):
-		return self.enter_or_leavify(match, _("leaves"))
+		return self.enter_or_leavify(match.group('leave_time'), match.group('leave_name'), _("leaves"))
 
 
 class MinuteExtension(Extension):
 	def extendMarkdown(self, md):
 		md.registerExtension(self)
-		md.preprocessors.register(VotePreprocessor(md), 'votify', 200)
-		md.preprocessors.register(StartEndPreprocessor(md), 'start_or_endify', 200)
-		md.preprocessors.register(BreakPreprocessor(md), 'breakify', 200)
-		md.preprocessors.register(QuorumPrepocessor(md), 'quorumify', 200)
-		md.preprocessors.register(EnterLeavePreprocessor(md), 'enter_or_leavify', 200)
+		md.preprocessors.register(MinutesPreprocessor(md), 'minutes', 200)
 
 
 def makeExtension():
@@ -1,18 +1,20 @@
 from datetime import date, datetime
+import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.core.exceptions import SuspiciousOperation
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.template import loader
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _, ungettext_lazy
-from guardian.shortcuts import assign_perm
 from reversion import revisions
 
-from _1327.documents.models import Document
+from _1327.documents.models import assign_object_permissions, Document, remove_object_permissions
+from _1327.main.render_cache import get_versions
 from _1327.minutes.fields import HexColorModelField
 from _1327.user_management.models import UserProfile
 
@@ -58,6 +60,7 @@ class MinutesDocument(Document):
 	labels = models.ManyToManyField(MinutesLabel, related_name="minutes", blank=True)
 
 	VIEW_PERMISSION_NAME = MINUTES_VIEW_PERMISSION_NAME
+	REVISION_SNAPSHOT_INTERVAL = 10
 
 	class Meta(Document.Meta):
 		verbose_name = ungettext_lazy("Minutes", "Minutes", 1)
@@ -82,7 +85,8 @@ class MinutesDocument(Document):
 	def get_edit_url(self):
 		return reverse(self.get_edit_url_name(), args=(self.url_title, ))
 
-	def get_view_url_name(self):
+	@classmethod
+	def get_view_url_name(cls):
 		return 'minutes:view'
 
 	def get_edit_url_name(self):
@@ -97,6 +101,14 @@ class MinutesDocument(Document):
 	def get_versions_url_name(self):
 		return 'minutes:versions'
 
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# remember the stored state to let update_permissions skip saves that do not change it
+		if 'state' in field_names:
+			instance._stored_state = instance.state
+		return instance
+
 	def get_publish_url_name(self):
 		return 'documents:publish'
 
@@ -141,19 +153,47 @@ class MinutesDocument(Document):
 revisions.register(MinutesDocument, follow=["document_ptr"])
 
 
+PUBLICATION_GROUPS_VERSION_KEY = 'publication_groups_version'
+
+
+def get_publication_groups():
+	"""
+		the groups that published minutes are visible to, stored in the shared cache until a group changes
+	"""
+	key = 'publication_groups:{}'.format(get_versions(PUBLICATION_GROUPS_VERSION_KEY)[0])
+	groups = cache.get(key)
+	if groups is None:
+		groups = (Group.objects.get(name=settings.STUDENT_GROUP_NAME), Group.objects.get(name=settings.UNIVERSITY_GROUP_NAME))
+		cache.set(key, groups, timeout=None)
+	return groups
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_publication_groups(sender, **kwargs):
+	cache.set(PUBLICATION_GROUPS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
 @receiver(post_save, sender=MinutesDocument, dispatch_uid="update_permissions")
 def update_permissions(sender, instance, **kwargs):
-	student_group = Group.objects.get(name=settings.STUDENT_GROUP_NAME)
-	university_network_group = Group.objects.get(name=settings.UNIVERSITY_GROUP_NAME)
+	# the permissions only depend on the state, so saves that keep the state do not need to touch them
+	if getattr(instance, '_stored_state', None) == instance.state:
+		return
+	instance._stored_state = instance.state
+
+	student_group, university_network_group = get_publication_groups()
 	if instance.state == MinutesDocument.UNPUBLISHED or instance.state == MinutesDocument.INTERNAL:
-		instance.delete_all_permissions(student_group)
-		instance.delete_all_permissions(university_network_group)
+		remove_object_permissions(instance, instance.get_permission_ids(instance.all_permission_names), principals=[student_group, university_network_group])
 	if instance.state == MinutesDocument.PUBLISHED:
-		assign_perm(instance.view_permission_name, student_group, instance)
-		assign_perm(instance.view_permission_name, university_network_group, instance)
+		view_permission_ids = instance.get_permission_ids([instance.view_permission_name])
+		assign_object_permissions(instance, [
+			('group_id', group.id, permission_id)
+			for group in (student_group, university_network_group) for permission_id in view_permission_ids
+		])
 	if instance.state == MinutesDocument.PUBLISHED_STUDENT:
-		assign_perm(instance.view_permission_name, student_group, instance)
-		instance.delete_all_permissions(university_network_group)
+		view_permission_ids = instance.get_permission_ids([instance.view_permission_name])
+		assign_object_permissions(instance, [('group_id', student_group.id, permission_id) for permission_id in view_permission_ids])
+		remove_object_permissions(instance, instance.get_permission_ids(instance.all_permission_names), principals=[university_network_group])
 
 
 class Guest(models.Model):
@@ -2,6 +2,7 @@ from unittest import TestCase
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.test.utils import override_settings
 from django.urls import reverse
 from django_webtest import WebTest
 from guardian.core import ObjectPermissionChecker
@@ -11,10 +12,10 @@ from model_bakery import baker
 from reversion.models import Version
 
 from _1327.main.utils import slugify
-from _1327.minutes.markdown_minutes_extensions import BreakPreprocessor, EnterLeavePreprocessor, QuorumPrepocessor, \
-	StartEndPreprocessor, VotePreprocessor
+from _1327.minutes.markdown_minutes_extensions import MinutesPreprocessor
+from _1327.minutes.markdown_minutes_reference import PREPROCESSOR_NAMES
 
-from _1327.minutes.models import MinutesDocument
+from _1327.minutes.models import get_publication_groups, MinutesDocument
 from _1327.user_management.models import UserProfile
 
 
@@ -174,6 +175,36 @@ class TestEditor(WebTest):
 		self.assertTrue(checker.has_perm(document.edit_permission_name, document))
 		self.assertTrue(checker.has_perm(document.delete_permission_name, document))
 
+	def test_saving_without_state_change_keeps_permissions(self):
+		"""
+		Test that permissions are only updated if the state of the minutes changes
+		"""
+		university_group = Group.objects.get(name=settings.UNIVERSITY_GROUP_NAME)
+		document = baker.make(MinutesDocument, participants=self.participants, moderator=self.moderator, state=MinutesDocument.PUBLISHED)
+
+		document = MinutesDocument.objects.get(pk=document.pk)
+		document.text_en = 'changed text'
+		# only the document and the minutes are updated
+		with self.assertNumQueries(2):
+			document.save()
+
+		document.state = MinutesDocument.PUBLISHED_STUDENT
+		document.save()
+		self.assertFalse(ObjectPermissionChecker(university_group).has_perm(document.view_permission_name, document))
+		document.state = MinutesDocument.PUBLISHED
+		document.save()
+		self.assertTrue(ObjectPermissionChecker(university_group).has_perm(document.view_permission_name, document))
+
+	def test_publication_groups_are_cached_until_a_group_changes(self):
+		student_group, university_group = get_publication_groups()
+		with self.assertNumQueries(0):
+			self.assertEqual(get_publication_groups(), (student_group, university_group))
+
+		# the groups are looked up again after any group was saved
+		university_group.save()
+		with self.assertNumQueries(2):
+			self.assertEqual(get_publication_groups(), (student_group, university_group))
+
 
 class TestMinutesList(WebTest):
 	csrf_checks = False
@@ -241,6 +272,39 @@ class TestMinutesList(WebTest):
 		self.assertNotIn('No minutes available.', response.body.decode('utf-8'))
 		self.assertNotIn('You might have to', response.body.decode('utf-8'))
 
+	@override_settings(ANONYMOUS_IP_RANGE_GROUPS={'8.0.0.0/8': 'university_group'})
+	def test_only_permitted_minutes_are_listed(self):
+		user = baker.make(UserProfile)
+		user_group = baker.make(Group)
+		user.groups.add(user_group)
+		university_group = baker.make(Group, name='university_group')
+		other_group = baker.make(Group)
+
+		viewable_by_user = baker.make(MinutesDocument, title_en='viewable by person')
+		viewable_by_user_group = baker.make(MinutesDocument, title_en='viewable by user group')
+		viewable_by_university = baker.make(MinutesDocument, title_en='viewable by university')
+		of_other_group = baker.make(MinutesDocument, title_en='of other group')
+		for document in [viewable_by_user, viewable_by_user_group, viewable_by_university]:
+			document.set_all_permissions(self.group)
+		of_other_group.set_all_permissions(other_group)
+		assign_perm(viewable_by_user.view_permission_name, user, viewable_by_user)
+		assign_perm(viewable_by_user_group.view_permission_name, user_group, viewable_by_user_group)
+		assign_perm(of_other_group.view_permission_name, user, of_other_group)
+		for document in [viewable_by_university, viewable_by_user_group]:
+			assign_perm(document.view_permission_name, university_group, document)
+
+		url = reverse("minutes:list", args=[self.group.id])
+		titles = {document.title_en for document in [viewable_by_user, viewable_by_user_group, viewable_by_university, of_other_group]}
+		for expected, kwargs in [
+			({'viewable by person', 'viewable by user group'}, {'user': user}),
+			({'viewable by university', 'viewable by user group'}, {'extra_environ': {'REMOTE_ADDR': '8.0.0.1'}}),
+			(set(), {}),
+			({'viewable by person', 'viewable by user group', 'viewable by university'}, {'user': self.user}),
+		]:
+			self.renew_app()
+			body = self.app.get(url, **kwargs).body.decode('utf-8')
+			self.assertEqual({title for title in titles if title in body}, expected)
+
 
 class TestSearchMinutes(WebTest):
 	csrf_checks = False
@@ -495,55 +559,91 @@ class TestMarkdownMinutesExtension(TestCase):
 				'_1327.minutes.markdown_minutes_extensions',
 			]
 		)
-		self.vote_preprocessor = VotePreprocessor(self.md)
-		self.start_end_preprocessor = StartEndPreprocessor(self.md)
-		self.break_preprocessor = BreakPreprocessor(self.md)
-		self.quorum_preprocessor = QuorumPrepocessor(self.md)
-		self.enter_leave_preprocessor = EnterLeavePreprocessor(self.md)
+		self.preprocessor = MinutesPreprocessor(self.md)
 		self.base_text = "This is a nice template text, where we will add stuff that shall be preprocessed: {}"
 
 	def test_vote_preprocessor(self):
 		vote_text = "[1|1|3]"
-		processed_text = self.vote_preprocessor.run([self.base_text.format(vote_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(vote_text)])[0]
 		self.assertIn("**{}**".format(vote_text), processed_text)
 
 	def test_start_end_preprocessor(self):
 		start_text = "|start|(15:00)"
-		processed_text = self.start_end_preprocessor.run([self.base_text.format(start_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(start_text)])[0]
 		self.assertIn("*Begin of meeting: 15:00*", processed_text)
 
 		end_text = "|end|(16:00)"
-		processed_text = self.start_end_preprocessor.run([self.base_text.format(end_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(end_text)])[0]
 		self.assertIn("*End of meeting: 16:00*", processed_text)
 
 	def test_break_preprocessor(self):
 		break_text = "|break|(15:15)(15:20)"
-		processed_text = self.break_preprocessor.run([self.base_text.format(break_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(break_text)])[0]
 		self.assertIn("*Meeting break: 15:15 – 15:20*", processed_text)
 
 	def test_quorum_preprocessor(self):
 		enough_quorum_text = "|quorum|(6/7)"
-		processed_text = self.quorum_preprocessor.run([self.base_text.format(enough_quorum_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(enough_quorum_text)])[0]
 		self.assertIn("*6/7 present → quorate*", processed_text)
 
 		not_enough_quorum_text = "|quorum|(3/7)"
-		processed_text = self.quorum_preprocessor.run([self.base_text.format(not_enough_quorum_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(not_enough_quorum_text)])[0]
 		self.assertIn("*3/7 present → not quorate*", processed_text)
 
 	def test_enter_leave_preprocessor(self):
 		enter_text_without_mean = "|enter|(14:30)(User)"
-		processed_text = self.enter_leave_preprocessor.run([self.base_text.format(enter_text_without_mean)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(enter_text_without_mean)])[0]
 		self.assertIn("*14:30: User enters the meeting*", processed_text)
 		self.assertNotIn("via", processed_text)
 
 		enter_text_with_mean = enter_text_without_mean + "(Hangout)"
-		processed_text = self.enter_leave_preprocessor.run([self.base_text.format(enter_text_with_mean)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(enter_text_with_mean)])[0]
 		self.assertIn("*14:30: User enters the meeting via Hangout*", processed_text)
 
 		leave_text = "|leave|(15:30)(User)"
-		processed_text = self.enter_leave_preprocessor.run([self.base_text.format(leave_text)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(leave_text)])[0]
 		self.assertIn("*15:30: User leaves the meeting*", processed_text)
 
 		leave_text_with_space = "|leave|(15:30)(User with Spaces)"
-		processed_text = self.enter_leave_preprocessor.run([self.base_text.format(leave_text_with_space)])[0]
+		processed_text = self.preprocessor.run([self.base_text.format(leave_text_with_space)])[0]
 		self.assertIn("*15:30: User with Spaces leaves the meeting*", processed_text)
+
+	def test_multiple_syntaxes_in_one_line(self):
+		text = "|start|(15:00) [1|2|3] |quorum|(3/7) |leave|(15:30)(User) [a|b|c]"
+		processed_text = self.preprocessor.run([text])[0]
+		self.assertEqual(
+			processed_text,
+			"*Begin of meeting: 15:00*   **[1|2|3]** *3/7 present → not quorate*   *15:30: User leaves the meeting*   [a|b|c]"
+		)
+
+	def test_output_equals_the_former_preprocessors(self):
+		lines = [
+			"|start|(15:00) [1|2|3] |quorum|(3/7) |leave|(15:30)(User) [a|b|c]",
+			"|enter|(18:00)(Jane)(call [1|2|3])",
+			"|enter|(18:00)(Jane)(call |start|(18:00))",
+			"|enter|(18:00)(Jane)(video |leave|(19:00)(Bob))",
+			"|enter|(18:00)(Jane)(|quorum|(3/7)) |enter|(18:05)(Bob)(|break|(18:10)(18:20))",
+			"|enter|(18:00)(Jane)(phone) |leave|(19:00)(Jane) |end|(19:30)",
+			"|enter|(18:00)(Jane, Bob) ([4|0|1]) |enter|(18:00)(Jane)()",
+			"[[1|2|3]|4|5] [1|[2|3|4]|5] |start|(|end|(10:00))",
+			"|quorum|(|quorum|(1/2)/3) |break|(10:00)(|start|(10:15))",
+			"",
+			"| Topic | Vote |",
+			"| ----- | ---- |",
+			"| Budget | [5|0|0] |",
+			"| |enter|(10:00)(Jane)(a | b) | |leave|(11:00)(Jane) |",
+		]
+		text = "\n".join(lines)
+
+		reference_md = markdown.Markdown(extensions=['_1327.minutes.markdown_minutes_reference', 'tables'])
+		md = markdown.Markdown(extensions=['_1327.minutes.markdown_minutes_extensions', 'tables'])
+		self.assertEqual(md.convert(text), reference_md.convert(text))
+		for line in lines:
+			reference_lines = [line]
+			for name in PREPROCESSOR_NAMES:
+				reference_lines = reference_md.preprocessors[name].run(reference_lines)
+			self.assertEqual(self.preprocessor.run([line]), reference_lines)
+
+	def test_lines_without_syntax_are_unchanged(self):
+		lines = ["", "   ", "Some text", "| a | table |"]
+		self.assertEqual(self.preprocessor.run(lines), lines)
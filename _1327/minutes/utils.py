@@ -1,15 +1,31 @@
-from guardian.core import ObjectPermissionChecker
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import CharField, Exists, OuterRef
+from django.db.models.functions import Cast
+from guardian.models import GroupObjectPermission
 
 from _1327.minutes.models import MinutesDocument
 
 
-def get_last_minutes_document_for_group(group):
-	minutes = MinutesDocument.objects.all().order_by('-date')
-	group_checker = ObjectPermissionChecker(group)
-	group_checker.prefetch_perms(minutes)
+def object_permissions(permission_model, codename, **filters):
+	"""
+		Returns the object permissions of guardian's user or group permission model for the minutes of the outer query,
+		to be used in an Exists subquery.
+	"""
+	return permission_model.objects.filter(
+		content_type=ContentType.objects.get_for_model(MinutesDocument),
+		permission__codename=codename,
+		object_pk=Cast(OuterRef('pk'), CharField()),
+		**filters,
+	)
+
 
-	for m in minutes:
-		if group_checker.has_perm(m.edit_permission_name, m):
-			return m
+def filter_minutes_of_group(minutes, group):
+	# the minutes of a group are the minutes the group has edit permissions for
+	codename = 'change_{}'.format(ContentType.objects.get_for_model(MinutesDocument).model)
+	return minutes.annotate(
+		group_can_edit=Exists(object_permissions(GroupObjectPermission, codename, group=group)),
+	).filter(group_can_edit=True)
 
-	return None
+
+def get_last_minutes_document_for_group(group):
+	return filter_minutes_of_group(MinutesDocument.objects.all(), group).order_by('-date').first()
@@ -2,15 +2,21 @@ import re
 
 from django.contrib.auth.models import Group
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
+from django.db.models import Exists, Q
 from django.shortcuts import Http404, redirect, render
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import get_language
-from guardian.core import ObjectPermissionChecker
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from guardian.utils import get_anonymous_user
 
+from _1327.documents.models import RENDERED_TEXT_FIELDS
 from _1327.minutes.forms import SearchForm
 from _1327.minutes.models import MinutesDocument
+from _1327.minutes.utils import filter_minutes_of_group, object_permissions
+
+
+MINUTES_TEXT_FIELDS = ('text_de', 'text_en') + RENDERED_TEXT_FIELDS
 
 
 def get_permitted_minutes(minutes, request, groupid):
@@ -22,32 +28,28 @@ def get_permitted_minutes(minutes, request, groupid):
 
 	own_group = request.user.is_superuser or group in request.user.groups.all()
 
-	# Prefetch group permissions
-	group_checker = ObjectPermissionChecker(group)
-	group_checker.prefetch_perms(minutes)
+	# we show all documents for which the requested group has edit permissions
+	# e.g. if you request FSR minutes, all minutes for which the FSR group has edit rights will be shown
+	minutes = filter_minutes_of_group(minutes, group)
 
-	# Prefetch user permissions
-	user_checker = ObjectPermissionChecker(request.user)
-	user_checker.prefetch_perms(minutes)
+	# we only show documents for which the user or the group of the user's ip range has view permissions,
+	# like guardian the anonymous user is used for users that are not logged in
+	user = get_anonymous_user() if request.user.is_anonymous else request.user
+	if user.is_active and user.is_superuser:
+		return minutes, own_group
 
-	# Prefetch ip group permissions
+	codename = MinutesDocument.get_view_permission().split('.')[1]
 	ip_range_group_name = request.user._ip_range_group_name if hasattr(request.user, '_ip_range_group_name') else None
-	if ip_range_group_name:
-		ip_range_group = Group.objects.get(name=ip_range_group_name)
-		ip_range_group_checker = ObjectPermissionChecker(ip_range_group)
-
-	permitted_minutes = []
-	for m in minutes:
-		# we show all documents for which the requested group has edit permissions
-		# e.g. if you request FSR minutes, all minutes for which the FSR group has edit rights will be shown
-		if not group_checker.has_perm(m.edit_permission_name, m):
-			continue
-		# we only show documents for which the user has view permissions
-		if not user_checker.has_perm(MinutesDocument.get_view_permission(), m) and (not ip_range_group_name or not ip_range_group_checker.has_perm(MinutesDocument.get_view_permission(), m)):
-			continue
-		permitted_minutes.append(m)
+	view_groups = Q(name=ip_range_group_name) if ip_range_group_name else Q(pk__in=[])
+	view_conditions = Q(group_can_view=True)
+	annotations = {}
+	if user.is_active:
+		view_groups |= Q(user=user)
+		annotations['user_can_view'] = Exists(object_permissions(UserObjectPermission, codename, user=user))
+		view_conditions |= Q(user_can_view=True)
+	annotations['group_can_view'] = Exists(object_permissions(GroupObjectPermission, codename, group__in=Group.objects.filter(view_groups)))
 
-	return permitted_minutes, own_group
+	return minutes.annotate(**annotations).filter(view_conditions), own_group
 
 
 def search(request, groupid):
@@ -60,7 +62,7 @@ def search(request, groupid):
 		return redirect("minutes:list", groupid=groupid)
 
 	# filter for documents that contain the searched for string
-	minutes = MinutesDocument.objects.filter(Q(text_de__icontains=search_text) | Q(text_en__icontains=search_text)).prefetch_related('labels').order_by('-date')
+	minutes = MinutesDocument.objects.filter(Q(text_de__icontains=search_text) | Q(text_en__icontains=search_text)).prefetch_related('labels', 'attachments').order_by('-date')
 
 	# only show permitted documents
 	minutes, own_group = get_permitted_minutes(minutes, request, groupid)
@@ -106,7 +108,8 @@ def search(request, groupid):
 
 
 def list(request, groupid):
-	minutes = MinutesDocument.objects.all().prefetch_related('labels').order_by('-date')
+	# the list only shows titles, so the texts of the minutes are not loaded
+	minutes = MinutesDocument.objects.all().defer(*MINUTES_TEXT_FIELDS).prefetch_related('labels', 'attachments').order_by('-date')
 	minutes, own_group = get_permitted_minutes(minutes, request, groupid)
 
 	result = {}
@@ -47,11 +47,11 @@ class Poll(Document):
 
 	class LinkPattern(InternalLinkPattern):
 
-		def url(self, id):
-			poll = Poll.objects.get(id=id)
-			if poll:
-				return reverse(poll.get_view_url_name(), args=[poll.id])
-			return ''
+		def urls_for_ids(self, ids):
+			return {
+				id: reverse(Poll.get_view_url_name(), args=[id])
+				for id in Poll.objects.filter(id__in=ids).values_list('id', flat=True)
+			}
 
 	@classmethod
 	def generate_new_title(cls):
@@ -83,7 +83,8 @@ class Poll(Document):
 	def get_edit_url(self):
 		return reverse(self.get_edit_url_name(), args=(self.url_title,))
 
-	def get_view_url_name(self):
+	@classmethod
+	def get_view_url_name(cls):
 		return 'polls:view'
 
 	def get_edit_url_name(self):
@@ -1,9 +1,10 @@
 import datetime
 
 from django.contrib.auth.models import Group
-from django.db import transaction
+from django.db import connection, transaction
 from django.template.defaultfilters import floatformat
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_webtest import WebTest
 from guardian.shortcuts import assign_perm, get_perms
@@ -112,6 +113,33 @@ class PollViewTests(WebTest):
 		self.assertIn(b"There are no polls you can vote for.", response.body)
 		self.assertIn(b"There are no results you can see.", response.body)
 
+	def test_index_queries_do_not_depend_on_number_of_polls(self):
+		user = baker.make(UserProfile)
+		user.groups.add(self.group)
+
+		def count_index_queries():
+			with CaptureQueriesContext(connection) as context:
+				response = self.app.get(reverse('polls:index'), user=user)
+			self.assertEqual(response.status_code, 200)
+			return len(context.captured_queries)
+
+		count_index_queries()
+		num_queries = count_index_queries()
+
+		today = datetime.date.today()
+		for start_date, end_date in [(today, today), (today - datetime.timedelta(days=5), today - datetime.timedelta(days=1)), (today + datetime.timedelta(days=1), today + datetime.timedelta(days=2))]:
+			for poll in baker.make(Poll, start_date=start_date, end_date=end_date, _quantity=4):
+				poll.set_all_permissions(self.group)
+				assign_perm(poll.vote_permission_name, self.group, poll)
+				poll.participants.add(baker.make(UserProfile))
+		self.poll.participants.add(user)
+
+		self.assertEqual(count_index_queries(), num_queries)
+		response = self.app.get(reverse('polls:index'), user=user)
+		self.assertEqual(len(response.context['running_polls']), 4)
+		self.assertEqual(len(response.context['finished_polls']), 5)
+		self.assertEqual(len(response.context['upcoming_polls']), 4)
+
 	def test_create_poll(self):
 		response = self.app.get(reverse('documents:create', args=['poll']), user=self.user)
 		self.assertEqual(response.status_code, 200)
@@ -3,7 +3,7 @@ import datetime
 
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
-from django.db.models import F
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Value, When
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
@@ -12,24 +12,39 @@ from django.utils.translation import ugettext_lazy as _
 from _1327.documents.models import Document
 from _1327.main.utils import convert_markdown, document_permission_overview
 from _1327.polls.models import Poll
-from _1327.user_management.shortcuts import check_permissions
+from _1327.user_management.shortcuts import check_permissions, prefetched_object_permissions
+
+
+POLL_UPCOMING, POLL_RUNNING, POLL_FINISHED = range(3)
 
 
 def index(request):
 	running_polls = []
 	finished_polls = []
 	upcoming_polls = []
+	today = datetime.date.today()
+	polls = Poll.objects.annotate(
+		participated=Exists(Poll.participants.through.objects.filter(poll=OuterRef('pk'), userprofile=request.user.pk)),
+		phase=Case(
+			When(start_date__gt=today, then=Value(POLL_UPCOMING)),
+			When(end_date__gte=today, then=Value(POLL_RUNNING)),
+			default=Value(POLL_FINISHED),
+			output_field=IntegerField(),
+		),
+	).order_by('-end_date')
+	has_perm = prefetched_object_permissions(request.user, polls)
+	view_permission, vote_permission = Poll.get_view_permission(), Poll.get_vote_permission()
 	# do not show polls that a user is not allowed to see
-	for poll in Poll.objects.all().order_by('-end_date'):
-		if request.user.has_perm(Poll.get_view_permission(), obj=poll) and poll.start_date <= datetime.date.today():
-			if datetime.date.today() <= poll.end_date \
-						and not poll.participants.filter(id=request.user.pk).exists() \
-						and request.user.has_perm(Poll.get_vote_permission(), poll):
+	for poll in polls:
+		poll.can_change = has_perm("polls.change_poll", poll)
+		if poll.phase == POLL_UPCOMING:
+			if poll.can_change:
+				upcoming_polls.append(poll)
+		elif has_perm(view_permission, poll):
+			if poll.phase == POLL_RUNNING and not poll.participated and has_perm(vote_permission, poll):
 				running_polls.append(poll)
 			else:
 				finished_polls.append(poll)
-		elif request.user.has_perm("polls.change_poll", obj=poll) and poll.start_date > datetime.date.today():
-			upcoming_polls.append(poll)
 
 	return render(
 		request,
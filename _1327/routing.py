@@ -3,11 +3,12 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.conf import settings
 from django.urls import path
 
-from _1327.documents.consumers import PreviewConsumer
+from _1327.documents.consumers import EditorConsumer, PreviewConsumer
 
 
 websocket_urlpatterns = [
 	path("{preview_url}/<hash_value>".format(preview_url=settings.PREVIEW_URL.lstrip('/')), PreviewConsumer),
+	path("{editor_url}/<hash_value>".format(editor_url=settings.EDITOR_URL.lstrip('/')), EditorConsumer),
 ]
 
 
@@ -63,7 +63,7 @@ UNIVERSITY_GROUP_NAME = "University Network"
 DEFAULT_USER_GROUP_NAME = ""  # if a name is set, all new users are automatically added to this group
 
 # Anonymous users in one of the given IP ranges are automatically assumed to be in the associated group.
-# Only the first match will be used.
+# If ranges overlap, the most specific range containing the address is used.
 ANONYMOUS_IP_RANGE_GROUPS = {
 	# Example: '127.0.0.0/8': UNIVERSITY_GROUP_NAME,
 }
@@ -170,6 +170,30 @@ CHANNEL_LAYERS = {
 	},
 }
 PREVIEW_URL = '/ws/preview'
+EDITOR_URL = '/ws/editor'
+# number of threads per process rendering the texts sent by editors
+PREVIEW_RENDER_THREADS = 4
+# minimum number of seconds between two previews sent to a client, previews arriving meanwhile are combined
+PREVIEW_INTERVAL = 0.5
+
+# Rendered markdown is cached by text, language, the state of abbreviations and the targets of its internal links.
+# 'locmem' keeps the MARKDOWN_CACHE_MAX_ENTRIES most recently used texts per process, any other value is used as
+# the alias of a cache in CACHES. The state of abbreviations is tracked in the default cache, so deployments with
+# multiple processes need a shared default cache for changes to become visible in every process.
+# The live preview caches every block of a text separately. Long minutes have a few hundred blocks and a block
+# renders to about a kilobyte of html, so 5000 entries keep the blocks of several edited documents next to the
+# rendered pages at a cost of a few megabytes per process.
+MARKDOWN_CACHE_BACKEND = 'locmem'
+MARKDOWN_CACHE_MAX_ENTRIES = 5000
+
+# Versions of documents with a REVISION_SNAPSHOT_INTERVAL are stored as deltas in this format.
+SERIALIZATION_MODULES = {
+	'delta_json': '_1327.documents.delta_serializer',
+}
+
+# The versions page loads this many revisions at once and shows this many unchanged lines around each change of a diff.
+VERSIONS_PAGE_SIZE = 50
+VERSIONS_DIFF_CONTEXT_LINES = 3
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 EMAIL_HOST = ''
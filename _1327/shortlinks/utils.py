@@ -1,6 +1,6 @@
 from django.template import loader
-from guardian.shortcuts import get_objects_for_user
 
+from _1327.documents.utils import get_objects_for_user
 from _1327.information_pages.models import InformationDocument
 from _1327.minutes.models import MinutesDocument
 from _1327.polls.models import Poll
@@ -30,19 +30,29 @@ class _1327AuthorizationBackend:
 		if app != content_type.app_label:
 			return False
 
-		group_name = user_obj._ip_range_group_name if hasattr(user_obj, '_ip_range_group_name') else None
-
-		if user_obj.is_authenticated:
-			# user is not anonymous user and no other backend confirmed the permission yet
-			# --> we need to check the anonymous permissions again
-			check = ObjectPermissionChecker(get_anonymous_user())
-			if check.has_perm(perm, obj):
-				return True
-		if group_name:
-			group = Group.objects.get(name=group_name)
-			check = ObjectPermissionChecker(group)
-			return check.has_perm(perm, obj)
-		return False
+		# an authenticated user also has the permissions of the anonymous user, and an anonymous user in one of the
+		# configured IP ranges has the permissions of the group of that range
+		return any(checker.has_perm(perm, obj) for checker in get_permission_checkers(user_obj))
+
+
+def get_permission_checkers(user_obj):
+	"""
+		Returns the permission checkers for the permissions a user has in addition to the own ones. They are kept on the
+		user object, which only lives for a single request, so that the group of the IP range is loaded and the
+		permissions of every object are fetched at most once per request.
+	"""
+	group_name = user_obj._ip_range_group_name if hasattr(user_obj, '_ip_range_group_name') else None
+	cached_group_name, checkers = getattr(user_obj, '_permission_checkers', (None, None))
+	if checkers is not None and cached_group_name == group_name:
+		return checkers
+
+	checkers = []
+	if user_obj.is_authenticated:
+		checkers.append(ObjectPermissionChecker(get_anonymous_user()))
+	if group_name:
+		checkers.append(ObjectPermissionChecker(Group.objects.get(name=group_name)))
+	user_obj._permission_checkers = (group_name, checkers)
+	return checkers
 
 
 @receiver(user_logged_in)
@@ -0,0 +1,72 @@
+from ipaddress import ip_address, ip_network
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from _1327.user_management.middleware import IPRangeMatcher
+
+
+def generate_ip_range_groups(num_ranges):
+	# subnets of different sizes, some of them nested in others, like the ranges published by a university
+	random_generator = random.Random(num_ranges)
+	ip_range_groups = {}
+	while len(ip_range_groups) < num_ranges:
+		if random_generator.random() < 0.9:
+			network = ip_network((random_generator.getrandbits(32), random_generator.choice([8, 16, 20, 24, 28, 32])), strict=False)
+		else:
+			network = ip_network((random_generator.getrandbits(128), random_generator.choice([32, 48, 64])), strict=False)
+		ip_range_groups[str(network)] = 'Group {}'.format(len(ip_range_groups) % 10)
+	return ip_range_groups
+
+
+def generate_addresses(ip_range_groups, num_addresses):
+	# most requests come from a few addresses, half of them in one of the ranges
+	random_generator = random.Random(num_addresses)
+	networks = [ip_network(ip_range) for ip_range in ip_range_groups]
+	distinct_addresses = []
+	for __ in range(max(1, num_addresses // 10)):
+		if random_generator.random() < 0.5:
+			network = random_generator.choice(networks)
+			distinct_addresses.append(str(network.network_address + random_generator.randrange(network.num_addresses)))
+		else:
+			distinct_addresses.append(str(ip_address(random_generator.getrandbits(32))))
+	return [random_generator.choice(distinct_addresses) for __ in range(num_addresses)]
+
+
+def find_group_linearly(ip_ranges, address):
+	# the former approach of the middleware, checking the ranges in the order of the settings
+	address = ip_address(address)
+	for ip_range, group_name in ip_ranges.items():
+		if address in ip_range:
+			return group_name
+	return None
+
+
+class Command(BaseCommand):
+	args = ''
+	help = 'Measures the lookup of the group of the IP range of anonymous users for many ranges'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--ranges', type=int, nargs='+', default=[10, 1000, 5000], help='Number of configured IP ranges')
+		parser.add_argument('--lookups', type=int, default=2000, help='Number of looked up addresses per measurement')
+
+	def handle(self, *args, **options):
+		for num_ranges in options['ranges']:
+			ip_range_groups = generate_ip_range_groups(num_ranges)
+			addresses = generate_addresses(ip_range_groups, options['lookups'])
+			ip_ranges = {ip_network(ip_range): group_name for ip_range, group_name in ip_range_groups.items()}
+
+			build_seconds = timeit.timeit(lambda: IPRangeMatcher(ip_range_groups), number=1)
+			matcher = IPRangeMatcher(ip_range_groups, cache_size=0)
+			cached_matcher = IPRangeMatcher(ip_range_groups)
+			measurements = [
+				('linear scan', lambda: [find_group_linearly(ip_ranges, address) for address in addresses]),
+				('interval search', lambda: [matcher.match(address) for address in addresses]),
+				('interval search, cached', lambda: [cached_matcher.match(address) for address in addresses]),
+			]
+
+			self.stdout.write('{} ranges, building the matcher took {:.3f} ms'.format(num_ranges, build_seconds * 1000))
+			for name, function in measurements:
+				microseconds = timeit.timeit(function, number=1) * 1000000 / len(addresses)
+				self.stdout.write('    {:<36}{:>10.3f} µs per lookup'.format(name, microseconds))
@@ -1,3 +1,5 @@
+from bisect import bisect_right
+from functools import lru_cache
 from ipaddress import ip_address, ip_network
 from urllib.parse import urlparse
 
@@ -7,12 +9,67 @@ from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.shortcuts import resolve_url
 
 
+class IPRangeMatcher:
+	"""
+		Finds the group of the most specific IP range containing an address. The ranges of each IP version are flattened
+		into sorted, disjoint intervals of integers, so that a lookup is a binary search instead of a scan of all ranges.
+	"""
+
+	def __init__(self, ip_range_groups, cache_size=1024):
+		self.intervals = {4: ([], [], []), 6: ([], [], [])}
+		networks = sorted(
+			((ip_network(ip_range), group) for ip_range, group in ip_range_groups.items()),
+			key=lambda item: (item[0].version, int(item[0].network_address), -item[0].num_addresses),
+		)
+		for version in self.intervals:
+			self.add_intervals(version, [
+				(int(network.network_address), int(network.broadcast_address), group)
+				for network, group in networks if network.version == version
+			])
+		self.match = lru_cache(maxsize=cache_size)(self.find_group)
+
+	def add_intervals(self, version, networks):
+		starts, ends, groups = self.intervals[version]
+		# the networks are sorted by start and enclosing networks come first, so the ones containing the current
+		# position are a stack and the top of the stack is the most specific one
+		enclosing = []
+		position = 0
+
+		def close_networks(until):
+			nonlocal position
+			while enclosing and enclosing[-1][0] < until:
+				end, group = enclosing.pop()
+				if position <= end:
+					starts.append(position)
+					ends.append(end)
+					groups.append(group)
+					position = end + 1
+
+		for start, end, group in networks:
+			close_networks(start)
+			if enclosing and position < start:
+				starts.append(position)
+				ends.append(start - 1)
+				groups.append(enclosing[-1][1])
+			enclosing.append((end, group))
+			position = start
+		close_networks(float('inf'))
+
+	def find_group(self, address):
+		address = ip_address(address)
+		starts, ends, groups = self.intervals[address.version]
+		index = bisect_right(starts, int(address)) - 1
+		if index >= 0 and int(address) <= ends[index]:
+			return groups[index]
+		return None
+
+
 class IPRangeUserMiddleware:
 
 	def __init__(self, get_response):
 		self.get_response = get_response
 		try:
-			self.ip_ranges = {ip_network(k): v for k, v in settings.ANONYMOUS_IP_RANGE_GROUPS.items()}
+			self.ip_range_matcher = IPRangeMatcher(settings.ANONYMOUS_IP_RANGE_GROUPS)
 		except ValueError as e:
 			raise ImproperlyConfigured from e
 
@@ -23,12 +80,10 @@ class IPRangeUserMiddleware:
 
 	def process_request(self, request):
 		if request.user.is_anonymous:
-			address = ip_address(request.META.get('REMOTE_ADDR'))
-			for ip_range, group_name in self.ip_ranges.items():
-				if address in ip_range:
-					# user is in this IP range
-					request.user._ip_range_group_name = group_name
-					break
+			group_name = self.ip_range_matcher.match(request.META.get('REMOTE_ADDR'))
+			if group_name is not None:
+				# user is in this IP range
+				request.user._ip_range_group_name = group_name
 
 
 class LoginRedirectMiddleware:
@@ -1,4 +1,8 @@
 from django.core.exceptions import PermissionDenied
+from guardian.core import ObjectPermissionChecker
+from guardian.utils import get_anonymous_user
+
+from _1327.user_management.authentication import get_permission_checkers
 
 
 def check_permissions(obj, user, permissions):
@@ -14,3 +18,19 @@ def check_permissions(obj, user, permissions):
 		# check for object level permission
 		if not user.has_perm(permission, obj):
 			raise PermissionDenied
+
+
+def prefetched_object_permissions(user, objects):
+	"""
+		returns a function that checks object permissions of the user like user.has_perm(permission, obj), with the
+		permissions of all given objects fetched at once instead of once per object and permission
+	"""
+	objects = list(objects)
+	checkers = [ObjectPermissionChecker(user if user.is_authenticated else get_anonymous_user())] + get_permission_checkers(user)
+	if objects:
+		for checker in checkers:
+			checker.prefetch_perms(objects)
+
+	def has_perm(permission, obj):
+		return any(checker.has_perm(permission, obj) for checker in checkers)
+	return has_perm
@@ -1,5 +1,9 @@
+from io import StringIO
+
 from django.conf import settings
-from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.management import call_command
+from django.test import TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
 
@@ -9,6 +13,8 @@ from guardian.utils import get_anonymous_user
 from model_bakery import baker
 
 from _1327.information_pages.models import InformationDocument
+from _1327.user_management.authentication import _1327AuthorizationBackend
+from _1327.user_management.middleware import IPRangeMatcher
 from .models import UserProfile
 
 
@@ -277,6 +283,50 @@ class _1327AuthenticationBackendUniversityNetworkTests(WebTest):
 		redirect_url = reverse('login') + '?next=' + reverse(self.document.get_view_url_name(), args=[self.document.url_title])
 		self.assertRedirects(response, redirect_url)
 
+	def test_permission_checkers_are_kept_on_the_user(self):
+		documents = [self.document, baker.make(InformationDocument)]
+		assign_perm(documents[1].view_permission_name, self.university_group, documents[1])
+		user = AnonymousUser()
+		user._ip_range_group_name = self.university_group.name
+
+		self.assertTrue(_1327AuthorizationBackend().has_perm(user, documents[1].view_permission_name, documents[1]))
+		# the group and the permissions of a document are only fetched once per user
+		with self.assertNumQueries(0):
+			self.assertTrue(_1327AuthorizationBackend().has_perm(user, documents[1].view_permission_name, documents[1]))
+			self.assertFalse(_1327AuthorizationBackend().has_perm(user, documents[1].edit_permission_name, documents[1]))
+
+
+class IPRangeMatcherTests(TestCase):
+
+	def test_most_specific_range_is_used(self):
+		matcher = IPRangeMatcher({
+			'10.0.0.0/8': 'network',
+			'10.1.0.0/16': 'institute',
+			'10.1.2.0/24': 'office',
+			'10.2.0.0/16': 'dormitory',
+			'2001:db8::/32': 'network',
+			'2001:db8:1::/48': 'institute',
+		})
+		self.assertEqual(matcher.match('10.0.0.1'), 'network')
+		self.assertEqual(matcher.match('10.1.0.1'), 'institute')
+		self.assertEqual(matcher.match('10.1.2.255'), 'office')
+		self.assertEqual(matcher.match('10.1.3.0'), 'institute')
+		self.assertEqual(matcher.match('10.2.255.255'), 'dormitory')
+		self.assertEqual(matcher.match('10.255.255.255'), 'network')
+		self.assertIsNone(matcher.match('11.0.0.0'))
+		self.assertEqual(matcher.match('2001:db8:1::1'), 'institute')
+		self.assertEqual(matcher.match('2001:db8:2::1'), 'network')
+		self.assertIsNone(matcher.match('::1'))
+
+	def test_invalid_ranges_are_rejected(self):
+		with self.assertRaises(ValueError):
+			IPRangeMatcher({'10.0.0.1/8': 'network'})
+
+	def test_benchmark_command(self):
+		stdout = StringIO()
+		call_command('benchmark_ip_ranges', ranges=[20], lookups=10, stdout=stdout)
+		self.assertIn('20 ranges', stdout.getvalue())
+
 
 class GroupEditFormTests(WebTest):
 
@@ -35,6 +35,9 @@ sudo -H -u vagrant pip3 install --user psycopg2==2.7.3.1
 cp /vagrant/deployment/localsettings.template.py /vagrant/_1327/localsettings.py
 sed -i -e "s/\${SECRET_KEY}/`sudo head /dev/urandom | tr -dc A-Za-z0-9 | head -c 32`/" /vagrant/_1327/localsettings.py
 
+# install the periodic tasks
+sed -e "s|\${PROJECT_DIR}|/vagrant|" /vagrant/deployment/crontab.template | crontab -u vagrant -
+
 # setup redis
 cd /vagrant/deployment/redis
 sh init_redis.sh